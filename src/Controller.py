@@ -99,6 +99,9 @@ class controller:
                 self.imuResetFlag = False
                 self.Dir = 1
 
+                # Make the first control pass look at the section
+                self.sectionSeq = -1
+
                 # Set inital states
                 self.state = self.S1_CONTROL
                 self.section = self.SC1
@@ -117,16 +120,19 @@ class controller:
         if (self.state == self.S1_CONTROL):
             # If disabled
             if (self.enable.get() == 0):
-                self.rVelShare.put(0)
-                self.lVelShare.put(0)
+                self.velShare.put(0, 0)
                 self.sensor.disable()
                 self.state = self.S0_INIT
                 return
-            elif(self.sectionShare.get() == 2):
-                self.ignoreLine = False
-                self.searchThickness = -1 # No search thickness
-            elif(self.sectionShare.get() == 3):
-                self.searchThickness = 2 # Search for no line
+            # The section is only looked at when Tracker has written it again
+            elif(self.sectionShare.changed_since(self.sectionSeq)):
+                self.sectionSeq = self.sectionShare.seq
+                section = self.sectionShare.get()
+                if(section == 2):
+                    self.ignoreLine = False
+                    self.searchThickness = -1 # No search thickness
+                elif(section == 3):
+                    self.searchThickness = 2 # Search for no line
 
             if (not self.ignoreLine):
                 error = self.centerPos - self.centroidPos
@@ -140,11 +146,9 @@ class controller:
                 if (self.velL < -self.maxVel): self.velL = -self.maxVel
                 if (self.velL > self.maxVel): self.velL = self.maxVel
 
-                self.rVelShare.put(self.velR)
-                self.lVelShare.put(self.velL)
+                self.velShare.put(self.velL, self.velR)
             else:
-                self.rVelShare.put(self.defaultVel - 1)
-                self.lVelShare.put(self.defaultVel + 1)
+                self.velShare.put(self.defaultVel + 1, self.defaultVel - 1)
 
             self.state = self.S2_SENSE
 
@@ -176,6 +180,7 @@ class controller:
     # - Reset to \ref _S0
     def _SC2(self):
         if (self.state == self.S1_CONTROL):
+            section = self.sectionShare.get()
             if (self.enable.get() == 0 and not self.turn2Flag):
                 self.sectionShare.put(-3)
                 self.targetHeading -= 1440
@@ -185,27 +190,26 @@ class controller:
                 self.Dir = -1 # Reverse Romi
                 self.enable.put(1)
 
-            elif(self.sectionShare.get() == 4 and not self.turn1Flag):
+            elif(section == 4 and not self.turn1Flag):
                 self.targetHeading += 1440
                 self.targetHeading -= 5760 if self.targetHeading > 5760 else 0
                 self.turn1Flag = True
                 self.imuResetFlag = False
 
-            elif(self.sectionShare.get() == 6 and not self.wallTurn1Flag):
+            elif(section == 6 and not self.wallTurn1Flag):
                 self.targetHeading -= 1440
                 self.targetHeading += 5760 if self.targetHeading < 0 else 0
                 self.wallTurn1Flag = True
                 self.imuResetFlag = False
 
-            elif(self.sectionShare.get() == 7 and not self.wallTurn2Flag):
+            elif(section == 7 and not self.wallTurn2Flag):
                 self.targetHeading -= 1440
                 self.targetHeading += 5760 if self.targetHeading < 0 else 0
                 self.wallTurn2Flag = True
                 self.imuResetFlag = False
 
-            elif(self.sectionShare.get() == 8 ):
-                self.rVelShare.put(0)
-                self.lVelShare.put(0)
+            elif(section == 8 ):
+                self.velShare.put(0, 0)
                 self.state = self.S0_INIT
                 return
 
@@ -236,8 +240,7 @@ class controller:
             if (velL < -self.maxVel): velL = -self.maxVel
             if (velL > self.maxVel): velL = self.maxVel
 
-            self.rVelShare.put(velR)
-            self.lVelShare.put(velL)
+            self.velShare.put(velL, velR)
             self.state = self.S2_SENSE
 
         elif (self.state == self.S2_SENSE):
@@ -247,10 +250,11 @@ class controller:
     ## Defines the task for Controller.
     # This generator function defines the task for the controller, is starts in an Initialization state before alternating
     # between sensing and controlling states. What each state does is dependent on what section Romi is in (\ref _SC1 or \ref _SC2)
-    # @param shares A tuple of shares (enable, lVelShare, rVelShare, sectionShare)
+    # @param shares A tuple of shares (enable, velShare, sectionShare), where velShare is a record of the
+    # left and right velocities
     def task(self, shares):
 
-        self.enable, self.lVelShare, self.rVelShare, self.sectionShare = shares
+        self.enable, self.velShare, self.sectionShare = shares
 
         #Declaring States, categorized by section functions
         self.S0_INIT = 0
@@ -0,0 +1,131 @@
+## @file DriveTrain.py
+# This file contains the actuation layer which drives both of Romi's motors together.
+
+from pyb import Pin, Timer
+import array
+
+import Motor
+
+## Drives both of Romi's motors from their shared PWM timer.
+# This class owns the timer used by both motors and a Motor object for each wheel. Both wheels' efforts are
+# applied back to back in one call, so that one wheel doesn't lag the other by a scheduler slot. The change in
+# each wheel's effort per call can be limited, and efforts are turned into pulse widths with a table made when the
+# object is created rather than by pulse_width_percent() on every call.
+# @b Example:
+# @code
+# # Create the drive train, letting each wheel's effort change by at most 20% per call
+# drive = DriveTrain(slew=20)
+# # Enable both motors
+# drive.enable()
+# # Set the left and right efforts
+# drive.set_efforts(50, -50)
+# # Disable both motors
+# drive.disable()
+# @endcode
+class DriveTrain:
+
+    ## Initializes the drive train.
+    # This function configures the PWM timer and creates the motor objects for both wheels.
+    # @param slew The largest change in each wheel's effort per call to set_efforts() [%], or None for no limit
+    # @param freq The PWM frequency [Hz]
+    def __init__(self, slew=None, freq=50*100000):
+        self.tim = Timer(2, freq=freq)
+
+        ## The right motor
+        self.right = Motor.Motor((self.tim, 1, Pin.board.PA15), Pin.board.PH0, Pin.board.PH1)
+
+        ## The left motor
+        self.left = Motor.Motor((self.tim, 3, Pin.board.PB10), Pin.board.PB3, Pin.board.PA10)
+
+        ## The largest change in each wheel's effort per call [%]
+        self.slew = slew
+
+        # Pulse widths in timer counts for each whole percent of effort from 0 to 100
+        top = self.tim.period() + 1
+        self._pulses = array.array('L', [(effort * top + 50) // 100 for effort in range(101)])
+
+        ## The left effort most recently applied, after slew limiting [%]
+        self.effortL = 0
+
+        ## The right effort most recently applied, after slew limiting [%]
+        self.effortR = 0
+
+        # The efforts most recently written to the pins, rounded to whole percents, so that unchanged ones aren't
+        # written again
+        self._stepL = 0
+        self._stepR = 0
+
+    ## Limits an effort to +/-100% and to within slew of the effort applied last time.
+    # @param effort The effort wanted [%]
+    # @param current The effort applied last time [%]
+    def _limit(self, effort, current):
+        if effort > 100:
+            effort = 100
+        elif effort < -100:
+            effort = -100
+        slew = self.slew
+        if slew is not None:
+            if effort > current + slew:
+                return current + slew
+            if effort < current - slew:
+                return current - slew
+        return effort
+
+    ## Sets the efforts of both wheels.
+    # Each effort is limited by the slew rate, then the directions and pulse widths of both motors are written one
+    # after the other. Motors whose rounded effort hasn't changed aren't written.
+    # @param left The left effort, a float between -100 and 100
+    # @param right The right effort, a float between -100 and 100
+    def set_efforts(self, left, right):
+        left = self._limit(left, self.effortL)
+        right = self._limit(right, self.effortR)
+        self.effortL = left
+        self.effortR = right
+
+        stepL = int(left + 0.5) if left >= 0 else -int(0.5 - left)
+        stepR = int(right + 0.5) if right >= 0 else -int(0.5 - right)
+        changedL = stepL != self._stepL
+        changedR = stepR != self._stepR
+        self._stepL = stepL
+        self._stepR = stepR
+
+        if changedL:
+            if stepL < 0:
+                self.left.DIR_pin.high()
+            else:
+                self.left.DIR_pin.low()
+        if changedR:
+            if stepR < 0:
+                self.right.DIR_pin.high()
+            else:
+                self.right.DIR_pin.low()
+        if changedL:
+            self.left.PWM_pin.pulse_width(self._pulses[stepL if stepL >= 0 else -stepL])
+        if changedR:
+            self.right.PWM_pin.pulse_width(self._pulses[stepR if stepR >= 0 else -stepR])
+
+    ## Enables both motor drivers.
+    # Both motors start from zero effort, so the slew limit applies from a standstill.
+    def enable(self):
+        self.effortL = self.effortR = 0
+        self._stepL = self._stepR = 0
+        self.left.enable()
+        self.right.enable()
+
+    ## Disables both motor drivers.
+    def disable(self):
+        self.left.disable()
+        self.right.disable()
+
+    ## Defines the task for the DriveTrain.
+    # This generator function enables the motors, then on each run applies the efforts found by both wheels'
+    # control loops. It's meant to run after them in the same task group, so that both efforts are applied as soon
+    # as they're found.
+    # @param shares A tuple (left, right) of objects, such as MotorEncoder objects, whose effort attributes hold
+    # the efforts wanted [%]
+    def task(self, shares):
+        left, right = shares
+        self.enable()
+        while True:
+            self.set_efforts(left.effort, right.effort)
+            yield 0
@@ -1,9 +1,38 @@
 ## @file Encoder.py
 # This file contains the driver for the encoder in the Gearmotor and Encoder Assembly for Romi/TI-RSLK MAX
 
-from time import ticks_us, ticks_diff # Use to get dt value in update()
-from pyb import Timer
+from utime import ticks_us, ticks_diff # Use to get dt value in update()
+from pyb import Timer, disable_irq, enable_irq
+import array
 import math
+import micropython
+import stm
+
+## Velocity from the change in count between the last two updates (the default)
+VEL_DIFF = 0
+
+## Velocity from a least-squares straight line fitted to the samples in the window
+VEL_LSQ = 1
+
+## Velocity from the longest part of the window in which the counts lie on a straight line
+VEL_ADAPTIVE = 2
+
+## Velocity from the time between the last two changes in count, for low speeds
+VEL_PERIOD = 3
+
+## The number of fractional bits in velocities returned by get_velocity_fp()
+VEL_SHIFT = 4
+
+# The direction bit in a timer's control register 1, set while the counter counts down, and the update flag in its
+# status register, set when the counter has wrapped and the interrupt hasn't yet been serviced
+_CR1_DIR = 0x10
+_SR_UIF = 0x01
+
+# Sample times are divided by 2**_TIME_SHIFT for least-squares fits so the sums stay small integers
+_TIME_SHIFT = 4
+
+# The least-squares numerator is kept below this so that scaling it to ticks / second stays a small integer
+_LSQ_LIMIT = (1 << 30) // (1000000 >> _TIME_SHIFT)
 
 ## Implements a quadrature encoder driver.
 # This class allows for control of the encoder in the Gearmotor and Encoder Assembly for Romi/TI-RSLK MAX.
@@ -21,6 +50,23 @@ import math
 # # Zero the encoder
 # encoder.zero()
 # @endcode
+# For a smoother velocity than the change in count between two updates, an estimator can be chosen; the
+# samples it needs are kept in preallocated arrays, so updating doesn't allocate memory.
+# @code
+# encoder = Encoder(1, Pin.board.PA8, Pin.board.PA9, estimator=VEL_LSQ, window=8)
+# @endcode
+# In extended mode the timer's overflows are counted by an interrupt, so the position stays exact however long
+# it is between updates, and capture() reads the exact position and time without waiting for an update.
+# @code
+# encoder = Encoder(1, Pin.board.PA8, Pin.board.PA9, extended=True)
+# pos = encoder.capture() # [Ticks], read at time encoder.cap_time [us]
+# @endcode
+# With a history, the samples of the most recent updates are kept so that the position at a recent time can be
+# looked up, for example to line it up with a sensor reading taken by a slower task, or exported for logging.
+# @code
+# encoder = Encoder(1, Pin.board.PA8, Pin.board.PA9, history=16)
+# then = encoder.position_at(ticks_add(ticks_us(), -40000)) # [Ticks], 40 ms ago
+# @endcode
 class Encoder:
 
     ## Initializes the motor object.
@@ -31,8 +77,14 @@ class Encoder:
     # @param tim The numer of the timer to be configured
     # @param chA_pin The timer's Channel A pin
     # @param chB_pin The timer's Channel B pin
+    # @param estimator How get_velocity() finds the velocity: VEL_DIFF, VEL_LSQ, VEL_ADAPTIVE or VEL_PERIOD
+    # @param window The number of (position, time) samples kept for the estimators other than VEL_DIFF
+    # @param band The largest error in ticks allowed between a straight line and the samples by VEL_ADAPTIVE
+    # @param extended True to count the timer's overflows in an interrupt so that no ticks are lost, however
+    # rarely the encoder is updated
+    # @param history The number of (position, time) samples kept for position_at() and export(), or 0 for none
 
-    def __init__(self, tim, chA_pin, chB_pin):
+    def __init__(self, tim, chA_pin, chB_pin, estimator=VEL_DIFF, window=8, band=1, extended=False, history=0):
         self.tim = Timer(tim, period = 0xFFFF, prescaler = 0)
         self.tim.channel(1, pin=chA_pin, mode=Timer.ENC_AB)
         self.tim.channel(2, pin=chB_pin, mode=Timer.ENC_AB)
@@ -42,24 +94,129 @@ class Encoder:
         self.prev_t = ticks_us()
         self.dt = 0 # Amount of time between last two updates
 
+        # The counter's reload value is read once here rather than on every update; a change in count of more
+        # than half of it is taken to be a wraparound
+        self._reload = self.tim.period() + 1
+        self._half = self._reload // 2
+
+        # In extended mode, the number of times the counter has wrapped around (down counts negative) and the
+        # full count at which the position is zero
+        self._extended = extended
+        self._wraps = 0
+        self._offset = 0
+
+        # The addresses of the timer's control register 1 and status register, read to find which way the counter
+        # wrapped
+        base = getattr(stm, 'TIM' + str(tim))
+        self._cr1 = base + stm.TIM_CR1
+        self._sr = base + stm.TIM_SR
+
+        ## The position read by the most recent call to capture() [Ticks]
+        self.cap_position = 0
+
+        ## The time at which the most recent call to capture() read the position [us]
+        self.cap_time = self.prev_t
+
+        if extended:
+            self._offset = self._full_count()
+            self.prev_count = self._offset
+            self.tim.callback(self._wrap_isr)
+
+        ## The velocity estimator used by get_velocity()
+        self.estimator = estimator
+        self.band = band
+
+        # Ring buffer of the positions and times of the most recent updates, long enough for both the estimator's
+        # window and the history; the estimators use only the newest window of it
+        size = max(window, history) if estimator != VEL_DIFF else history
+        self._window = window
+        self._keep = size > 0
+        self._pos_buf = array.array('l', [0] * max(size, 1))
+        self._time_buf = array.array('L', [0] * max(size, 1))
+        self._buf_idx = 0 # Where the next sample goes
+        self._buf_count = 0 # Number of samples in the buffer
+
+        ## The number of samples kept since the encoder was created, so a logger can tell how many are new
+        self.samples = 0
+
     ## Update the encoder's internal state.
     # This function updates the encoders internal state which calculates current position and velocity.
-    # This function must be ran regularly for proper functionality.
+    # This function must be ran regularly for proper functionality. It only does small integer arithmetic and
+    # doesn't allocate memory.
+    @micropython.native
     def update(self):
-        curr_count = self.tim.counter()
-        curr_t = ticks_us()
-        dcount = curr_count - self.prev_count
-        AR = self.tim.period()
-        if dcount > (AR + 1)/2:
-            dcount -= (AR + 1)
-        elif dcount < -(AR + 1)/2:
-            dcount += (AR + 1)
+        if self._extended:
+            curr_count = self._full_count()
+            curr_t = ticks_us()
+            dcount = curr_count - self.prev_count
+        else:
+            curr_count = self.tim.counter()
+            curr_t = ticks_us()
+            dcount = curr_count - self.prev_count
+            if dcount > self._half:
+                dcount -= self._reload
+            elif dcount < -self._half:
+                dcount += self._reload
         self.position += dcount #[Ticks]
         self.prev_count = curr_count
         self.delta = dcount # [Ticks]
         self.dt = ticks_diff(curr_t, self.prev_t) # [us]
         self.prev_t = curr_t
 
+        if self._keep:
+            idx = self._buf_idx
+            self._pos_buf[idx] = self.position
+            self._time_buf[idx] = curr_t
+            idx += 1
+            if idx >= len(self._pos_buf):
+                idx = 0
+            self._buf_idx = idx
+            if self._buf_count < len(self._pos_buf):
+                self._buf_count += 1
+            self.samples += 1
+
+    ## Count an overflow or underflow of the timer's counter.
+    # This interrupt service routine is called by the timer's update event, which happens when the counter wraps
+    # around in either direction. The timer's DIR bit tells which way it was counting, so the wrap is counted the
+    # right way however late the interrupt is serviced.
+    # @param tim The timer which caused the interrupt
+    def _wrap_isr(self, tim):
+        if stm.mem16[self._cr1] & _CR1_DIR:
+            self._wraps -= 1
+        else:
+            self._wraps += 1
+
+    ## Read the full count, including the overflows counted by the interrupt.
+    # The counter and the number of wraps are read with interrupts disabled. If the timer's update flag shows
+    # that the counter has wrapped but the interrupt hasn't counted it yet, the counter is read again, so that it
+    # was certainly read after the wrap, and the wrap is counted here.
+    def _full_count(self):
+        irq_state = disable_irq()
+        count = self.tim.counter()
+        wraps = self._wraps
+        if stm.mem16[self._sr] & _SR_UIF:
+            count = self.tim.counter()
+            if stm.mem16[self._cr1] & _CR1_DIR:
+                wraps -= 1
+            else:
+                wraps += 1
+        enable_irq(irq_state)
+        return wraps * self._reload + count
+
+    ## Read the exact position of the encoder and the time at which it was read.
+    # In extended mode this doesn't disturb update(), so it can be called from any task at any time, as often as
+    # needed. Otherwise it updates the encoder and returns the updated position. The time is kept in cap_time.
+    # @return The position in ticks
+    def capture(self):
+        if self._extended:
+            self.cap_position = self._full_count() - self._offset
+            self.cap_time = ticks_us()
+        else:
+            self.update()
+            self.cap_position = self.position
+            self.cap_time = self.prev_t
+        return self.cap_position # [Ticks]
+
     ## Get the relative position of the encoder.
     # This function gets the angular position (in ticks) of the motor relative to the angle at which the encoder
     # was when the encoder object was created.
@@ -67,14 +224,215 @@ class Encoder:
         return self.position # [Ticks]
 
     ## Get the velocity of the encoder.
-    # This function gets the angular velocity (in ticks / second) of the motor.
-    # This function will be less accurate if the encoder is updated too quickly.
+    # This function gets the angular velocity (in ticks / second) of the motor, using the estimator chosen when
+    # the encoder was created. With VEL_DIFF, this will be less accurate if the encoder is updated too quickly.
     def get_velocity(self):
-        return int(self.delta/self.dt * 1000000) # [Ticks/s]
+        if self.estimator == VEL_LSQ:
+            return self._lsq_velocity()
+        if self.estimator == VEL_ADAPTIVE:
+            return self._adaptive_velocity()
+        if self.estimator == VEL_PERIOD:
+            return self._period_velocity()
+        if self.dt <= 0:
+            return 0
+        # Integer division which, like int(), rounds toward zero
+        if self.delta < 0:
+            return -(-self.delta * 1000000 // self.dt) # [Ticks/s]
+        return self.delta * 1000000 // self.dt # [Ticks/s]
+
+    ## Get the velocity of the encoder as a fixed-point number.
+    # This function gets the angular velocity in ticks / second multiplied by 2**VEL_SHIFT, so that fractions of
+    # a tick per second are kept without using floats. With VEL_DIFF it uses only integer arithmetic.
+    # The whole ticks / second are found first and the fraction from the remainder, so that no intermediate
+    # value leaves MicroPython's small integers unless more than 1000 ticks go by between updates.
+    @micropython.native
+    def get_velocity_fp(self):
+        if self.estimator != VEL_DIFF:
+            return self.get_velocity() << VEL_SHIFT
+        dt = self.dt
+        if dt <= 0:
+            return 0
+        delta = self.delta
+        scaled = (delta if delta >= 0 else -delta) * 1000000
+        whole = scaled // dt
+        velocity = (whole << VEL_SHIFT) + ((scaled - whole * dt) << VEL_SHIFT) // dt
+        return velocity if delta >= 0 else -velocity # [Ticks/s * 2**VEL_SHIFT]
+
+    ## Find the index in the ring buffer of a sample.
+    # @param age 0 for the newest sample, 1 for the one before it and so on
+    def _sample(self, age):
+        idx = self._buf_idx - 1 - age
+        if idx < 0:
+            idx += len(self._pos_buf)
+        return idx
+
+    ## Estimate the velocity with a least-squares line through all the samples in the window.
+    # This averages out the one-tick steps of the count, at the cost of a delay of half the window. Only integer
+    # arithmetic is used, ending in one integer divide, so it doesn't allocate memory.
+    def _lsq_velocity(self):
+        count = min(self._buf_count, self._window)
+        if count < 2:
+            return 0
+        newest = self._sample(0)
+        t_new = self._time_buf[newest]
+        p_new = self._pos_buf[newest]
+
+        # Sums taken relative to the newest sample so that they stay small
+        st = sp = stt = stp = 0
+        for age in range(count):
+            idx = self._sample(age)
+            t = ticks_diff(self._time_buf[idx], t_new) >> _TIME_SHIFT
+            p = self._pos_buf[idx] - p_new
+            st += t
+            sp += p
+            stt += t * t
+            stp += t * p
+        sxx = count * stt - st * st
+        num = count * stp - st * sp
+        negative = num < 0
+        if negative:
+            num = -num
+
+        # Halve both sides of the ratio until multiplying by the time scale can't leave the small integers; the
+        # ratio keeps at least 13 bits, far more than the counts' resolution
+        while num >= _LSQ_LIMIT:
+            num >>= 1
+            sxx >>= 1
+        if sxx <= 0:
+            return 0
+        velocity = num * (1000000 >> _TIME_SHIFT) // sxx
+        return -velocity if negative else velocity # [Ticks/s]
+
+    ## Estimate the velocity over the longest part of the window in which all the samples lie within band ticks
+    # of a straight line from the oldest of them to the newest.
+    # At high speeds the window is short, so the estimate follows changes quickly; at low speeds it's long, so
+    # the one-tick steps are averaged over many samples.
+    def _adaptive_velocity(self):
+        count = min(self._buf_count, self._window)
+        if count < 2:
+            return 0
+        newest = self._sample(0)
+        t_new = self._time_buf[newest]
+        p_new = self._pos_buf[newest]
+
+        best = 1
+        for age in range(2, count):
+            oldest = self._sample(age)
+            dt_o = ticks_diff(t_new, self._time_buf[oldest]) >> _TIME_SHIFT
+            dp_o = p_new - self._pos_buf[oldest]
+            limit = self.band * dt_o
+            fits = True
+            for mid in range(1, age):
+                idx = self._sample(mid)
+                dt_m = ticks_diff(t_new, self._time_buf[idx]) >> _TIME_SHIFT
+                err = (p_new - self._pos_buf[idx]) * dt_o - dp_o * dt_m
+                if err > limit or err < -limit:
+                    fits = False
+                    break
+            if not fits:
+                break
+            best = age
+
+        oldest = self._sample(best)
+        dt = ticks_diff(t_new, self._time_buf[oldest])
+        if dt <= 0:
+            return 0
+        return (p_new - self._pos_buf[oldest]) * 1000000 // dt # [Ticks/s]
+
+    ## Estimate the velocity from the time between the last two updates at which the count changed.
+    # At low speeds, when the count changes only every few updates, this is much smoother than VEL_DIFF. If the
+    # count hasn't changed for longer than that time, the speed can be no more than one tick in the time since
+    # it last changed, which is returned instead so that the estimate falls to zero when the motor stops.
+    def _period_velocity(self):
+        count = min(self._buf_count, self._window)
+        newest = self._sample(0)
+        t_new = self._time_buf[newest]
+
+        # Find the newest sample at which the count changed, then the one before that
+        changes = 0
+        last = first = newest
+        for age in range(count - 1):
+            idx = self._sample(age)
+            if self._pos_buf[idx] != self._pos_buf[self._sample(age + 1)]:
+                if changes == 0:
+                    last = idx
+                else:
+                    first = idx
+                changes += 1
+                if changes == 2:
+                    break
+        if changes == 0:
+            return 0
+        if changes == 1:
+            first = self._sample(count - 1)
+
+        ticks = self._pos_buf[last] - self._pos_buf[first]
+        dt = ticks_diff(self._time_buf[last], self._time_buf[first])
+        if dt <= 0:
+            return 0
+        velocity = ticks * 1000000 // dt
+
+        # Limit the speed to one tick in the time since the count last changed
+        since = ticks_diff(t_new, self._time_buf[last])
+        if since > 0 and abs(velocity) * since > 1000000:
+            velocity = 1000000 // since if velocity > 0 else -(1000000 // since)
+        return velocity # [Ticks/s]
+
+    ## Find the position of the encoder at a recent time.
+    # The position is interpolated between the two kept samples either side of the time. Times before the oldest
+    # sample give its position and times after the newest give the newest position, as the encoder can't tell
+    # where it has gone since the last update. Without a history this is always the current position.
+    # @param t The time in microseconds, from ticks_us()
+    # @return The position in ticks
+    def position_at(self, t):
+        count = self._buf_count
+        if count == 0:
+            return self.position # [Ticks]
+        newer = self._sample(0)
+        if ticks_diff(t, self._time_buf[newer]) >= 0:
+            return self._pos_buf[newer] # [Ticks]
+        for age in range(1, count):
+            older = self._sample(age)
+            t_old = self._time_buf[older]
+            since = ticks_diff(t, t_old)
+            if since >= 0:
+                p_old = self._pos_buf[older]
+                dp = self._pos_buf[newer] - p_old
+                span = ticks_diff(self._time_buf[newer], t_old)
+                if dp < 0:
+                    return p_old - (-dp * since // span) # [Ticks]
+                return p_old + dp * since // span # [Ticks]
+            newer = older
+        return self._pos_buf[newer] # [Ticks]
+
+    ## Copy the newest kept samples into arrays, oldest first, for logging.
+    # Comparing samples with its value at the last export tells how many samples are new, for example
+    # @code
+    # n = encoder.export(times, positions, encoder.samples - last)
+    # last = encoder.samples
+    # @endcode
+    # @param times An array which is given the times of the samples [us]
+    # @param positions An array which is given the positions of the samples [Ticks]
+    # @param count The largest number of samples to copy, or None for as many as are kept and fit
+    # @return The number of samples copied
+    def export(self, times, positions, count=None):
+        n = min(self._buf_count, len(times), len(positions))
+        if count is not None and count < n:
+            n = count
+        for i in range(n):
+            idx = self._sample(n - 1 - i)
+            times[i] = self._time_buf[idx]
+            positions[i] = self._pos_buf[idx]
+        return n
 
     ## Zeros the encoder.
     # This function zeros the encoder. (Setting position to zero). It first updates the encoder to ensure
     # that the position is set to zero at the moment it is called.
     def zero(self):
         self.update()
+
+        # Keep the samples' positions relative to the new zero so the velocity estimate carries on smoothly
+        for idx in range(len(self._pos_buf)):
+            self._pos_buf[idx] -= self.position
+        self._offset += self.position
         self.position = 0
\ No newline at end of file
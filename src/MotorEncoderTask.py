@@ -1,17 +1,23 @@
 ## @file MotorEncoderTask.py
 # This file contains the class responsible for controlling Romi's low level motor control based on desired velocity.
 
-from pyb import Pin, Timer, USB_VCP, ADC
+from pyb import Pin, USB_VCP, ADC
 import task_share
 import cotask
 
 import PID
-import Motor
 import Encoder
 
+## Number of encoder samples kept for looking up recent positions, enough for 80 ms at the 5 ms drive period
+HISTORY = 16
+
+## Converts velocities from Encoder.get_velocity_fp(), in ticks / second * 2**VEL_SHIFT, to rad / s
+VEL_SCALE = 2 * 3.1415 / 1440 / (1 << Encoder.VEL_SHIFT)
+
 ## MotorEncoder is the low-level control loop for Romi's motors.
 # This class contains an initialization function and a generator function to be used as a task.
-# Each instance of this class represents either the left or right motor encoder pair.
+# Each instance of this class represents either the left or right motor encoder pair. The effort it finds is kept
+# in effort, and applied to both motors together by a DriveTrain.
 
 class MotorEncoder():
 
@@ -19,20 +25,18 @@ class MotorEncoder():
     # This function initializes either a left or right MotorEncoder object
     # @param side either "R" or "L" to indicate which pair
     # @param vbat current battery voltage for effort caluclation
+    # The encoder keeps the last HISTORY samples, so encoder.position_at() gives the wheel's position at a recent
+    # time, to line it up with events seen by slower tasks.
     def __init__(self, side, vbat):
 
         self.vbat = vbat
-        tm2 = Timer(2, freq=50*100000)
 
         if side == 'R':
-            self.motor = Motor.Motor((tm2, 1, Pin.board.PA15), Pin.board.PH0, Pin.board.PH1)
-
-            self.encoder = Encoder.Encoder(1, Pin.board.PA8, Pin.board.PA9)
+            self.encoder = Encoder.Encoder(1, Pin.board.PA8, Pin.board.PA9, extended=True, history=HISTORY)
             self.name = "Right"
 
         elif side == 'L':
-            self.motor = Motor.Motor((tm2, 3, Pin.board.PB10), Pin.board.PB3, Pin.board.PA10)
-            self.encoder = Encoder.Encoder(3, Pin.board.PB4, Pin.board.PB5)
+            self.encoder = Encoder.Encoder(3, Pin.board.PB4, Pin.board.PB5, extended=True, history=HISTORY)
             self.name = "Left"
         else:
             raise ValueError("Class takes 'R' or 'L' as parameters")
@@ -55,13 +59,21 @@ class MotorEncoder():
         self.pid = PID.PID(Kp_m, Ki_m, Kd_m)
         self.error = 0
 
+        ## The effort wanted from the motor, between -100 and 100 [%]
+        self.effort = 0
+
     ## Defines the task for MotorEncoder.
     # This generator function defines the task for the MotorEncoder, is starts in an Initialization state before alternating
     # between sensing and controlling states. It uses a PID to control the motor to a desired angular velocity.
-    # @param shares A tuple of shares (velocityShare, positionShare, reset)
+    # The velocity and position are fields of records with typed views, which are read and written directly
+    # rather than through get() and put().
+    # @param shares A tuple (velocityShare, positionShare, reset), where the first two are task_share.RecordField
+    # objects
     def task(self, shares):
 
         velocityShare, pos, reset = shares
+        velocity = velocityShare.value
+        position = pos.value
 
         S0_INIT = 0
         S1_ACTUATE = 1
@@ -72,18 +84,17 @@ class MotorEncoder():
         while True:
 
             if (state == S0_INIT):
-                self.motor.enable()
                 self.encoder.update()
 
                 state = S1_ACTUATE
 
             elif (state == S1_ACTUATE):
-                if (velocityShare.get() == 0):
-                    self.motor.set_effort(0)
+                if (velocity[0] == 0):
+                    self.effort = 0
                 else:
                     voltageDelta = self.pid.update(self.error)
-                    voltage = voltageDelta + self.vel2volt(velocityShare.get())
-                    self.motor.set_effort(voltage/Vbat * 100)
+                    voltage = voltageDelta + self.vel2volt(velocity[0])
+                    self.effort = voltage/Vbat * 100
 
                 state = S2_SENSE
 
@@ -95,9 +106,9 @@ class MotorEncoder():
                 else:  # else so we don't double update
                     self.encoder.update()
 
-                self.error = velocityShare.get() - (self.encoder.get_velocity() * 2 * 3.1415 / 1440)
+                self.error = velocity[0] - self.encoder.get_velocity_fp() * VEL_SCALE
 
-                pos.put(self.encoder.get_position())
+                position[0] = self.encoder.get_position()
                 state = S1_ACTUATE
 
             else:
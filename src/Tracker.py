@@ -45,8 +45,7 @@ class Tracker:
             return
 
         # Calculating Position
-        rPos = self.posR.get()
-        lPos = self.posL.get()
+        lPos, rPos = self.pos.get()
         avg = (rPos + lPos) / 2
 
         # Controlling Servo
@@ -68,8 +67,7 @@ class Tracker:
             self.state = self.S3_IMU
             return
 
-        rPos = self.posR.get()
-        lPos = self.posL.get()
+        lPos, rPos = self.pos.get()
         avg = (rPos + lPos) / 2
         #print("L:", lPos, "R:", rPos, "Avg:", avg)
         if avg >= 100_000: pass
@@ -95,8 +93,7 @@ class Tracker:
             self.state = self.S4_WALL
             return
 
-        rPos = self.posR.get()
-        lPos = self.posL.get()
+        lPos, rPos = self.pos.get()
         avg = ((rPos + lPos) / 2)
         #print("L:", lPos, "R:", rPos, "Avg:", avg)
         if avg >= 8_500: pass #Seems to be falling through for some reason
@@ -107,8 +104,9 @@ class Tracker:
     # - Counts distance until each turn
     # - After 3 turns and distance disables Romi.
     def _S4(self):
-        rPos =  4294967295 - self.posR.get()
-        lPos =  4294967295 - self.posL.get()
+        lPos, rPos = self.pos.get()
+        rPos =  4294967295 - rPos
+        lPos =  4294967295 - lPos
 
         avg = (rPos + lPos) / 2
         print(avg)
@@ -128,11 +126,12 @@ class Tracker:
     ## Defines the task for Controller.
     # This generator function defines the task for the tracker, is starts in an Initialization state before before
     # switching into state 1.
-    # @param shares A tuple of shares (enable, sectionShare, posL, posR, resetL, resetR)
+    # @param shares A tuple of shares (enable, sectionShare, pos, resetL, resetR), where pos is a record of the
+    # left and right positions
     def task(self, shares):
 
         # Unpacking Shares
-        self.enable, self.sectionShare, self.posL, self.posR, self.resetL, self.resetR = shares
+        self.enable, self.sectionShare, self.pos, self.resetL, self.resetR = shares
 
         # Declaring States
         self.S0_INIT = 0
@@ -27,9 +27,59 @@
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
+import array                           # Preallocated storage for traces
+import struct                          # Packs headers for binary traces
 import gc                              # Memory allocation garbage collector
 import utime                           # Micropython version of time library
 import micropython                     # This shuts up incorrect warnings
+import pyb                             # Used to sleep when there's no work
+
+
+## Overload policy for a task which always runs, however late it is. It's
+#  for critical tasks such as motor control, and it's the default.
+SHED_RUN = 0
+
+## Overload policy for a task whose late runs are dropped. When the task
+#  falls a period behind, or a task with policy @c SHED_RUN does, the stale
+#  waiting run is dropped and the task is released afresh at its latest due
+#  time, so it runs once rather than catching up on every missed period.
+SHED_SKIP = 1
+
+## Overload policy for a task which is slowed down in an overload. When the
+#  task falls a period behind, or a task with policy @c SHED_RUN does, its
+#  period is doubled, up to @c SHED_SLOW_MAX times its normal period; it's
+#  halved again after each @c SHED_RECOVER releases without trouble.
+SHED_SLOW = 2
+
+## The most by which @c SHED_SLOW lengthens a task's period
+SHED_SLOW_MAX = 8
+
+## The number of untroubled releases after which a slowed task speeds up
+SHED_RECOVER = 4
+
+## The number of bins in each of a profiled task's histograms.
+HIST_BINS = 64
+
+## The @c struct format of the header written by @c Task.write_trace().
+TRACE_HEADER = '<4sHLLBB'
+
+## The @c struct format of the header of a binary profile made by
+#  @c TaskList.snapshot(). See that method for the fields.
+PROFILE_HEADER = '<4sBLHHLL'
+
+## The number of bytes of a task's name kept in a binary profile.
+PROFILE_NAME = 16
+
+## The largest number of bytes written by each run of
+#  @c TaskList.profile_task().
+PROFILE_CHUNK = 16
+
+## The @c struct format of each task's fields, which follow its name, in a
+#  binary profile. See @c Task.pack_profile() for the fields.
+PROFILE_RECORD = '<hBLLLLLLLlLLLlLLLLL'
+
+# The width of a task's row in the task table before the memory columns
+_ROW_WIDTH = 140
 
 
 ## Implements multitasking with scheduling and some performance logging.
@@ -65,13 +115,26 @@ import micropython                     # This shuts up incorrect warnings
 #    @endcode
 class Task:
 
+    ## A counter which is incremented by every call to @c go(). Schedulers
+    #  which don't poll every task compare it with the value they last saw
+    #  to find out that some task has been made ready from outside.
+    signals = 0
+
+    ## A counter which is incremented whenever a task with overload policy
+    #  @c SHED_RUN falls a whole period behind. Tasks which may be shed
+    #  compare it with the value they last saw to find out about overloads.
+    crises = 0
+
     ## Initialize a task object so it may be run by the scheduler.
     # 
     #  This method initializes a task object, saving copies of constructor
     #  parameters and preparing an empty dictionary for states.
     # 
     #  @param run_fun The function which implements the task's code. It must
-    #         be a generator which yields the current state.
+    #         be a generator which yields the current state, a number. When
+    #         tracing, states are stored as 32 bit integers, so a state such
+    #         as @c 2.0 or @c True is stored as @c int(state); a state which
+    #         can't be converted, such as @c None, raises an exception.
     #  @param name The name of the task, by default @c NoName. This should
     #         be overridden with a more descriptive name by the programmer.
     #  @param priority The priority of the task, a positive integer with
@@ -81,12 +144,32 @@ class Task:
     #         The time can be given in a @c float or @c int; it will be 
     #         converted to microseconds for internal use by the scheduler.
     #  @param profile Set to @c True to enable run-time profiling 
-    #  @param trace Set to @c True to generate a list of transitions between
-    #         states. @b Note: This slows things down and allocates memory.
+    #  @param trace Set to @c True to record transitions between states in a
+    #         ring buffer. @b Note: This slows things down a little; memory
+    #         for the buffer is allocated here, not while the task runs.
     #  @param shares A list or tuple of shares and queues used by this task.
     #         If no list is given, no shares are passed to the task
+    #  @param trace_size The number of most recent transitions which are kept
+    #         when tracing; older ones are overwritten (default 100)
+    #  @param hist_us The width in microseconds of each bin of the run time
+    #         and lateness histograms kept when profiling. By default the
+    #         histograms of a timed task span two of its periods, and those
+    #         of other tasks have bins 100 microseconds wide
+    #  @param timer The number of a hardware timer which is to run this task
+    #         once per period, or @c None (the default) if the scheduler is
+    #         to run it. A task run by a timer starts within a bytecode or so
+    #         of its timer's interrupt, even if another task is running. 
+    #  @param shed What to do with the task when the system is overloaded:
+    #         @c SHED_RUN (the default) to run it anyway, @c SHED_SKIP to
+    #         skip late runs or @c SHED_SLOW to lengthen its period for a
+    #         while. Shedding is only done for tasks run by the scheduler.
+    #  @param mem Set to @c True to measure the memory allocated by each run
+    #         of the task and count the garbage collections which happen
+    #         while it runs. This needs @c gc.mem_alloc(), so it works only
+    #         under MicroPython.
     def __init__(self, run_fun, name="NoName", priority=0, period=None,
-                 profile=False, trace=False, shares=()):
+                 profile=False, trace=False, shares=(), trace_size=100,
+                 hist_us=None, timer=None, shed=SHED_RUN, mem=False):
         # The function which is run to implement this task's code. Since it 
         # is a generator, we "run" it here, which doesn't actually run it but
         # gets it going as a generator which is ready to yield values
@@ -114,20 +197,59 @@ class Task:
             self.period = period
             self._next_run = None
 
+        # The time at which the task was most recently released by its timer
+        # but hasn't yet run; used to measure the task's lateness
+        self._due = None
+
+        # The overload policy, the period to which a slowed task returns,
+        # the number of untroubled releases since it was last slowed, and
+        # the value of Task.crises when the task last looked at it
+        self._shed = shed
+        self._base_period = self.period
+        self._on_time = 0
+        self._crises = Task.crises
+
+        # The number of the hardware timer which runs this task, if any
+        if timer != None and period == None:
+            raise ValueError('A task run by a timer needs a period')
+        self._timer = timer
+
         # Flag which causes the task to be profiled, in which the execution
         #  time of the @c run() method is measured and basic statistics kept. 
         self._prof = profile
+
+        # Flag which causes the memory allocated by each run to be measured
+        self._mem = mem
+
+        # When profiling, histograms of run durations and lateness are kept
+        # in preallocated arrays of HIST_BINS bins, each hist_us wide; the
+        # last bin also counts everything which is too long for the others
+        if hist_us == None:
+            hist_us = 2 * self.period // HIST_BINS if self.period else 100
+        self._hist_us = max(int(hist_us), 1)
+        if profile:
+            self._run_hist = array.array('L', [0] * HIST_BINS)
+            self._late_hist = array.array('L', [0] * HIST_BINS)
         self.reset_profile()
 
+        # Room for the run time and lateness percentiles worked out when a
+        # binary profile is packed, so that packing doesn't allocate memory
+        self._pcts = array.array('L', [0] * 6)
+
         # The previous state in which the task last ran. It is used to watch
         # for and track state transitions.
         self._prev_state = 0
 
-        # If transition tracing has been enabled, create an empty list in 
-        # which to store transition (time, to-state) stamps
+        # If transition tracing has been enabled, create a ring buffer of
+        # transition times and to-states. The index is where the next
+        # transition goes; the count is the number of transitions ever seen
         self._trace = trace
-        self._tr_data = []
-        self._prev_time = utime.ticks_us()
+        if trace:
+            self._tr_times = array.array('L', [0] * trace_size)
+            self._tr_states = array.array('l', [0] * trace_size)
+        self._tr_idx = 0
+        self._tr_count = 0
+        self._tr_start = utime.ticks_us()
 
         ## Flag which is set true when the task is ready to be run by the
         #  scheduler
@@ -142,52 +264,92 @@ class Task:
     #  @return @c True if the task ran or @c False if it did not
     def schedule(self) -> bool:
         if self.ready():
-
-            # Reset the go flag for the next run
-            self.go_flag = False
-
-            # If profiling, save the start time
-            if self._prof:
-                stime = utime.ticks_us()
-
-            # Run the method belonging to the state which should be run next
-            curr_state = next(self._run_gen)
-
-            # If profiling or tracing, save timing data
-            if self._prof or self._trace:
-                etime = utime.ticks_us()
-
-            # If profiling, save timing data
-            if self._prof:
-                self._runs += 1
-                runt = utime.ticks_diff(etime, stime)
-                if self._runs > 2:
-                    self._run_sum += runt
-                    if runt > self._slowest:
-                        self._slowest = runt
-
-            # If transition logic tracing is on, record a transition; if not,
-            # ignore the state. If out of memory, switch tracing off and 
-            # run the memory allocation garbage collector
-            if self._trace:
-                try:
-                    if curr_state != self._prev_state:
-                        self._tr_data.append(
-                            (utime.ticks_diff(etime, self._prev_time),
-                             curr_state))
-                except MemoryError:
-                    self._trace = False
-                    gc.collect()
-
-                self._prev_state = curr_state
-                self._prev_time = etime
-
+            self._run()
             return True
 
         else:
             return False
 
 
+    ## This method runs the task's generator up to its next @c yield().
+    #  It is used by schedulers which have already decided that the task is
+    #  ready to run; it records profiling and trace data as configured.
+    def _run(self):
+        # Reset the go flag for the next run
+        self.go_flag = False
+        due = self._due
+        self._due = None
+
+        # If profiling memory, note how much is in use before the run
+        if self._mem:
+            mem_start = gc.mem_alloc()
+
+        # If profiling, save the start time and measure how long after its
+        # scheduled release time the task actually started
+        if self._prof:
+            stime = utime.ticks_us()
+            if due != None:
+                late = utime.ticks_diff(stime, due)
+                self._late_sum += late
+                if late > self._latest:
+                    self._latest = late
+                if late >= self.period:
+                    self._misses += 1
+                idx = late // self._hist_us
+                if idx >= HIST_BINS:
+                    idx = HIST_BINS - 1
+                self._late_hist[idx] += 1
+
+        # Run the method belonging to the state which should be run next
+        curr_state = next(self._run_gen)
+
+        # If profiling or tracing, save timing data
+        if self._prof or self._trace:
+            etime = utime.ticks_us()
+
+        # If profiling memory, find how much the run allocated. Less memory
+        # in use than before means that the garbage collector ran, in which
+        # case the amount allocated can't be known, so the run isn't counted
+        if self._mem:
+            alloc = gc.mem_alloc() - mem_start
+            self._mem_runs += 1
+            if alloc < 0:
+                self._gcs += 1
+            elif self._mem_runs > 2:
+                self._mem_sum += alloc
+                self._mem_count += 1
+                if alloc > self._mem_max:
+                    self._mem_max = alloc
+
+        # If profiling, save timing data
+        if self._prof:
+            self._runs += 1
+            runt = utime.ticks_diff(etime, stime)
+            if self._runs > 2:
+                self._run_sum += runt
+                if runt > self._slowest:
+                    self._slowest = runt
+                idx = runt // self._hist_us
+                if idx >= HIST_BINS:
+                    idx = HIST_BINS - 1
+                self._run_hist[idx] += 1
+
+        # If transition logic tracing is on, record a transition in the next
+        # slot of the ring buffer, overwriting the oldest one when it's full
+        if self._trace:
+            if curr_state != self._prev_state:
+                idx = self._tr_idx
+                self._tr_times[idx] = etime
+                self._tr_states[idx] = int(curr_state)
+                idx += 1
+                if idx >= len(self._tr_times):
+                    idx = 0
+                self._tr_idx = idx
+                self._tr_count += 1
+
+            self._prev_state = curr_state
+
+
     ## This method checks if the task is ready to run.
     #  If the task runs on a timer, this method checks what time it is; if not,
     #  this method checks the flag which indicates that the task is ready to
@@ -198,31 +360,109 @@ class Task:
         # If this task uses a timer, check if it's time to run run() again. If
         # so, set go flag and set the timer to go off at the next run time
         if self.period != None:
-            late = utime.ticks_diff(utime.ticks_us(), self._next_run)
-            if late > 0:
-                self.go_flag = True
-                self._next_run = utime.ticks_diff(self.period, 
-                                                  -self._next_run)
-
-                # If keeping a latency profile, record the data
-                if self._prof:
-                    self._late_sum += late
-                    if late > self._latest:
-                        self._latest = late
+            now = utime.ticks_us()
+            if utime.ticks_diff(now, self._next_run) > 0:
+                self._release(now)
 
         # If the task doesn't use a timer, we rely on go_flag to signal ready
         return self.go_flag
 
 
+    ## This method releases a timed task whose run time has come.
+    #  It sets the go flag, remembers the scheduled release time so that
+    #  lateness can be measured when the task actually starts, and moves the
+    #  next run time forward by one period. After the release, the next run
+    #  time is also the deadline by which this run should be finished. If the
+    #  task was already waiting to run, its earlier release time is kept.
+    #
+    #  A task whose oldest waiting release is a whole period or more behind
+    #  the time now is taken to be a sign of overload. This is found from
+    #  the time, not from the go flag, because @c pri_sched() only releases
+    #  a task when it looks at it, so a late task may never be seen waiting.
+    #  What's done then depends on the task's overload policy: a task which
+    #  skips has its stale release dropped, its next run time moved up to
+    #  the latest one which has passed, and is released afresh from there.
+    #  Each time a task is shed, it's counted in the profile's @c SHED
+    #  column.
+    #  @param now The time, from @c utime.ticks_us()
+    @micropython.native
+    def _release(self, now):
+        # A task readied by go() is waiting but has no release time
+        due = self._due if self.go_flag and self._due != None \
+            else self._next_run
+        overdue = utime.ticks_diff(now, due) >= self.period
+        if self._shed != SHED_RUN:
+            if overdue or self._crises != Task.crises:
+                self._crises = Task.crises
+                self._sheds += 1
+                self._on_time = 0
+                if self._shed == SHED_SKIP:
+                    self.go_flag = False
+                    while utime.ticks_diff(now, self._next_run) >= \
+                            self.period:
+                        self._next_run = utime.ticks_diff(self.period,
+                                                          -self._next_run)
+                elif self.period < self._base_period * SHED_SLOW_MAX:
+                    self.period *= 2
+            elif self.period != self._base_period:
+                self._on_time += 1
+                if self._on_time >= SHED_RECOVER:
+                    self._on_time = 0
+                    self.period //= 2
+        elif overdue:
+            Task.crises += 1
+
+        if not self.go_flag:
+            self._due = self._next_run
+        self.go_flag = True
+        self._next_run = utime.ticks_diff(self.period, -self._next_run)
+
+
+    ## This method starts the hardware timer which runs this task.
+    #  It's called by @c TaskList.append() for tasks given a timer number.
+    #  The timer's interrupt service routine can't run the task itself, as
+    #  tasks may allocate memory; it uses @c micropython.schedule() to have
+    #  the task run as soon as the currently running bytecode has finished.
+    #  Both callbacks are bound methods made here, so that the interrupt
+    #  doesn't allocate memory. 
+    def _start_timer(self):
+        self._dispatch_cb = self._dispatch
+        self._hw_timer = pyb.Timer(self._timer, freq=1000000 / self.period)
+        self._hw_timer.callback(self._timer_isr)
+
+
+    ## This interrupt service routine releases a task run by a timer.
+    #  If the previous release of the task hasn't run yet, this release is
+    #  dropped and counted as a deadline miss.
+    #  @param timer The timer which caused the interrupt
+    def _timer_isr(self, timer):
+        if self.go_flag:
+            self._misses += 1
+            return
+        self._due = utime.ticks_us()
+        self.go_flag = True
+        micropython.schedule(self._dispatch_cb, None)
+
+
+    ## This method is scheduled by the timer interrupt to run the task.
+    #  @param arg Unused; required by @c micropython.schedule()
+    def _dispatch(self, arg):
+        self._run()
+
+
     ## This method sets the period between runs of the task to the given
     #  number of milliseconds, or @c None if the task is triggered by calls
-    #  to @c go() rather than time.
+    #  to @c go() rather than time. A task made untimed is dropped from its
+    #  task list's heap of timers the next time it comes due, and a run
+    #  which has already been released isn't measured for lateness.
     #  @param new_period The new period in milliseconds between task runs
     def set_period(self, new_period):
         if new_period is None:
             self.period = None
+            self._due = None
         else:
             self.period = int(new_period) * 1000
+        self._base_period = self.period
 
 
     ## This method resets the variables used for execution time profiling.
@@ -233,38 +473,218 @@ class Task:
         self._slowest = 0
         self._late_sum = 0
         self._latest = 0
+        self._misses = 0
+        self._sheds = 0
+        self._mem_runs = 0
+        self._mem_count = 0
+        self._mem_sum = 0
+        self._mem_max = 0
+        self._gcs = 0
+        if self._prof:
+            for idx in range(HIST_BINS):
+                self._run_hist[idx] = 0
+                self._late_hist[idx] = 0
+
+
+    ## This method finds a percentile of one of the profiling histograms.
+    #  The result is the upper edge of the bin in which the percentile falls,
+    #  so it is accurate to within the histogram bin width, except that
+    #  anything in the last bin may be much longer than its upper edge.
+    #  @param hist The histogram, either @c _run_hist or @c _late_hist
+    #  @param percent The percentile to find, from 0 to 100
+    #  @return The percentile in microseconds, or 0 if the histogram is empty
+    def percentile(self, hist, percent):
+        total = 0
+        for count in hist:
+            total += count
+        if total == 0:
+            return 0
+        limit = total * percent / 100
+        total = 0
+        for idx in range(HIST_BINS):
+            total += hist[idx]
+            if total >= limit:
+                break
+        return (idx + 1) * self._hist_us
 
 
     ## This method returns a string containing the task's transition trace.
-    #  The trace is a set of tuples, each of which contains a time and the
-    #  states from and to which the system transitioned. 
+    #  Each line holds the time in seconds since the task was created and
+    #  the states from and to which the task transitioned. If the ring buffer
+    #  has overflowed, only the most recent transitions are shown.
     #  @return A possibly quite large string showing state transitions
     def get_trace(self):
         tr_str = 'Task ' + self.name + ':'
         if self._trace:
             tr_str += '\n'
+            size = len(self._tr_times)
+            count = min(self._tr_count, size)
+            first = (self._tr_idx - count) % size
             last_state = 0
-            total_time = 0.0
-            for item in self._tr_data:
-                total_time += item[0] / 1000000.0
+
+            # After overflowing, the oldest kept transition only tells us the
+            # state from which the next one starts
+            if self._tr_count > size:
+                tr_str += '  ({:d} earlier transitions lost)\n'.format (
+                    self._tr_count - size + 1)
+                last_state = self._tr_states[first]
+                first += 1
+                count -= 1
+
+            for num in range(count):
+                idx = (first + num) % size
+                total_time = utime.ticks_diff(self._tr_times[idx],
+                                              self._tr_start) / 1000000.0
                 tr_str += '{: 12.6f}: {: 2d} -> {:d}\n'.format (total_time, 
-                    last_state, item[1])
-                last_state = item[1]
+                    last_state, self._tr_states[idx])
+                last_state = self._tr_states[idx]
         else:
             tr_str += ' not traced'
         return tr_str
 
 
+    ## This method writes the task's transition trace in binary form.
+    #  Writing the ring buffer's contents directly is much quicker than
+    #  building the string made by @c get_trace(), and the stream can be a
+    #  file or a UART. The data begins with a header packed with the format
+    #  @c TRACE_HEADER: the bytes @c b'CTRC', the number of transitions
+    #  written, the number of transitions ever seen, the tick count when the
+    #  task was created, and the sizes in bytes of one time and one state.
+    #  All the times follow, oldest first, then all the states. 
+    #  @param stream An object with a @c write() method, such as a UART
+    def write_trace(self, stream):
+        if not self._trace:
+            stream.write(struct.pack(TRACE_HEADER, b'CTRC', 0, 0,
+                                     self._tr_start, 0, 0))
+            return
+
+        size = len(self._tr_times)
+        count = min(self._tr_count, size)
+        first = (self._tr_idx - count) % size
+        stream.write(struct.pack(TRACE_HEADER, b'CTRC', count, self._tr_count,
+                                 self._tr_start, self._tr_times.itemsize,
+                                 self._tr_states.itemsize))
+
+        # The transitions kept may wrap around the end of the buffer, so each
+        # array is written as up to two pieces, oldest piece first
+        for data in (self._tr_times, self._tr_states):
+            view = memoryview(data)
+            if first + count > size:
+                stream.write(view[first:])
+                stream.write(view[:first + count - size])
+            else:
+                stream.write(view[first:first + count])
+
+
+    ## This method packs the task's profile into a buffer in binary form.
+    #  The fields are packed with the format @c PROFILE_RECORD; they are the
+    #  priority, flags (bit 0 set if profiled, bit 1 if run on a timer,
+    #  bit 2 if run by a hardware timer, bit 3 if memory is profiled), the
+    #  period, the number of runs, the average, 50th, 95th and 99th
+    #  percentile and maximum run times, the same five figures for lateness,
+    #  the number of missed deadlines, the number of times the task was shed
+    #  in an overload, the average and maximum bytes allocated per run and
+    #  the number of garbage collections which happened during runs.
+    #  Times are in microseconds. No memory is allocated, so this can be
+    #  called while the tasks are running. The task's name isn't packed.
+    #  @param buf A @c bytearray into which the fields are packed
+    #  @param offset The position in @c buf at which the fields begin
+    def pack_profile(self, buf, offset):
+        flags = 0
+        avg_dur = 0
+        avg_late = 0
+        pcts = self._pcts
+        if self._prof:
+            flags = 1
+            if self._runs > 0:
+                avg_dur = self._run_sum // self._runs
+                avg_late = self._late_sum // self._runs
+            self._percentiles(self._run_hist, self._slowest, 0)
+            self._percentiles(self._late_hist, self._latest, 3)
+        if self.period != None:
+            flags |= 2
+        if self._timer != None:
+            flags |= 4
+        if self._mem:
+            flags |= 8
+        struct.pack_into(PROFILE_RECORD, buf, offset, self.priority, flags,
+                         self.period if self.period != None else 0,
+                         self._runs, avg_dur, pcts[0], pcts[1], pcts[2],
+                         self._slowest, avg_late, pcts[3], pcts[4], pcts[5],
+                         self._latest, self._misses, self._sheds,
+                         self._mem_sum // self._mem_count
+                         if self._mem_count else 0,
+                         self._mem_max, self._gcs)
+
+
+    ## This method finds the 50th, 95th and 99th percentiles of a profiling
+    #  histogram in one pass, as @c percentile() does, and puts them into
+    #  the task's array of percentiles.
+    #  @param hist The histogram, either @c _run_hist or @c _late_hist
+    #  @param most The longest time seen, to which percentiles are limited
+    #  @param first The index in the array of the first percentile to set
+    def _percentiles(self, hist, most, first):
+        total = 0
+        for idx in range(HIST_BINS):
+            total += hist[idx]
+        pcts = self._pcts
+        pcts[first] = pcts[first + 1] = pcts[first + 2] = 0
+        if total == 0:
+            return
+
+        # Numbers of samples at or below each of the three percentiles
+        need_50 = (total * 50 + 99) // 100
+        need_95 = (total * 95 + 99) // 100
+        need_99 = (total * 99 + 99) // 100
+        total = 0
+        pos = first
+        for idx in range(HIST_BINS):
+            total += hist[idx]
+            edge = min((idx + 1) * self._hist_us, most)
+            if pos == first and total >= need_50:
+                pcts[pos] = edge
+                pos += 1
+            if pos == first + 1 and total >= need_95:
+                pcts[pos] = edge
+                pos += 1
+            if pos == first + 2 and total >= need_99:
+                pcts[pos] = edge
+                return
+
+
+    ## This method shows the 50th, 95th and 99th percentiles of a profiling
+    #  histogram in milliseconds for the task table. A percentile which
+    #  falls in the last bin, which also holds everything too long for the
+    #  histogram, is only known to be over the histogram's range, so it's
+    #  shown as, for example, @c >6.4 rather than as a plain number.
+    #  @param hist The histogram, either @c _run_hist or @c _late_hist
+    #  @param most The longest time seen, to which percentiles are limited
+    #  @return The three percentiles as text, each 8 characters wide
+    def _show_percentiles(self, hist, most):
+        top = (HIST_BINS - 1) * self._hist_us
+        text = ''
+        for percent in (50, 95, 99):
+            pct = self.percentile(hist, percent)
+            if pct > top and most > top:
+                text += f"{'>' + format(top / 1000.0, '.1f'):>8s}"
+            else:
+                text += f"{(min(pct, most) / 1000.0): 8.1f}"
+        return text
+
+
     ## Method to set a flag so that this task indicates that it's ready to run.
     #  This method may be called from an interrupt service routine or from
     #  another task which has data that this task needs to process soon.
     def go(self):
         self.go_flag = True
+        Task.signals += 1
 
 
     ## This method converts the task to a string for diagnostic use.
     #  It shows information about the task, including execution time
-    #  profiling results if profiling has been done.
+    #  profiling results if profiling has been done. If memory is profiled,
+    #  the average and largest numbers of bytes allocated per run and the
+    #  number of garbage collections during runs are added at the end.
     #  @returns The string which represents the task
     def __repr__(self):
         rst = f"{self.name:<16s}{self.priority: 4d}"
@@ -277,12 +697,73 @@ class Task:
         if self._prof and self._runs > 0:
             avg_dur = (self._run_sum / self._runs) / 1000.0
             avg_late = (self._late_sum / self._runs) / 1000.0
-            rst += f"{avg_dur: 10.3f}{(self._slowest / 1000.0): 10.3f}"
+            rst += f"{avg_dur: 10.3f}"
+            rst += self._show_percentiles(self._run_hist, self._slowest)
+            rst += f"{(self._slowest / 1000.0): 10.3f}"
             if self.period != None:
-                rst += f"{avg_late: 10.3f}{(self._latest / 1000.0): 10.3f}"
+                rst += f"{avg_late: 10.3f}"
+                rst += self._show_percentiles(self._late_hist, self._latest)
+                rst += f"{(self._latest / 1000.0): 10.3f}{self._misses: 8d}"
+                rst += f"{self._sheds: 6d}"
+
+        if self._mem:
+            avg_mem = self._mem_sum // self._mem_count if self._mem_count \
+                else 0
+            rst += ' ' * (_ROW_WIDTH - len(rst))
+            rst += f"{avg_mem: 8d}{self._mem_max: 8d}{self._gcs: 6d}"
         return rst
 
 
+## A task which runs several generators one after another in one slot.
+#
+#  Tasks which have the same period and priority and always run together,
+#  such as the controllers for two wheels, can be fused into one group. The
+#  scheduler then checks, profiles and dispatches the group once rather than
+#  each member separately, and the members always run back to back in the
+#  order given, so they work from the same sample instant and can't drift
+#  apart by a scheduler pass. Each member is written exactly as for a
+#  @c Task. The group's profile covers all the members' runs together.
+#
+#  @b Example:
+#    @code
+#       drive = cotask.TaskGroup (((motorR.task, (velR, posR)),
+#                                  (motorL.task, (velL, posL))),
+#                                 name = 'Drive', priority = 3, period = 5,
+#                                 profile = True)
+#       cotask.task_list.append (drive)
+#    @endcode
+class TaskGroup(Task):
+
+    ## Initialize a group of generators which are run as one task.
+    #  @param members A sequence of (run_fun, shares) pairs, one for each
+    #         member in the order in which they're to be run, where
+    #         @c run_fun and @c shares are as for @c Task. The shares may be
+    #         empty for a member which doesn't use any.
+    #  @param kwargs The other parameters are as for @c Task, except that
+    #         @c shares isn't used
+    def __init__(self, members, **kwargs):
+        gens = []
+        for run_fun, shares in members:
+            gens.append(run_fun(shares) if shares else run_fun())
+
+        ## The state most recently yielded by each member, in order
+        self.states = [0] * len(gens)
+
+        super().__init__(self._run_all, shares=gens, **kwargs)
+
+
+    ## The generator which runs each member up to its next @c yield().
+    #  It yields the first member's state, which is what a trace records.
+    #  @param gens The members' generators
+    def _run_all(self, gens):
+        states = self.states
+        count = len(gens)
+        while True:
+            for idx in range(count):
+                states[idx] = next(gens[idx])
+            yield states[0]
+
+
 # =============================================================================
 
 ## A list of tasks used internally by the task scheduler.
@@ -308,12 +789,82 @@ class TaskList:
         #  that priority. 
         self.pri_list = []
 
+        # Tasks which are run by hardware timers rather than the scheduler
+        self._hw_tasks = []
+
+        # A binary heap of the tasks which run on a timer, ordered by their
+        # next run times, so that @c heap_sched() needs to look only at the
+        # tasks which are due. It's kept ordered only by @c heap_sched().
+        self._timers = []
+
+        # Set when tasks may be ready to run, so @c heap_sched() should look
+        # through the priority lists; cleared when a look finds nothing
+        self._dirty = True
+
+        # The value of @c Task.signals when the priority lists were last
+        # found to contain no tasks which are ready to run
+        self._signals = Task.signals
+
+        # The time at which @c heap_sched() last read the clock
+        self._now = utime.ticks_us()
+
+        ## A function which @c idle_sched() calls to sleep when no task is
+        #  ready. It is called with the number of microseconds until the next
+        #  timed task is due, or @c None if no task runs on a timer, and
+        #  should return early if an interrupt occurs. If it's @c None, the
+        #  processor waits for the next interrupt with @c pyb.wfi(). 
+        self.idle_fun = None
+
+        ## The shortest time, in microseconds, before the next timed task is
+        #  due for which @c idle_sched() will go to sleep. The default of one
+        #  millisecond matches the system tick interrupt which ends a
+        #  @c pyb.wfi() sleep, so sleeping never makes a task late.
+        self.idle_min = 1000
+
+        ## The fraction of time spent asleep by @c idle_sched() during the
+        #  most recent full second, or @c None until a second has passed
+        self.idle_fraction = None
+
+        # Total time slept and the start of the current one-second window
+        self._idle_sum = 0
+        self._idle_since = self._now
+
+        ## A fraction of the processor's time above which @c idle_sched()
+        #  prints a warning when a second's use goes over it, or @c None for
+        #  no warnings. @c analyze() shows whether the tasks can cope.
+        self.load_warn = None
+
+        # Set while the load is over load_warn, so it's only reported once
+        self._overloaded = False
+
+        # Garbage collection settings used after gc_manage() is called: the
+        # bytes allocated which call for a collection (zero when collection
+        # isn't managed), the gap needed to collect, the memory in use after
+        # the last collection, and the collections' count and durations
+        self._gc_step = 0
+        self._gc_need = 0
+        self._gc_base = 0
+        self._gc_runs = 0
+        self._gc_sum = 0
+        self._gc_max = 0
+
+        ## The buffer into which @c snapshot() packs the binary profile. It's
+        #  reallocated only when a task is added to the list.
+        self.profile_data = bytearray(struct.calcsize(PROFILE_HEADER))
+
 
     ## Append a task to the task list. The list will be sorted by task 
     #  priorities so that the scheduler can quickly find the highest priority
     #  task which is ready to run at any given time. 
     #  @param task The task to be appended to the list
     def append(self, task):
+        # Tasks run by hardware timers are kept out of the schedulers' way
+        if task._timer != None:
+            self._hw_tasks.append(task)
+            self._size_profile()
+            task._start_timer()
+            return
+
         # See if there's a tasklist with the given priority in the main list
         new_pri = task.priority
         for pri in self.pri_list:
@@ -333,6 +884,13 @@ class TaskList:
         # Make sure the main list (of lists at each priority) is sorted
         self.pri_list.sort(key=lambda pri: pri[0], reverse=True)
 
+        # Tasks which run on a timer also go into the heap of timers
+        if task.period != None:
+            self._timers.append(task)
+            self._timer_up(len(self._timers) - 1)
+
+        self._size_profile()
+
 
     ## Run tasks in order, ignoring the tasks' priorities.
     #
@@ -375,13 +933,434 @@ class TaskList:
                     return
 
 
+    ## Run tasks according to their priorities, checking only due tasks.
+    #
+    #  This scheduler follows the same rules as @c pri_sched(): it runs the
+    #  highest priority task which is ready, taking turns among tasks of equal
+    #  priority. Rather than asking every task whether it's ready, it keeps
+    #  the timed tasks in a heap ordered by their next run times, so the clock
+    #  is read once per call and only the tasks which are actually due are
+    #  released. If nothing has been released and no task's @c go() method
+    #  has been called, it returns without looking through the task lists. 
+    #  Use either this scheduler or one of the others in a program, not both,
+    #  as the others don't keep the heap in order.
+    #  @return @c True if a task was run, @c False if no task was ready
+    @micropython.native
+    def heap_sched(self) -> bool:
+        self._release_due()
+
+        # If nothing can have become ready since the last look, we're done
+        signals = Task.signals
+        if not self._dirty and signals == self._signals:
+            return False
+
+        # Go down the list of priorities, beginning with the highest, and run
+        # the first ready task, in round-robin order within each priority
+        for pri in self.pri_list:
+            tries = 2
+            length = len(pri)
+            while tries < length:
+                task = pri[pri[1]]
+                tries += 1
+                pri[1] += 1
+                if pri[1] >= length:
+                    pri[1] = 2
+                if task.go_flag:
+                    task._run()
+                    return True
+
+        # No task was ready; don't look again until something changes
+        self._dirty = False
+        self._signals = signals
+        return False
+
+
+    ## Run the ready task whose deadline is soonest.
+    #
+    #  This earliest-deadline-first scheduler releases timed tasks from the
+    #  heap of timers as @c heap_sched() does, then runs the ready task whose
+    #  current run must finish soonest, which is its release time plus its
+    #  period. Of tasks with equal deadlines, the one which has been waiting
+    #  longest runs first, then the one with the highest priority. This lets
+    #  a slow task with a long period run ahead of fast tasks which were
+    #  released after it, which lowers its worst-case lateness. Tasks which
+    #  don't run on a timer have no deadline; they run, highest priority
+    #  first, when no timed task is ready. The same profiling is done as by
+    #  the other schedulers.
+    #  @return @c True if a task was run, @c False if no task was ready
+    @micropython.native
+    def edf_sched(self) -> bool:
+        self._release_due()
+
+        # If nothing can have become ready since the last look, we're done
+        signals = Task.signals
+        if not self._dirty and signals == self._signals:
+            return False
+
+        # Find the timed task with the soonest deadline and, in case there
+        # is none, the highest priority untimed task which is ready
+        now = self._now
+        best = None
+        best_due = 0
+        best_deadline = 0
+        untimed = None
+        for pri in self.pri_list:
+            for idx in range(2, len(pri)):
+                task = pri[idx]
+                if task.go_flag:
+                    if task.period == None:
+                        if untimed == None:
+                            untimed = task
+                        continue
+
+                    # The deadline is a period after the oldest release
+                    # which is waiting, however many releases have come
+                    # since. A task readied by go() or released afresh
+                    # after being shed has no release time; it's taken to
+                    # be due now
+                    due = task._due if task._due != None else now
+                    deadline = utime.ticks_diff(task.period, -due)
+                    if best != None:
+                        diff = utime.ticks_diff(deadline, best_deadline)
+                        if diff == 0:
+                            diff = utime.ticks_diff(due, best_due)
+                        if diff >= 0:
+                            continue
+                    best = task
+                    best_due = due
+                    best_deadline = deadline
+
+        if best == None:
+            best = untimed
+        if best != None:
+            best._run()
+            return True
+
+        # No task was ready; don't look again until something changes
+        self._dirty = False
+        self._signals = signals
+        return False
+
+
+    ## Release every timed task whose run time has come.
+    #  The heap's first task is the one due soonest, so this stops at the
+    #  first one which isn't yet due. A task which is overdue by more than
+    #  one period is released once and its next run time moved past now.
+    #  A task whose period has been set to @c None is taken out of the heap
+    #  when it reaches the top; it then runs only when @c go() is called.
+    @micropython.native
+    def _release_due(self):
+        timers = self._timers
+        if timers:
+            now = utime.ticks_us()
+            self._now = now
+            while timers:
+                task = timers[0]
+                if task.period == None:
+                    last = timers.pop()
+                    if timers:
+                        timers[0] = last
+                        self._timer_down(0)
+                    continue
+                if utime.ticks_diff(now, task._next_run) <= 0:
+                    break
+                task._release(now)
+                self._timer_down(0)
+                self._dirty = True
+
+
+    ## Run tasks as @c heap_sched() does, sleeping when none is ready.
+    #
+    #  Rather than spinning between deadlines, this scheduler puts the
+    #  processor to sleep until the next interrupt when no task is ready and
+    #  the next timed task isn't due for at least @c idle_min microseconds.
+    #  Interrupts are disabled while deciding to sleep, so an interrupt
+    #  service routine which calls a task's @c go() method in the meantime
+    #  still wakes the processor, and that task runs on the next call. The
+    #  fraction of each second spent asleep is kept in @c idle_fraction.
+    #
+    #  @b Example:
+    #    @code
+    #       while True:
+    #           cotask.task_list.idle_sched ()
+    #    @endcode
+    #  @param edf @c True to choose tasks with @c edf_sched() rather than
+    #         by priority with @c heap_sched()
+    #  @return @c True if a task was run, @c False if no task was ready
+    @micropython.native
+    def idle_sched(self, edf=False) -> bool:
+        ran = self.edf_sched() if edf else self.heap_sched()
+
+        # Once a second, work out what fraction of the time was spent idle
+        elapsed = utime.ticks_diff(self._now, self._idle_since)
+        if elapsed >= 1000000:
+            self.idle_fraction = self._idle_sum / elapsed
+            self._idle_sum = 0
+            self._idle_since = self._now
+            if self.load_warn != None:
+                over = 1.0 - self.idle_fraction > self.load_warn
+                if over and not self._overloaded:
+                    print('cotask: load {:.0f}% is over {:.0f}%'.format(
+                        100.0 * (1.0 - self.idle_fraction),
+                        100.0 * self.load_warn))
+                self._overloaded = over
+
+        if ran:
+            return True
+
+        # Find how long it will be until the next timed task is due
+        start = utime.ticks_us()
+        if self._timers:
+            wait = utime.ticks_diff(self._timers[0]._next_run, start)
+        else:
+            wait = None
+
+        # If managing garbage collection, collect if enough memory has been
+        # used and the gap is long enough; then look for ready tasks again
+        if self._gc_step and (wait == None or wait >= self._gc_need):
+            if gc.mem_alloc() - self._gc_base >= self._gc_step:
+                self._collect(start)
+                return False
+
+        # Don't sleep if the next timed task will be due very soon
+        if wait != None and wait < self.idle_min:
+            return False
+
+        # Sleep unless go() was called since heap_sched() last looked
+        irq_state = pyb.disable_irq()
+        if Task.signals == self._signals:
+            if self.idle_fun is None:
+                pyb.wfi()
+            else:
+                self.idle_fun(wait)
+        pyb.enable_irq(irq_state)
+
+        self._idle_sum += utime.ticks_diff(utime.ticks_us(), start)
+        return False
+
+
+    ## Make the scheduler responsible for garbage collection.
+    #
+    #  Normally the garbage collector runs whenever the memory allocator
+    #  runs out of space, which may be in the middle of a time-critical task.
+    #  After this method is called, @c idle_sched() collects garbage itself
+    #  when at least @c step bytes have been allocated since the last
+    #  collection, but only in an idle gap before the next timed task which
+    #  is longer than the slowest collection so far (or @c budget_us if that
+    #  is longer). As a backstop, @c gc.threshold() is set so that if no
+    #  long enough gap comes along, the allocator collects after
+    #  @c threshold bytes. The time taken by each collection done by the
+    #  scheduler is shown in the task list's diagnostic printout.
+    #  @param step Bytes allocated after which a collection is wanted
+    #  @param threshold Bytes allocated after which the allocator collects
+    #         whether there's a gap or not; the default is four steps
+    #  @param budget_us The shortest gap in microseconds in which to collect
+    def gc_manage(self, step=4096, threshold=None, budget_us=3000):
+        gc.threshold(threshold if threshold else 4 * step)
+        self._gc_step = step
+        self._gc_need = budget_us
+        self._collect(utime.ticks_us())
+
+
+    ## Run the garbage collector and record how long it took.
+    #  @param start The time at which the collection was started
+    def _collect(self, start):
+        gc.collect()
+        gc_time = utime.ticks_diff(utime.ticks_us(), start)
+        self._gc_base = gc.mem_alloc()
+        self._gc_runs += 1
+        self._gc_sum += gc_time
+        if gc_time > self._gc_max:
+            self._gc_max = gc_time
+        if gc_time > self._gc_need:
+            self._gc_need = gc_time
+
+
+    ## Check whether the tasks can meet their deadlines.
+    #
+    #  The analysis in @c schedcheck is run on the periods and measured run
+    #  times of the tasks, so the tasks should be profiled and should have
+    #  run for long enough to have met their slowest cases. Tasks which
+    #  aren't profiled are taken to need no time.
+    #
+    #  @b Example:
+    #    @code
+    #       print (cotask.task_list.analyze ()[0])
+    #    @endcode
+    #  @return A tuple holding a table of results as text, @c True if the
+    #          tasks are schedulable by @c pri_sched() or @c heap_sched(),
+    #          and @c True if they're schedulable by @c edf_sched()
+    def analyze(self):
+        import schedcheck              # Only loaded when it's wanted
+
+        tasks = []
+        for pri in self.pri_list:
+            tasks.extend(pri[2:])
+        tasks.extend(self._hw_tasks)
+        specs = []
+        for task in tasks:
+            timed = task._runs - 2     # The first two runs aren't timed
+            specs.append({'name': task.name, 'priority': task.priority,
+                          'period': task.period, 'wcet': task._slowest,
+                          'avg': task._run_sum // timed if timed > 0 else 0,
+                          'hw': task._timer != None})
+        return schedcheck.analyze(specs)
+
+
+    ## Pack the profiles of all the tasks into @c profile_data.
+    #
+    #  This is a quick and compact alternative to printing the task list,
+    #  suitable for sending over a slow link while the tasks are running;
+    #  @c tools/profile_decode.py turns it back into a table. The data
+    #  begins with a header packed with the format @c PROFILE_HEADER: the
+    #  bytes @c b'CPRF', the number of tasks, the tick count in microseconds
+    #  when the snapshot was taken, the idle time in tenths of a percent
+    #  (0xFFFF if not yet known), and the number of collections made by the
+    #  scheduler and their average and maximum times in microseconds. For
+    #  each task, in the order in which the task list is printed, there
+    #  follows its name, padded with zeros to @c PROFILE_NAME bytes, and the
+    #  fields packed by @c Task.pack_profile(). No memory is allocated
+    #  except, while profiling idle time, for one floating point number.
+    #  @return The number of bytes of @c profile_data which were filled
+    def snapshot(self):
+        buf = self.profile_data
+        offset = struct.calcsize(PROFILE_HEADER)
+        size = PROFILE_NAME + struct.calcsize(PROFILE_RECORD)
+        count = 0
+        for pri in self.pri_list:
+            for idx in range(2, len(pri)):
+                pri[idx].pack_profile(buf, offset + PROFILE_NAME)
+                offset += size
+                count += 1
+        for task in self._hw_tasks:
+            task.pack_profile(buf, offset + PROFILE_NAME)
+            offset += size
+            count += 1
+
+        idle = 0xFFFF
+        if self.idle_fraction != None:
+            idle = int(self.idle_fraction * 1000)
+        struct.pack_into(PROFILE_HEADER, buf, 0, b'CPRF', count,
+                         utime.ticks_us(), idle, min(self._gc_runs, 0xFFFF),
+                         self._gc_sum // self._gc_runs if self._gc_runs else 0,
+                         self._gc_max)
+        return offset
+
+
+    ## A task which sends binary profiles of the task list to a stream.
+    #
+    #  A snapshot is taken every @c interval_ms milliseconds and written a
+    #  few bytes, @c PROFILE_CHUNK, per run, so that even a slow stream such
+    #  as a UART never holds up the other tasks for long. Give this task a
+    #  low priority and a period short enough for the chunks to keep up;
+    #  at 115200 baud, each chunk takes about 1.4 ms to send.
+    #
+    #  @b Example:
+    #    @code
+    #       telemetry = cotask.Task (cotask.task_list.profile_task,
+    #                                name = 'Telemetry', priority = 0,
+    #                                period = 10, shares = (uart, 1000))
+    #    @endcode
+    #  @param shares A tuple holding the stream, an object with a @c write()
+    #         method, and the time in milliseconds between snapshots
+    def profile_task(self, shares):
+        stream, interval_ms = shares
+        interval = int(interval_ms * 1000)
+        chunks = []
+        chunked = 0
+        last = utime.ticks_us()
+        while True:
+            if utime.ticks_diff(utime.ticks_us(), last) < interval:
+                yield 0
+                continue
+            last = utime.ticks_us()
+            size = self.snapshot()
+
+            # The pieces of the buffer to be written are only made when the
+            # size of the profile changes, so that writing doesn't allocate
+            if size != chunked:
+                view = memoryview(self.profile_data)
+                chunks = [view[pos:min(pos + PROFILE_CHUNK, size)]
+                          for pos in range(0, size, PROFILE_CHUNK)]
+                chunked = size
+            for part in chunks:
+                stream.write(part)
+                yield 1
+
+
+    ## Make @c profile_data big enough for a profile of all the tasks, and
+    #  put the tasks' names into it, as they don't change.
+    def _size_profile(self):
+        tasks = []
+        for pri in self.pri_list:
+            tasks.extend(pri[2:])
+        tasks.extend(self._hw_tasks)
+        size = PROFILE_NAME + struct.calcsize(PROFILE_RECORD)
+        offset = struct.calcsize(PROFILE_HEADER)
+        self.profile_data = bytearray(offset + size * len(tasks))
+        for task in tasks:
+            name = task.name.encode()[:PROFILE_NAME]
+            self.profile_data[offset:offset + len(name)] = name
+            offset += size
+
+
+    ## Move the task at the given position in the timer heap up toward the
+    #  top of the heap until no task above it is due later.
+    #  @param pos The index of the task in the timer heap
+    def _timer_up(self, pos):
+        heap = self._timers
+        task = heap[pos]
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if utime.ticks_diff(task._next_run, heap[parent]._next_run) >= 0:
+                break
+            heap[pos] = heap[parent]
+            pos = parent
+        heap[pos] = task
+
+
+    ## Move the task at the given position in the timer heap down toward the
+    #  bottom of the heap until no task below it is due sooner. Times are
+    #  compared with @c ticks_diff() so that the heap survives the wrapping
+    #  around of the microsecond timer.
+    #  @param pos The index of the task in the timer heap
+    @micropython.native
+    def _timer_down(self, pos):
+        heap = self._timers
+        length = len(heap)
+        task = heap[pos]
+        while True:
+            child = 2 * pos + 1
+            if child >= length:
+                break
+            if child + 1 < length and utime.ticks_diff(
+                    heap[child + 1]._next_run, heap[child]._next_run) < 0:
+                child += 1
+            if utime.ticks_diff(heap[child]._next_run, task._next_run) >= 0:
+                break
+            heap[pos] = heap[child]
+            pos = child
+        heap[pos] = task
+
+
     ## Create some diagnostic text showing the tasks in the task list.
     def __repr__(self):
-        ret_str = 'TASK             PRI    PERIOD    RUNS   AVG DUR   MAX ' \
-            'DUR  AVG LATE  MAX LATE\n'
+        ret_str = 'TASK             PRI    PERIOD    RUNS   AVG DUR     P50' \
+            '     P95     P99   MAX DUR  AVG LATE     P50     P95     P99' \
+            '  MAX LATE  MISSES  SHED   B/RUN   MAX B   GCS\n'
         for pri in self.pri_list:
             for task in pri[2:]:
                 ret_str += str(task) + '\n'
+        for task in self._hw_tasks:
+            ret_str += str(task) + '\n'
+
+        if self.idle_fraction != None:
+            ret_str += f"IDLE {(self.idle_fraction * 100.0): 6.1f}%\n"
+
+        if self._gc_runs > 0:
+            ret_str += f"{'GC':<20s}{self._gc_runs: 18d}" \
+                f"{(self._gc_sum / self._gc_runs / 1000.0): 10.3f}" \
+                f"{(self._gc_max / 1000.0): 34.3f}\n"
 
         return ret_str
 
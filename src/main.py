@@ -4,13 +4,14 @@
 # ------------- | ------------- | ------------- | -------------
 # Control  | Controller.Controller.task | 2 | 10
 # Tracker  | Tracker.Tracker.task | 1 | 20
-# DriveR  | MotorEncoderTask.MotorEncoder.task | 3 | 5
-# DriveL  | MotorEncoderTask.MotorEncoder.task| 3 | 5
+# Drive  | MotorEncoderTask.MotorEncoder.task (right, then left), then DriveTrain.DriveTrain.task | 3 | 5
+# Events  | main.events | 4 | 5
 # This file also contains interrupt configuration to allow the bump sensors to turn Romi on or off.
+# The interrupts put their line numbers into a queue which the Events task reads.
 # @code
 # bumpSensors = [Pin.board.PB11, Pin.board.PB14, Pin.board.PB15]
 # for bump in bumpSensors:
-#     pyb.ExtInt(bump, pyb.ExtInt.IRQ_FALLING, Pin.PULL_UP, lambda b: enabled.put(0))
+#     pyb.ExtInt(bump, pyb.ExtInt.IRQ_FALLING, Pin.PULL_UP, buttonEvents.put)
 # @endcode
 
 from pyb import Pin, Timer, USB_VCP, ADC
@@ -20,6 +21,49 @@ import gc
 from Controller import controller
 from Tracker import Tracker
 from MotorEncoderTask import MotorEncoder
+from DriveTrain import DriveTrain
+
+## Set to True to run tasks earliest deadline first rather than by priority.
+#  tools/edf_compare.py shows that EDF makes Control and Tracker less late, at
+#  the cost of making the drive and event tasks later
+USE_EDF = False
+
+## Set to True to measure the memory allocated by each run of the tasks
+MEM_PROFILE = False
+
+## Milliseconds between binary task profiles sent over the Bluetooth UART
+#  (decode them with tools/profile_decode.py), or None to send none
+TELEMETRY_PERIOD = None
+
+## Milliseconds between snapshots of all the shares sent over the Bluetooth UART
+#  (decode them with tools/share_decode.py), or None to send none. Use this or
+#  TELEMETRY_PERIOD, not both, as they'd be mixed up on the same UART
+SHARE_PERIOD = None
+
+## Fraction of the CPU above which a warning is printed once a second's load
+#  goes over it, or None for no warning
+LOAD_WARN = 0.9
+
+## The largest change in each wheel's effort per Drive run [%], or None for no limit
+DRIVE_SLEW = 20
+
+## The external interrupt line of the START/STOP button; the bump sensors use other lines
+BUTTON_LINE = 13
+
+## Handles the button and bump sensor interrupts which have come in since the last run.
+# The START/STOP button turns Romi on or off and a bump sensor turns it off.
+# @param shares A tuple (events, enable) of the queue of interrupt line numbers and the enable share
+def events(shares):
+    queue, enable = shares
+    while True:
+        line = queue.get()
+        while line is not None:
+            if line == BUTTON_LINE:
+                enable.put(0 if enable.get() else 1)
+            else:
+                enable.put(0)
+            line = queue.get()
+        yield 0
 
 if __name__ == '__main__':
     # Bluetooth Configuration
@@ -38,48 +82,74 @@ if __name__ == '__main__':
    
     motorR = MotorEncoder("R",batPin)
     motorL = MotorEncoder("L",batPin)
+    drive = DriveTrain(slew=DRIVE_SLEW)
 
     controller = controller()
     tracker = Tracker()
 
     enabled = task_share.Share('B', thread_protect=False, name="enabled")
-    velocityL = task_share.Share('f', thread_protect=False, name="velocityL")
-    velocityR = task_share.Share('f', thread_protect=False, name="velocityR")
+    # Left and right values are kept in records so they're always written together
+    velocity = task_share.RecordShare('ff', ('left', 'right'), thread_protect=False, name="velocity")
 
-    posL = task_share.Share('L', thread_protect=False, name="posL")
-    posR = task_share.Share('L', thread_protect=False, name="posR")
+    pos = task_share.RecordShare('LL', ('left', 'right'), thread_protect=False, name="pos")
 
     sectionShare = task_share.Share('b', thread_protect=False, name="section")
 
     encoderResetL = task_share.Share('B', thread_protect=False, name="resetL")
     encoderResetR =  task_share.Share('B', thread_protect=False, name="resetR")
 
+    # Written only by the interrupts and read only by the Events task, so it needs no locking
+    buttonEvents = task_share.SPSCQueue('B', 8, stamp=True, name="events")
+
     # User_task = cotask.Task(User, name="User", priority=1, period=100, profile=True, trace=False, shares=(enabled))
-    Control_task = cotask.Task(controller.task, name="Control", priority=2, period=10, profile=True, trace=False, shares=(enabled, velocityL, velocityR, sectionShare))
+    Control_task = cotask.Task(controller.task, name="Control", priority=2, period=10, profile=True, trace=False, mem=MEM_PROFILE, shares=(enabled, velocity, sectionShare))
 
-    MotorR_task = cotask.Task(motorR.task, name="DriveR", priority=3, period=5, profile=True, trace=False, shares=(velocityR, posR, encoderResetR))
+    # Drive and Control always run; Tracker and Telemetry are shed in an overload
+    # Both wheels run in one slot so they're actuated from the same sample instant; the drive train then applies
+    # both efforts back to back
+    Drive_task = cotask.TaskGroup(((motorR.task, (velocity.field('right'), pos.field('right'), encoderResetR)), (motorL.task, (velocity.field('left'), pos.field('left'), encoderResetL)), (drive.task, (motorL, motorR))), name="Drive", priority=3, period=5, profile=True, trace=False, mem=MEM_PROFILE)
 
-    MotorL_task = cotask.Task(motorL.task, name="DriveL", priority=3, period=5, profile=True, trace=False, shares=(velocityL, posL, encoderResetL))
+    Tracker_task = cotask.Task(tracker.task, name="Tracker", priority=1, period = 20, profile=True, shed=cotask.SHED_SLOW, mem=MEM_PROFILE, shares= (enabled, sectionShare, pos, encoderResetL, encoderResetR))
 
-    Tracker_task = cotask.Task(tracker.task, name="Tracker", priority=1, period = 20, shares= (enabled, sectionShare, posL, posR, encoderResetL, encoderResetR))
+    # Button and bump events are handled first so the other tasks see them at once
+    Events_task = cotask.Task(events, name="Events", priority=4, period=5, profile=True, shares=(buttonEvents, enabled))
 
     # cotask.task_list.append(User_task)
+    cotask.task_list.append(Events_task)
     cotask.task_list.append(Control_task)
-    cotask.task_list.append(MotorR_task)
-    cotask.task_list.append(MotorL_task)
+    cotask.task_list.append(Drive_task)
     cotask.task_list.append(Tracker_task)
 
+    if TELEMETRY_PERIOD:
+        Telemetry_task = cotask.Task(cotask.task_list.profile_task, name="Telemetry", priority=0, period=10, profile=True, shed=cotask.SHED_SKIP, shares=(uart, TELEMETRY_PERIOD))
+        cotask.task_list.append(Telemetry_task)
+
+    if SHARE_PERIOD:
+        # Made after all the shares, so that the snapshot includes them
+        snapshot = task_share.Snapshot()
+        Shares_task = cotask.Task(snapshot.task, name="Shares", priority=0, period=5, profile=True, shed=cotask.SHED_SKIP, shares=(uart, SHARE_PERIOD))
+        cotask.task_list.append(Shares_task)
+
     gc.collect()
 
+    # From here on, collect garbage in idle gaps between tasks
+    cotask.task_list.gc_manage()
+    cotask.task_list.load_warn = LOAD_WARN
+
     # START/STOP Button Config
-    pyb.ExtInt(Pin.cpu.C13, pyb.ExtInt.IRQ_FALLING, Pin.PULL_NONE, lambda b: enabled.put(0 if enabled.get() else 1))
+    pyb.ExtInt(Pin.cpu.C13, pyb.ExtInt.IRQ_FALLING, Pin.PULL_NONE, buttonEvents.put)
 
     bumpSensors = [Pin.board.PB11,Pin.board.PB14,Pin.board.PB15]
     for bump in bumpSensors:
-        pyb.ExtInt(bump, pyb.ExtInt.IRQ_FALLING, Pin.PULL_UP, lambda b: enabled.put(0))
+        pyb.ExtInt(bump, pyb.ExtInt.IRQ_FALLING, Pin.PULL_UP, buttonEvents.put)
 
+    # Sleep between task runs rather than spinning; see task_list.idle_fraction
     while True:
         try:
-            cotask.task_list.pri_sched()
+            cotask.task_list.idle_sched(USE_EDF)
         except KeyboardInterrupt:
             break
+
+    # Show how the tasks ran and whether the periods leave enough slack
+    print(cotask.task_list)
+    print(cotask.task_list.analyze()[0])
@@ -0,0 +1,212 @@
+## @file schedcheck.py
+#  This file contains a schedulability analysis for cotask task sets.
+#
+#  Given each task's period and its longest and average measured run times,
+#  it works out the processor utilization and, for each task, a bound on the
+#  time from its release to the end of its run. A task set is schedulable
+#  if every task's bound is within its period, so that each run finishes
+#  before the next one is due. Two schedulers are covered:
+#
+#  * @c pri_sched() and @c heap_sched(), which run the highest priority
+#    ready task to its next @c yield. As tasks can't be preempted, a task
+#    may be blocked by one run of any lower priority task which started just
+#    before it was released, then delayed by every run of higher priority
+#    tasks until it starts. Tasks of equal priority take turns, so each is
+#    treated as being of higher priority than the others. The bounds come
+#    from the response time analysis for non-preemptive fixed priority
+#    scheduling, which checks every run in the longest busy period.
+#  * @c edf_sched(), which runs the ready task whose deadline is soonest.
+#    The task set passes if total utilization is at most one and, at every
+#    deadline in the first busy period, the work due by then plus the
+#    longest run of any task with a later deadline fits before it.
+#
+#  Tasks run by hardware timers preempt the others between bytecodes, so
+#  they add interference but never block. Tasks without a period can't be
+#  bounded; they are counted only as blockers. Scheduler overhead isn't
+#  included, so leave some margin.
+#
+#  Tasks are described by dictionaries with the keys @c name,
+#  @c priority, @c period (microseconds, or @c None), @c wcet and @c avg
+#  (longest and average run times in microseconds) and @c hw (@c True if
+#  run by a hardware timer). @c cotask.TaskList.analyze() makes them from
+#  the task list's profiles; @c tools/sched_check.py from a saved profile.
+
+## The bounds are given up on when a busy period exceeds this many times
+#  the longest period, which happens when the load is too high
+BUSY_LIMIT = 100
+
+
+# Integer division rounding up
+def _ceil_div(num, den):
+    return -(-num // den)
+
+
+## Find the response time bound of a task under @c pri_sched().
+#  @param task The task's dictionary
+#  @param tasks The dictionaries of all the tasks
+#  @return A tuple (bound, blocking) in microseconds; the bound is @c None
+#          if it couldn't be found because the load is too high
+def np_response(task, tasks):
+    timed = [other for other in tasks if other['period'] and not other['hw']]
+    hwt = [other for other in tasks if other['period'] and other['hw']]
+    hp = [other for other in timed if other is not task
+          and other['priority'] >= task['priority']]
+    blocking = 0
+    for other in tasks:
+        if not other['hw'] and other['priority'] < task['priority']:
+            blocking = max(blocking, other['wcet'])
+    cost = task['wcet']
+    period = task['period']
+    limit = BUSY_LIMIT * max(other['period'] for other in timed + hwt)
+
+    # Find the longest busy period in which this task and those which
+    # delay it keep the processor busy, so each run in it can be checked
+    busy = blocking + cost
+    while True:
+        new = blocking
+        for other in hp + [task] + hwt:
+            new += _ceil_div(busy, other['period']) * other['wcet']
+        if new == busy:
+            break
+        if new > limit:
+            return (None, blocking)
+        busy = new
+
+    # For each run in the busy period, find when it can start: after the
+    # blocking run, its earlier runs and every higher priority run released
+    # up to and including that moment
+    worst = 0
+    for run in range(_ceil_div(busy, period)):
+        start = blocking + run * cost
+        while True:
+            new = blocking + run * cost
+            for other in hp:
+                new += (start // other['period'] + 1) * other['wcet']
+            for other in hwt:
+                new += _ceil_div(start + cost, other['period']) * other['wcet']
+            if new == start:
+                break
+            if new > limit:
+                return (None, blocking)
+            start = new
+        worst = max(worst, start + cost - run * period)
+    return (worst, blocking)
+
+
+## Find the response time bound of a task run by a hardware timer. Such a
+#  task runs when its interrupt comes unless another is running.
+#  @param task The task's dictionary
+#  @param tasks The dictionaries of all the tasks
+#  @return The bound in microseconds
+def hw_response(task, tasks):
+    worst = task['wcet']
+    for other in tasks:
+        if other['hw'] and other['period'] and other is not task:
+            worst += other['wcet']
+    return worst
+
+
+## Check whether the timed tasks can be scheduled by @c edf_sched().
+#  @param tasks The dictionaries of all the tasks
+#  @return @c True if every deadline is met, @c False if some may not be
+def edf_ok(tasks):
+    timed = [task for task in tasks if task['period'] and not task['hw']]
+    hwt = [task for task in tasks if task['period'] and task['hw']]
+    if not timed:
+        return True
+    if utilization(tasks, 'wcet') > 1.0:
+        return False
+
+    # The synchronous busy period, blocking included, bounds the deadlines
+    # which need checking
+    most = max(task['wcet'] for task in tasks if not task['hw'])
+    limit = BUSY_LIMIT * max(task['period'] for task in timed + hwt)
+    busy = most
+    while True:
+        new = most
+        for task in timed + hwt:
+            new += _ceil_div(busy, task['period']) * task['wcet']
+        if new == busy:
+            break
+        if new > limit:
+            return False
+        busy = new
+
+    # At each deadline in the busy period, the runs due by then and one
+    # run of a task with a later deadline, or of an untimed task, must fit
+    untimed = 0
+    for task in tasks:
+        if not task['period'] and not task['hw']:
+            untimed = max(untimed, task['wcet'])
+    deadlines = set()
+    for task in timed:
+        for run in range(1, busy // task['period'] + 1):
+            deadlines.add(run * task['period'])
+    for when in sorted(deadlines):
+        demand = 0
+        later = untimed
+        for task in timed:
+            if task['period'] <= when:
+                demand += (when // task['period']) * task['wcet']
+            else:
+                later = max(later, task['wcet'])
+        for task in hwt:
+            demand += _ceil_div(when, task['period']) * task['wcet']
+        if demand + later > when:
+            return False
+    return True
+
+
+## Find the fraction of the processor's time used by the timed tasks.
+#  @param tasks The dictionaries of all the tasks
+#  @param key @c 'avg' for the average use or @c 'wcet' for the worst case
+#  @return The utilization, where 1.0 means fully loaded
+def utilization(tasks, key='avg'):
+    total = 0.0
+    for task in tasks:
+        if task['period']:
+            total += task[key] / task['period']
+    return total
+
+
+## Analyze a task set and describe the results.
+#  @param tasks The dictionaries of all the tasks
+#  @return A tuple holding the text of a table of results, @c True if the
+#          set is schedulable by @c pri_sched(), and @c True if it is
+#          schedulable by @c edf_sched()
+def analyze(tasks):
+    text = 'TASK             PRI    PERIOD   AVG DUR   MAX DUR   UTIL %' \
+        '  BLOCKING  RESPONSE\n'
+    pri_ok = True
+    for task in tasks:
+        text += '{:<16s}{: 4d}'.format(task['name'], task['priority'])
+        if not task['period']:
+            text += '         -{: 10.3f}{: 10.3f}\n'.format(
+                task['avg'] / 1000.0, task['wcet'] / 1000.0)
+            continue
+        if task['hw']:
+            bound = hw_response(task, tasks)
+            blocking = 0
+        else:
+            bound, blocking = np_response(task, tasks)
+        text += '{: 10.1f}{: 10.3f}{: 10.3f}{: 9.1f}{: 10.3f}'.format(
+            task['period'] / 1000.0, task['avg'] / 1000.0,
+            task['wcet'] / 1000.0, 100.0 * task['wcet'] / task['period'],
+            blocking / 1000.0)
+        if bound == None:
+            text += '   UNBOUNDED\n'
+            pri_ok = False
+        else:
+            text += '{: 10.3f}'.format(bound / 1000.0)
+            if bound > task['period']:
+                text += '  MISSES'
+                pri_ok = False
+            text += '\n'
+
+    edf = edf_ok(tasks)
+    text += 'UTILIZATION {: 5.1f}% average, {: 5.1f}% worst case\n'.format(
+        100.0 * utilization(tasks, 'avg'), 100.0 * utilization(tasks, 'wcet'))
+    text += 'pri_sched: {:s}\nedf_sched: {:s}\n'.format(
+        'schedulable' if pri_ok else 'NOT schedulable',
+        'schedulable' if edf else 'NOT schedulable')
+    return (text, pri_ok, edf)
@@ -22,10 +22,17 @@
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import array
+import struct
 import gc
+import utime
 import pyb
 import micropython
 
+try:
+    import uctypes
+except ImportError:
+    uctypes = None
+
 
 ## This is a system-wide list of all the queues and shared variables. It is
 #  used to create diagnostic printouts. 
@@ -40,6 +47,101 @@ type_code_strings = {'b' : "int8",   'B' : "uint8",
                      'f' : "float",  'd' : "double"}
 
 
+## The @c struct format of the header of the layout made by
+#  @c Snapshot. See that class for the fields.
+LAYOUT_HEADER = '<4sBHH'
+
+## The @c struct format of the header of each frame made by
+#  @c Snapshot.take(): the bytes @c b'SFRM', the layout's identifier and the
+#  tick count in microseconds when the frame was taken.
+FRAME_HEADER = '<4sHL'
+
+## The number of bytes of each share's name and format kept in a layout.
+LAYOUT_NAME = 16
+
+## The largest number of bytes written by each run of @c Snapshot.task().
+FRAME_CHUNK = 16
+
+## The number of frames sent by @c Snapshot.task() between layouts
+LAYOUT_EVERY = 50
+
+
+# Standard integer type codes by size in bytes, used to describe native
+# integers in a snapshot's layout
+_INT_CODES = {1: 'b', 2: 'h', 4: 'l', 8: 'q'}
+
+# The uctypes type of each struct type code, used to make typed views of
+# record fields where memoryview.cast() isn't available
+if uctypes != None:
+    _UCTYPES = {'b': uctypes.INT8, 'B': uctypes.UINT8,
+                'h': uctypes.INT16, 'H': uctypes.UINT16,
+                'i': uctypes.INT32, 'I': uctypes.UINT32,
+                'l': uctypes.INT32, 'L': uctypes.UINT32,
+                'q': uctypes.INT64, 'Q': uctypes.UINT64,
+                'f': uctypes.FLOAT32, 'd': uctypes.FLOAT64}
+
+
+## Describe a share's packed bytes with a format which means the same on
+#  any machine.
+#
+#  Native sizes and alignment differ between the board and a PC, so a
+#  share's native type codes are turned into standard ones of the same size,
+#  with pad bytes wherever alignment put gaps between fields. The host can
+#  then decode a snapshot's frames whatever its own native sizes are.
+#  @param order The byte order character of the share's format, or @c ''
+#         for native
+#  @param codes The type code of each field
+#  @param offsets The offset in bytes of each field
+#  @param size The size in bytes of the packed value
+#  @return A @c struct format beginning with @c '<' or @c '>'
+def _portable_format (order, codes, offsets, size):
+    fmt = '>' if order in ('>', '!') else '<'
+    pos = 0
+    for idx in range (len (codes)):
+        code = codes[idx]
+        if offsets[idx] > pos:
+            fmt += str (offsets[idx] - pos) + 'x'
+        width = struct.calcsize (order + code)
+        if code in 'efd':
+            fmt += code
+        elif code.isupper ():
+            fmt += _INT_CODES[width].upper ()
+        else:
+            fmt += _INT_CODES[width]
+        pos = offsets[idx] + width
+    if size > pos:
+        fmt += str (size - pos) + 'x'
+    return fmt
+
+
+## Make a typed view of one field of a packed record, whose element 0 is
+#  the field's value. Reading or writing it needs no @c struct call and
+#  allocates no tuple.
+#  @param buffer The @c bytearray holding the record
+#  @param offset The offset in bytes of the field
+#  @param order The byte order character of the record's format, or @c ''
+#  @param code The type code of the field
+#  @return The view, or @c None if the field can't have one
+def _field_view (buffer, offset, order, code):
+    size = struct.calcsize (order + code)
+    if order in ('', '@'):
+        try:
+            return memoryview (buffer)[offset:offset + size].cast (code)
+        except (AttributeError, TypeError, ValueError):
+            pass
+    if uctypes != None and code in _UCTYPES:
+        if order == '<':
+            kind = uctypes.LITTLE_ENDIAN
+        elif order in ('>', '!'):
+            kind = uctypes.BIG_ENDIAN
+        else:
+            kind = uctypes.NATIVE
+        layout = {'value': (uctypes.ARRAY | 0, _UCTYPES[code] | 1)}
+        return uctypes.struct (uctypes.addressof (buffer) + offset, layout,
+                               kind).value
+    return None
+
+
 ## Create a string holding a diagnostic printout showing the status of
 #  each queue and share in the system. 
 #  @return A string containing information about each queue and share
@@ -138,6 +240,10 @@ class Queue (BaseShare):
             self._buffer = None
             raise
 
+        # A view of the buffer through which blocks of items are copied and
+        # read in place without copying the rest of the buffer
+        self._view = memoryview (self._buffer)
+
         # Initialize pointers to be used for reading and writing data
         self.clear ()
 
@@ -162,6 +268,9 @@ class Queue (BaseShare):
     #                 my_queue.put (create_something_to_put ())
     #             yield 0
     #  @endcode
+    #  In a cooperative scheduler nothing else can run while @c put() waits,
+    #  so a task which might find the queue full should use @c try_put() or
+    #  @c put_many(), which never wait.
     #  @param item The item to be placed into the queue
     #  @param in_ISR Set this to @c True if calling from within an ISR
     @micropython.native
@@ -213,6 +322,9 @@ class Queue (BaseShare):
     #             # More loop stuff
     #             yield 0
     #  @endcode
+    #  In a cooperative scheduler nothing else can run while @c get() waits,
+    #  so a task which might find the queue empty should use @c try_get() or
+    #  @c get_many(), which never wait.
     #  @param in_ISR Set this to @c True if calling from within an ISR
     @micropython.native
     def get (self, in_ISR = False):
@@ -242,6 +354,228 @@ class Queue (BaseShare):
         return (to_return)
 
 
+    ## Put an item into the queue if there's room, without waiting.
+    #
+    #  If the queue is full and the @c overwrite constructor parameter was
+    #  set to @c True, the oldest item is dropped to make room, as by
+    #  @c put_many(), even from within an ISR. The check for room and the write are done with
+    #  interrupts disabled, so an interrupt can't fill the queue in between.
+    #  @param item The item to be placed into the queue
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return @c True if the item was put into the queue, @c False if the
+    #          queue was full and the item was dropped
+    @micropython.native
+    def try_put (self, item, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        stored = self._num_items < self._size or self._overwrite
+        if stored:
+            self._buffer[self._wr_idx] = item
+            self._wr_idx += 1
+            if self._wr_idx >= self._size:
+                self._wr_idx = 0
+
+            # When full, the oldest item was just overwritten; the next
+            # oldest is now the first to be read
+            if self._num_items >= self._size:
+                self._rd_idx = self._wr_idx
+            else:
+                self._num_items += 1
+            if self._num_items > self._max_full:
+                self._max_full = self._num_items
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+        return stored
+
+
+    ## Read an item from the queue if there is one, without waiting.
+    #
+    #  The check for an item and the read are done with interrupts disabled,
+    #  so an interrupt can't empty the queue in between. As any value of the
+    #  queue's type might be an item, @c None is returned for an empty queue
+    #  unless another value is given for @c empty:
+    #  @code
+    #     def some_task ():
+    #         while True:
+    #             something = my_queue.try_get ()
+    #             if something is not None:
+    #                 do_something_with (something)
+    #             yield 0
+    #  @endcode
+    #  @param empty The value to return if the queue is empty
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return The oldest item in the queue, which is removed from it, or
+    #          @c empty if the queue was empty
+    @micropython.native
+    def try_get (self, empty = None, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        to_return = empty
+        if self._num_items > 0:
+            to_return = self._buffer[self._rd_idx]
+            self._rd_idx += 1
+            if self._rd_idx >= self._size:
+                self._rd_idx = 0
+            self._num_items -= 1
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+        return to_return
+
+
+    ## Copy a block of items into the queue without waiting.
+    #
+    #  The items are copied with at most two slice copies, one up to the end
+    #  of the queue's buffer and one from its start. If there isn't room for
+    #  all of them, as many as fit are copied, unless the @c overwrite
+    #  constructor parameter was set to @c True, in which case the oldest
+    #  items in the queue are dropped to make room.
+    #  @code
+    #     samples = array.array ('h', range (64))
+    #     sent = my_queue.put_many (samples)
+    #  @endcode
+    #  @param items An @c array.array of the queue's type code, or a
+    #         @c memoryview of one, holding the items to be put in the queue
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return The number of items which were put into the queue
+    @micropython.native
+    def put_many (self, items, in_ISR = False):
+        size = self._size
+        count = len (items)
+        src = memoryview (items)
+
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        # Make room by dropping the oldest items, or copy only what fits
+        room = size - self._num_items
+        if count > room:
+            if self._overwrite:
+                if count > size:
+                    src = src[count - size:]
+                    count = size
+                drop = count - room
+                self._rd_idx += drop
+                if self._rd_idx >= size:
+                    self._rd_idx -= size
+                self._num_items -= drop
+            else:
+                count = room
+
+        # Copy up to the end of the buffer, then the rest from its start
+        wr_idx = self._wr_idx
+        first = size - wr_idx
+        if first > count:
+            first = count
+        self._view[wr_idx:wr_idx + first] = src[:first]
+        if count > first:
+            self._view[:count - first] = src[first:count]
+        wr_idx += count
+        if wr_idx >= size:
+            wr_idx -= size
+        self._wr_idx = wr_idx
+
+        self._num_items += count
+        if self._num_items > self._max_full:
+            self._max_full = self._num_items
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        return count
+
+
+    ## Copy a block of items out of the queue without waiting.
+    #
+    #  As many items as the buffer can hold, or as are in the queue if
+    #  that's fewer, are copied with at most two slice copies and removed
+    #  from the queue, oldest first.
+    #  @param buf An @c array.array of the queue's type code, or a
+    #         @c memoryview of one, into which items are copied
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return The number of items copied into @c buf, 0 if the queue was
+    #          empty
+    @micropython.native
+    def get_many (self, buf, in_ISR = False):
+        size = self._size
+        dst = memoryview (buf)
+
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        count = len (buf)
+        if count > self._num_items:
+            count = self._num_items
+
+        rd_idx = self._rd_idx
+        first = size - rd_idx
+        if first > count:
+            first = count
+        dst[:first] = self._view[rd_idx:rd_idx + first]
+        if count > first:
+            dst[first:count] = self._view[:count - first]
+        rd_idx += count
+        if rd_idx >= size:
+            rd_idx -= size
+        self._rd_idx = rd_idx
+        self._num_items -= count
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        return count
+
+
+    ## Get a view of the oldest items in the queue without copying them.
+    #
+    #  The view covers the oldest items which lie next to each other in the
+    #  queue's buffer; if the items wrap around the end of the buffer, the
+    #  rest are seen by calling this method again after @c consume(). The
+    #  items stay in the queue until @c consume() removes them, so they must
+    #  be used before more items can overwrite them.
+    #  @code
+    #     while True:
+    #         window = my_queue.window ()
+    #         if not window:
+    #             break
+    #         uart.write (window)
+    #         my_queue.consume (len (window))
+    #  @endcode
+    #  @return A @c memoryview of up to @c num_in() items, empty if the queue
+    #          is empty
+    @micropython.native
+    def window (self):
+        rd_idx = self._rd_idx
+        count = self._size - rd_idx
+        if count > self._num_items:
+            count = self._num_items
+        return self._view[rd_idx:rd_idx + count]
+
+
+    ## Remove items from the queue without reading them, such as the items
+    #  seen through @c window() once they've been used.
+    #  @param count The number of oldest items to remove; no more than are
+    #         in the queue are removed
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    @micropython.native
+    def consume (self, count, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        if count > self._num_items:
+            count = self._num_items
+        self._rd_idx += count
+        if self._rd_idx >= self._size:
+            self._rd_idx -= self._size
+        self._num_items -= count
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+
     ## Check if there are any items in the queue.
     # 
     #  Returns @c True if there are any items in the queue and @c False
@@ -348,12 +682,24 @@ class Share (BaseShare):
     #  @param thread_protect True if mutual exclusion protection is used
     #  @param name A short name for the share, default @c ShareN where @c N
     #         is a serial number for the share
-    def __init__ (self, type_code, thread_protect = True, name = None):
+    #  @param stamp Set to @c True to record the time of each @c put(), so
+    #         that readers can find the data's age with @c age()
+    def __init__ (self, type_code, thread_protect = True, name = None,
+                  stamp = False):
         # First call the parent class initializer
         super ().__init__ (type_code, thread_protect, name)
 
         self._buffer = array.array (type_code, [0])
 
+        ## A count of the writes to the share, which goes up by one with each
+        #  @c put(). A reader can save it and later pass it to
+        #  @c changed_since() to find out whether there's new data.
+        self.seq = 0
+
+        # The tick count in microseconds of the last put(), if stamping
+        self._stamp = stamp
+        self._time = utime.ticks_us ()
+
         self._name = str (name) if name != None \
             else 'Share' + str (Share.ser_num)
         Share.ser_num += 1
@@ -375,6 +721,9 @@ class Share (BaseShare):
             irq_state = pyb.disable_irq ()
 
         self._buffer[0] = data
+        self.seq += 1
+        if self._stamp:
+            self._time = utime.ticks_us ()
 
         # Re-enable interrupts
         if self._thread_protect and not in_ISR:
@@ -402,6 +751,33 @@ class Share (BaseShare):
         return (to_return)
 
 
+    ## Check whether the share has been written since a reader last looked.
+    #  Every @c put() counts as a change, even one which writes the value
+    #  already there.
+    #
+    #  @code
+    #     seen = my_share.seq
+    #     while True:
+    #         if my_share.changed_since (seen):
+    #             seen = my_share.seq
+    #             do_something_with (my_share.get ())
+    #         yield 0
+    #  @endcode
+    #  @param seq The value of @c seq which the reader saw last
+    #  @return @c True if @c put() has been called since @c seq was read
+    @micropython.native
+    def changed_since (self, seq):
+        return (self.seq != seq)
+
+
+    ## Find how long ago the share was last written.
+    #  The share must have been created with @c stamp set to @c True;
+    #  otherwise the time is measured from the share's creation.
+    #  @return The time in microseconds since the last @c put()
+    def age (self):
+        return utime.ticks_diff (utime.ticks_us (), self._time)
+
+
     ## Puts diagnostic information about the share into a string.
     #
     #  Shares are pretty simple, so we just put the name and type. 
@@ -410,3 +786,778 @@ class Share (BaseShare):
                 type_code_strings[self._type_code]))
 
 
+
+
+
+# ============================================================================
+
+## A share which holds a record of several related fields.
+#  The fields are packed with a @c struct format into one preallocated
+#  buffer, and all of them are written by one call to @c put() with
+#  interrupts disabled only once, so a reader never sees some fields from one
+#  write and some from another. Single fields can be read and written too,
+#  and @c field() makes an object which can be given to a task in place of
+#  a @c Share.
+#
+#  An example of the creation and use of a record share is as follows:
+#  @code
+#  import task_share
+#
+#  # This record holds the left and right wheel speeds as floats
+#  speeds = task_share.RecordShare ('ff', ('left', 'right'), name="Speeds")
+#
+#  # Somewhere in one task, put both speeds into the record at once
+#  speeds.put (left_speed, right_speed)
+#
+#  # In another task, read both speeds, or just one of them
+#  left, right = speeds.get ()
+#  right = speeds.get_field (1)
+#  @endcode
+class RecordShare (BaseShare):
+
+    ## A counter used to give serial numbers to records for diagnostic use.
+    ser_num = 0
+
+    ## Create a record share with the given layout.
+    #
+    #  This method allocates the buffer in which the record is kept and works
+    #  out where each field is in it, so that no memory needs to be allocated
+    #  to find fields later.
+    #  @param fmt A @c struct format with one type code for each field, such
+    #         as @c 'ff' or @c '<LLB'; repeat counts aren't allowed
+    #  @param fields A sequence of names for the fields, in order
+    #  @param thread_protect @c True if mutual exclusion protection is used
+    #  @param name A short name for the record, default @c RecordN where @c N
+    #         is a serial number for the record
+    def __init__ (self, fmt, fields, thread_protect = True, name = None):
+        super ().__init__ (fmt, thread_protect, name)
+
+        order = fmt[0] if fmt[0] in '@=<>!' else ''
+        codes = fmt[len (order):]
+        if len (codes) != len (fields):
+            raise ValueError ('A record needs one type code per field')
+
+        self._fmt = fmt
+        self._fields = tuple (fields)
+
+        # The format and position in the buffer of each field. The position
+        # is found from the size up to the end of the field so that padding
+        # before it, which native formats may add, is allowed for
+        self._codes = []
+        self._offsets = []
+        for idx in range (len (codes)):
+            code = order + codes[idx]
+            self._codes.append (code)
+            self._offsets.append (struct.calcsize (order + codes[:idx + 1])
+                                  - struct.calcsize (code))
+
+        self._buffer = bytearray (struct.calcsize (fmt))
+
+        # A typed view of each field, or None for fields reached through
+        # struct. Fields wider than a machine word can't be read or written
+        # in one access, so if interrupts are guarded against they don't get
+        # a view
+        self._views = []
+        for idx in range (len (codes)):
+            if thread_protect and struct.calcsize (self._codes[idx]) > 4:
+                self._views.append (None)
+            else:
+                self._views.append (_field_view (self._buffer,
+                                                 self._offsets[idx], order,
+                                                 codes[idx]))
+
+        ## A @c memoryview of the record's packed bytes, which can be read
+        #  or sent without copying. Offsets of fields are found by
+        #  @c offset().
+        self.view = memoryview (self._buffer)
+
+        self._name = str (name) if name != None \
+            else 'Record' + str (RecordShare.ser_num)
+        RecordShare.ser_num += 1
+
+
+    ## Write all the fields of the record at once.
+    #  @param values One value for each field, in order
+    #  @param in_ISR Set this to True if calling from within an ISR
+    @micropython.native
+    def put (self, *values, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        struct.pack_into (self._fmt, self._buffer, 0, *values)
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+
+    ## Read all the fields of the record at once.
+    #  @param in_ISR Set this to True if calling from within an ISR
+    #  @return A tuple holding the value of each field, in order
+    @micropython.native
+    def get (self, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        to_return = struct.unpack_from (self._fmt, self._buffer, 0)
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        return (to_return)
+
+
+    ## Write one field of the record, leaving the others alone.
+    #  @param index The number of the field, starting at 0
+    #  @param value The value to be written into the field
+    #  @param in_ISR Set this to True if calling from within an ISR
+    @micropython.native
+    def put_field (self, index, value, in_ISR = False):
+        # Compared with 'is', as '!=' would compare a memoryview's contents
+        view = self._views[index]
+        if view is not None:
+            view[0] = value
+            return
+
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        struct.pack_into (self._codes[index], self._buffer,
+                          self._offsets[index], value)
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+
+    ## Read one field of the record.
+    #  @param index The number of the field, starting at 0
+    #  @param in_ISR Set this to True if calling from within an ISR
+    #  @return The value of the field
+    @micropython.native
+    def get_field (self, index, in_ISR = False):
+        view = self._views[index]
+        if view is not None:
+            return view[0]
+
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        to_return = struct.unpack_from (self._codes[index], self._buffer,
+                                        self._offsets[index])[0]
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        return (to_return)
+
+
+    ## Find the number of a field from its name.
+    #  @param name The name of the field
+    #  @return The number of the field, starting at 0
+    def index (self, name):
+        return self._fields.index (name)
+
+
+    ## Find where a field is in @c view.
+    #  @param name The name or number of the field
+    #  @return The offset in bytes of the field from the start of the record
+    def offset (self, name):
+        if isinstance (name, str):
+            name = self._fields.index (name)
+        return self._offsets[name]
+
+
+    ## Make an object through which one field of the record can be used as
+    #  though it were a @c Share, so that tasks which expect a share can be
+    #  given a field of a record instead.
+    #  @param name The name or number of the field
+    #  @return A @c RecordField for the field
+    def field (self, name):
+        if isinstance (name, str):
+            name = self._fields.index (name)
+        return RecordField (self, name)
+
+
+    ## Puts diagnostic information about the record into a string.
+    #
+    #  The record's name, format and field names are shown.
+    def __repr__ (self):
+        return ("{:<12s} Record<{:s}> {:s}".format (self._name, self._fmt,
+                ', '.join (self._fields)))
+
+
+## One field of a @c RecordShare, used in the same way as a @c Share.
+#  These are made by @c RecordShare.field(); they aren't added to
+#  @c share_list, as the record they belong to is already there. Where the
+#  field has a typed view, tasks in a hurry can read and write
+#  @c value[0] directly rather than calling @c get() and @c put().
+#
+#  @code
+#  speed = velocity.field ('left')
+#  speed.value[0] = 2.5
+#  print (speed.value[0])
+#  @endcode
+class RecordField:
+
+    ## Create an object which gets and puts one field of a record.
+    #  @param record The @c RecordShare which holds the field
+    #  @param index The number of the field in the record
+    def __init__ (self, record, index):
+        self._record = record
+        self._index = index
+
+        ## A typed view of the field whose element 0 is the field's value,
+        #  or @c None if the field has no view and must be reached through
+        #  @c get() and @c put()
+        self.value = record._views[index]
+
+
+    ## Write the field.
+    #  @param data The data to be put into the field
+    #  @param in_ISR Set this to True if calling from within an ISR
+    def put (self, data, in_ISR = False):
+        if self.value is not None:
+            self.value[0] = data
+        else:
+            self._record.put_field (self._index, data, in_ISR)
+
+
+    ## Read the field.
+    #  @param in_ISR Set this to True if calling from within an ISR
+    #  @return The value of the field
+    def get (self, in_ISR = False):
+        if self.value is not None:
+            return self.value[0]
+        return self._record.get_field (self._index, in_ISR)
+
+
+
+# ============================================================================
+
+## A queue of records, each holding several fields packed with a @c struct
+#  format, used to pass or log multi-channel samples.
+#
+#  All the records are kept in one preallocated @c bytearray, and a
+#  @c memoryview of each record's slot is made when the queue is created,
+#  so records can be written and read in place without allocating memory.
+#  Unlike @c Queue.put(), nothing here waits for room or for data.
+#
+#  An example of the creation and use of a record queue is as follows:
+#  @code
+#  import struct
+#  import task_share
+#
+#  # Each record holds a time, two wheel positions and a heading
+#  log = task_share.RecordQueue ('<LllH', ('time', 'posL', 'posR', 'head'),
+#                                200, name="Log")
+#
+#  # In one task, write a record straight into the next free slot
+#  slot = log.reserve ()
+#  if slot:
+#      struct.pack_into (log.fmt, slot, 0, now, pos_l, pos_r, heading)
+#      log.commit ()
+#
+#  # In another task, write out all the waiting records in large blocks
+#  while True:
+#      block = log.window ()
+#      if not block:
+#          break
+#      file.write (block)
+#      log.consume (len (block) // log.rec_size)
+#  @endcode
+class RecordQueue (BaseShare):
+
+    ## A counter used to give serial numbers to queues for diagnostic use.
+    ser_num = 0
+
+    ## Initialize a record queue, allocating memory for all its records.
+    #  @param fmt The @c struct format of each record
+    #  @param fields A sequence of names for the fields, used in printouts
+    #  @param size The maximum number of records which the queue can hold
+    #  @param thread_protect @c True if mutual exclusion protection is used
+    #  @param overwrite If @c True, the oldest records are overwritten with
+    #         new ones if the queue becomes full
+    #  @param name A short name for the queue, default @c RecordQueueN where
+    #         @c N is a serial number for the queue
+    def __init__ (self, fmt, fields, size, thread_protect = False,
+                  overwrite = False, name = None):
+        super ().__init__ (fmt, thread_protect, name)
+
+        ## The @c struct format of each record
+        self.fmt = fmt
+
+        ## The size in bytes of each record
+        self.rec_size = struct.calcsize (fmt)
+
+        self._fields = tuple (fields)
+        self._size = size
+        self._overwrite = overwrite
+        self._name = str (name) if name != None \
+            else 'RecordQueue' + str (RecordQueue.ser_num)
+        RecordQueue.ser_num += 1
+
+        # The records' storage, a view of all of it and a view of each slot
+        self._buffer = bytearray (self.rec_size * size)
+        self._view = memoryview (self._buffer)
+        self._slots = [self._view[idx * self.rec_size:
+                                  (idx + 1) * self.rec_size]
+                       for idx in range (size)]
+
+        self.clear ()
+        gc.collect ()
+
+
+    ## Put a record into the queue, packing the given values into it.
+    #
+    #  If the queue is full, the record is dropped unless the @c overwrite
+    #  constructor parameter was set to @c True, in which case the oldest
+    #  record is overwritten.
+    #  @param values One value for each field, in order
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return @c True if the record was put into the queue, @c False if the
+    #          queue was full and the record was dropped
+    @micropython.native
+    def put (self, *values, in_ISR = False):
+        slot = self.reserve ()
+        if slot is None:
+            return False
+        struct.pack_into (self.fmt, slot, 0, *values)
+        self.commit (in_ISR)
+        return True
+
+
+    ## Get the slot into which the next record is to be written.
+    #  The record is packed into the slot, for instance with
+    #  @c struct.pack_into(), then added to the queue by @c commit(). Only
+    #  one record at a time may be reserved.
+    #  @return A @c memoryview of the slot, or @c None if the queue is full
+    #          and mustn't be overwritten
+    @micropython.native
+    def reserve (self):
+        if self._num_items >= self._size and not self._overwrite:
+            return None
+        return self._slots[self._wr_idx]
+
+
+    ## Add the record written into the slot from @c reserve() to the queue.
+    #  If the queue was full, the oldest record is dropped.
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    @micropython.native
+    def commit (self, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        self._wr_idx += 1
+        if self._wr_idx >= self._size:
+            self._wr_idx = 0
+        if self._num_items >= self._size:
+            self._rd_idx = self._wr_idx
+        else:
+            self._num_items += 1
+        if self._num_items > self._max_full:
+            self._max_full = self._num_items
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+
+    ## Read and remove the oldest record in the queue.
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    #  @return A tuple holding the record's fields, or @c None if the queue
+    #          is empty
+    def get (self, in_ISR = False):
+        slot = self.peek ()
+        if slot is None:
+            return None
+        to_return = struct.unpack_from (self.fmt, slot, 0)
+        self.consume (1, in_ISR)
+        return to_return
+
+
+    ## Look at the oldest record in the queue without copying or removing it.
+    #  @return A @c memoryview of the record, or @c None if the queue is
+    #          empty
+    @micropython.native
+    def peek (self):
+        if self._num_items <= 0:
+            return None
+        return self._slots[self._rd_idx]
+
+
+    ## Get a view of the oldest records, which lie next to each other in
+    #  the queue's buffer, without copying them. If the records wrap around
+    #  the end of the buffer, the rest are seen by calling this method again
+    #  after @c consume().
+    #  @return A @c memoryview of whole records, empty if the queue is empty
+    @micropython.native
+    def window (self):
+        rd_idx = self._rd_idx
+        count = self._size - rd_idx
+        if count > self._num_items:
+            count = self._num_items
+        start = rd_idx * self.rec_size
+        return self._view[start:start + count * self.rec_size]
+
+
+    ## Remove the oldest records from the queue, such as those which have
+    #  been used through @c peek() or @c window().
+    #  @param count The number of records to remove; no more than are in the
+    #         queue are removed
+    #  @param in_ISR Set this to @c True if calling from within an ISR
+    @micropython.native
+    def consume (self, count, in_ISR = False):
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        if count > self._num_items:
+            count = self._num_items
+        self._rd_idx += count
+        if self._rd_idx >= self._size:
+            self._rd_idx -= self._size
+        self._num_items -= count
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+
+    ## Check if there are any records in the queue.
+    #  @return @c True if records are in the queue, @c False if not
+    @micropython.native
+    def any (self):
+        return (self._num_items > 0)
+
+
+    ## Check if the queue is full.
+    #  @return @c True if the queue is full
+    @micropython.native
+    def full (self):
+        return (self._num_items >= self._size)
+
+
+    ## Check how many records are in the queue.
+    #  @return The number of records in the queue
+    @micropython.native
+    def num_in (self):
+        return (self._num_items)
+
+
+    ## Remove all records from the queue.
+    def clear (self):
+        self._rd_idx = 0
+        self._wr_idx = 0
+        self._num_items = 0
+        self._max_full = 0
+
+
+    ## This method puts diagnostic information about the queue into a string.
+    #
+    #  It shows the queue's name, format and fields, and the maximum number
+    #  of records and queue size.
+    def __repr__ (self):
+        return ('{:<12s} RecordQueue<{:s}> {:s} Max Full {:d}/{:d}'.format (
+                self._name, self.fmt, ', '.join (self._fields),
+                self._max_full, self._size))
+
+
+
+# ============================================================================
+
+## A queue with one writer and one reader which needs no locking, such as
+#  a queue fed by an interrupt service routine and read by a task.
+#
+#  The writer only changes the write index and the reader only changes the
+#  read index, and each writes the item before moving its index, so
+#  neither ever sees a half finished change by the other and interrupts
+#  needn't be disabled. To tell a full queue from an empty one, one slot is
+#  always left empty, so the queue holds one item fewer than its size.
+#  Neither @c put() nor @c get() allocates memory or waits, so @c put()
+#  can be used directly as an interrupt callback. There must be only one
+#  writer and one reader; use a @c Queue with @c thread_protect otherwise.
+#
+#  An example of the creation and use of such a queue is as follows:
+#  @code
+#  import task_share
+#
+#  # Lines of external interrupts, each with the time at which it happened
+#  events = task_share.SPSCQueue ('B', 16, stamp=True, name="Events")
+#  pyb.ExtInt (Pin.board.PB11, pyb.ExtInt.IRQ_FALLING, Pin.PULL_UP,
+#              events.put)
+#
+#  # In a task, handle each event which has come in
+#  line = events.get ()
+#  while line is not None:
+#      handle (line, events.time)
+#      line = events.get ()
+#  @endcode
+class SPSCQueue (BaseShare):
+
+    ## A counter used to give serial numbers to queues for diagnostic use.
+    ser_num = 0
+
+    ## Initialize a queue, allocating memory for its items.
+    #  @param type_code The type of data items which the queue can hold, as
+    #         for a @c Queue
+    #  @param size The number of slots, one more than the number of items
+    #         which the queue can hold
+    #  @param stamp Set to @c True to record the time of each @c put(),
+    #         which is found in @c time after the item is read
+    #  @param name A short name for the queue, default @c SPSCQueueN where
+    #         @c N is a serial number for the queue
+    def __init__ (self, type_code, size, stamp = False, name = None):
+        super ().__init__ (type_code, False, name)
+
+        self._size = size
+        self._buffer = array.array (type_code, [0] * size)
+        self._stamp = stamp
+        if stamp:
+            self._times = array.array ('L', [0] * size)
+
+        ## The tick count in microseconds at which the item last returned by
+        #  @c get() was put into the queue, if the queue is stamped
+        self.time = 0
+
+        # Changed only by the writer and only by the reader respectively
+        self._wr_idx = 0
+        self._rd_idx = 0
+
+        # The number of items dropped because the queue was full, which is
+        # also changed only by the writer
+        self._dropped = 0
+
+        self._name = str (name) if name != None \
+            else 'SPSCQueue' + str (SPSCQueue.ser_num)
+        SPSCQueue.ser_num += 1
+
+
+    ## Put an item into the queue, if there's room. This is to be called by
+    #  the writer only.
+    #  @param item The item to be placed into the queue
+    #  @return @c True if the item was put into the queue, @c False if the
+    #          queue was full and the item was dropped
+    def put (self, item):
+        wr_idx = self._wr_idx
+        nxt = wr_idx + 1
+        if nxt >= self._size:
+            nxt = 0
+        if nxt == self._rd_idx:
+            self._dropped += 1
+            return False
+
+        self._buffer[wr_idx] = item
+        if self._stamp:
+            self._times[wr_idx] = utime.ticks_us ()
+
+        # Only now can the reader see the item
+        self._wr_idx = nxt
+        return True
+
+
+    ## Read and remove the oldest item in the queue. This is to be called by
+    #  the reader only.
+    #  @return The item, or @c None if the queue is empty
+    def get (self):
+        rd_idx = self._rd_idx
+        if rd_idx == self._wr_idx:
+            return None
+
+        to_return = self._buffer[rd_idx]
+        if self._stamp:
+            self.time = self._times[rd_idx]
+
+        # Only now can the writer reuse the slot
+        rd_idx += 1
+        if rd_idx >= self._size:
+            rd_idx = 0
+        self._rd_idx = rd_idx
+        return (to_return)
+
+
+    ## Check if there are any items in the queue.
+    #  @return @c True if items are in the queue, @c False if not
+    @micropython.native
+    def any (self):
+        return (self._rd_idx != self._wr_idx)
+
+
+    ## Check how many items are in the queue. As the writer may add items
+    #  at any time, the reader may find more than this.
+    #  @return The number of items in the queue
+    @micropython.native
+    def num_in (self):
+        count = self._wr_idx - self._rd_idx
+        if count < 0:
+            count += self._size
+        return (count)
+
+
+    ## This method puts diagnostic information about the queue into a string.
+    #
+    #  It shows the queue's name and type, the number of items in it and
+    #  its capacity, and how many items were dropped because it was full.
+    def __repr__ (self):
+        return ('{:<12s} SPSCQueue<{:s}> In {:d}/{:d} Dropped {:d}'.format (
+                self._name, type_code_strings[self._type_code],
+                self.num_in (), self._size - 1, self._dropped))
+
+
+# ============================================================================
+
+## Binary snapshots of the values of all the shares, for live telemetry.
+#
+#  Where @c show_all() makes a string, which is slow and allocates a lot of
+#  memory, this class works out once where each share's value goes in a
+#  binary frame; each call to @c take() then copies the current values into
+#  the same preallocated frame. Shares and record shares contribute their
+#  values; queues contribute the number of items in them. Shares created
+#  after the snapshot is made aren't included.
+#
+#  A host tool such as @c tools/share_decode.py needs the layout, in
+#  @c layout, to decode frames. The layout begins with a header packed with
+#  the format @c LAYOUT_HEADER: the bytes @c b'SLAY', the number of shares,
+#  the size in bytes of a frame and the layout's identifier. For each share
+#  follow its name and a @c struct format for its value, each padded with
+#  zeros to @c LAYOUT_NAME bytes. The formats use standard sizes, with pad
+#  bytes where native alignment leaves gaps, so that a PC whose native sizes
+#  differ from the board's decodes them correctly. Frames carry the
+#  identifier so that a
+#  frame is only decoded with the layout which describes it.
+#
+#  @b Example:
+#    @code
+#       snap = task_share.Snapshot ()
+#       uart.write (snap.layout)
+#       while True:
+#           size = snap.take ()
+#           uart.write (snap.frame)
+#    @endcode
+class Snapshot:
+
+    ## Work out the layout of frames holding the shares in @c share_list.
+    def __init__ (self):
+        # For each share, the buffer copied into the frame and the offset
+        # and size of its part of the frame; queues' counts are packed
+        self._copies = []
+        self._counts = []
+        offset = struct.calcsize (FRAME_HEADER)
+        entries = []
+        for share in share_list:
+            if isinstance (share, Share):
+                src = share._buffer
+                size = share._buffer.itemsize
+                fmt = _portable_format ('', share._type_code, (0,), size)
+            elif isinstance (share, RecordShare):
+                src = share._buffer
+                size = len (share._buffer)
+                order = share._fmt[0] if share._fmt[0] in '@=<>!' else ''
+                fmt = _portable_format (order,
+                                        [code[-1] for code in share._codes],
+                                        share._offsets, size)
+            else:
+                fmt = '<H'
+                src = None
+                size = 2
+
+            # A value whose format can't be described in the room a layout
+            # has for it, or doesn't match its size, is sent as raw bytes
+            if len (fmt) > LAYOUT_NAME or struct.calcsize (fmt) != size:
+                fmt = '<' + str (size) + 's'
+            if src is None:
+                self._counts.append ((share, offset))
+            else:
+                self._copies.append ((src, offset, offset + size))
+            entries.append ((share._name, fmt))
+            offset += size
+
+        ## The size in bytes of each frame
+        self.size = offset
+
+        ## The frame into which @c take() copies the shares' values
+        self.frame = bytearray (offset)
+
+        # Pack the layout, then give it an identifier made from its contents
+        head = struct.calcsize (LAYOUT_HEADER)
+        layout = bytearray (head + 2 * LAYOUT_NAME * len (entries))
+        pos = head
+        for name, fmt in entries:
+            for text in (name, fmt):
+                text = text.encode ()[:LAYOUT_NAME]
+                layout[pos:pos + len (text)] = text
+                pos += LAYOUT_NAME
+        struct.pack_into (LAYOUT_HEADER, layout, 0, b'SLAY', len (entries),
+                          offset, 0)
+
+        ## A number which identifies this layout; frames carry it too
+        self.ident = sum (layout) & 0xFFFF
+
+        struct.pack_into (LAYOUT_HEADER, layout, 0, b'SLAY', len (entries),
+                          offset, self.ident)
+
+        ## The packed layout, which a host needs in order to decode frames
+        self.layout = bytes (layout)
+
+
+    ## Copy the current values of all the shares into @c frame.
+    #  Interrupts are disabled while the values are copied, so the frame
+    #  shows all the shares as they were at one instant.
+    #  @return The size in bytes of the frame
+    @micropython.native
+    def take (self):
+        frame = self.frame
+        irq_state = pyb.disable_irq ()
+        for src, start, end in self._copies:
+            frame[start:end] = src
+        for queue, start in self._counts:
+            struct.pack_into ('<H', frame, start, queue.num_in ())
+        pyb.enable_irq (irq_state)
+        struct.pack_into (FRAME_HEADER, frame, 0, b'SFRM', self.ident,
+                          utime.ticks_us ())
+        return self.size
+
+
+    ## A task which sends snapshots of the shares to a stream.
+    #
+    #  A frame is taken every @c interval_ms milliseconds and written a few
+    #  bytes, @c FRAME_CHUNK, per run, so that a slow stream never holds up
+    #  the other tasks for long. The layout is sent before the first frame
+    #  and again every @c LAYOUT_EVERY frames, so that a host which starts
+    #  listening late can still decode the frames.
+    #
+    #  @b Example:
+    #    @code
+    #       snap = task_share.Snapshot ()
+    #       telemetry = cotask.Task (snap.task, name = 'Shares',
+    #                                priority = 0, period = 5,
+    #                                shares = (uart, 20))
+    #    @endcode
+    #  @param shares A tuple holding the stream, an object with a @c write()
+    #         method, and the time in milliseconds between frames
+    def task (self, shares):
+        stream, interval_ms = shares
+        interval = int (interval_ms * 1000)
+
+        # The pieces of the layout and frame are made once so that writing
+        # them doesn't allocate memory
+        layout = memoryview (self.layout)
+        layout_chunks = [layout[pos:pos + FRAME_CHUNK]
+                         for pos in range (0, len (layout), FRAME_CHUNK)]
+        frame = memoryview (self.frame)
+        frame_chunks = [frame[pos:pos + FRAME_CHUNK]
+                        for pos in range (0, self.size, FRAME_CHUNK)]
+
+        frames = 0
+        last = utime.ticks_us ()
+        while True:
+            if utime.ticks_diff (utime.ticks_us (), last) < interval:
+                yield 0
+                continue
+            last = utime.ticks_us ()
+
+            if frames % LAYOUT_EVERY == 0:
+                for part in layout_chunks:
+                    stream.write (part)
+                    yield 1
+            frames += 1
+
+            self.take ()
+            for part in frame_chunks:
+                stream.write (part)
+                yield 2
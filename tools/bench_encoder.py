@@ -0,0 +1,118 @@
+## @file bench_encoder.py
+#  Measures what @c Encoder.update() and @c get_velocity() cost per call,
+#  before and after the integer fast path.
+#
+#  The "before" figures come from a copy of the original code, which read
+#  the timer's period on every update and worked with floats; the "after"
+#  figures come from the current @c Encoder. Both run against a stand-in
+#  @c pyb.Timer whose counter moves on by a few ticks each time it's read,
+#  so that the count changes on every update. Calls are timed as by
+#  @c bench_runtime.py, with the cost of the loop taken off.
+#
+#  Usage: @c python3 bench_encoder.py [--calls N]
+
+import sys
+
+import host
+import pyb
+from utime import ticks_us, ticks_diff
+import Encoder
+from bench_runtime import measure, CALLS, REPEATS, IMPL, _nothing
+
+
+## A stand-in timer whose counter moves on by a few ticks at each read,
+#  wrapping around as a 16 bit encoder counter does.
+class MovingTimer(pyb.Timer):
+
+    def counter(self, value=None):
+        if value is not None:
+            self._counter = value
+            return
+        self._counter = (self._counter + 7) & self._period
+        return self._counter
+
+
+## The encoder as it was before the integer fast path, kept to measure it.
+class OldEncoder(Encoder.Encoder):
+
+    def update(self):
+        curr_count = self.tim.counter()
+        curr_t = ticks_us()
+        dcount = curr_count - self.prev_count
+        AR = self.tim.period()
+        if dcount > (AR + 1)/2:
+            dcount -= (AR + 1)
+        elif dcount < -(AR + 1)/2:
+            dcount += (AR + 1)
+        self.position += dcount
+        self.prev_count = curr_count
+        self.delta = dcount
+        self.dt = ticks_diff(curr_t, self.prev_t)
+        self.prev_t = curr_t
+
+    def get_velocity(self):
+        return int(self.delta/self.dt * 1000000)
+
+
+## Make an encoder of the given class which reads a moving timer.
+def make(cls):
+    Encoder.Timer = MovingTimer
+    try:
+        encoder = cls(1, None, None)
+    finally:
+        Encoder.Timer = pyb.Timer
+    encoder.update()
+
+    # Make sure the time between updates is never zero for get_velocity()
+    encoder.dt = 5000
+    encoder.delta = 7
+    return encoder
+
+
+## Time calls to a function, less the time taken by the loop.
+#  @return A tuple (nanoseconds per call, bytes per call or @c None)
+def per_call(fun, calls):
+    base = min(measure(_nothing, None, None, calls)[0]
+               for _ in range(REPEATS))
+    runs = [measure(fun, None, None, calls) for _ in range(REPEATS)]
+    ns = min(run[0] for run in runs)
+    mem = runs[0][1]
+    return (max(ns - base, 0) / calls, None if mem is None else mem / calls)
+
+
+def main():
+    calls = CALLS
+    args = sys.argv[1:]
+    if len(args) == 2 and args[0] == '--calls':
+        calls = int(args[1])
+    elif args:
+        print('Usage: python3 bench_encoder.py [--calls N]')
+        sys.exit(2)
+
+    # Each case gets fresh encoders, as timing update() on the real clock
+    # can leave the time between updates at zero
+    cases = (('Encoder.update', 'update', True),
+             ('get_velocity', 'get_velocity', True),
+             ('get_velocity_fp', 'get_velocity_fp', False))
+
+    print('{:s}, {:d} calls each'.format(IMPL, calls))
+    print('{:<18s} {:>10s} {:>10s} {:>10s} {:>10s} {:>8s}'.format(
+        'CALL', 'BEFORE NS', 'BYTES', 'AFTER NS', 'BYTES', 'SPEEDUP'))
+    for name, method, has_old in cases:
+        before = getattr(make(OldEncoder), method) if has_old else None
+        after = getattr(make(Encoder.Encoder), method)
+        new_ns, new_mem = per_call(after, calls)
+        if before is None:
+            old_ns, old_mem = None, None
+        else:
+            old_ns, old_mem = per_call(before, calls)
+        print('{:<18s} {:>10s} {:>10s} {:10.1f} {:>10s} {:>8s}'.format(
+            name, '-' if old_ns is None else '{:.1f}'.format(old_ns),
+            '-' if old_mem is None else '{:.1f}'.format(old_mem),
+            new_ns, '-' if new_mem is None else '{:.1f}'.format(new_mem),
+            '-' if old_ns is None or not new_ns
+            else '{:.2f}'.format(old_ns / new_ns)))
+
+
+if __name__ == '__main__':
+    main()
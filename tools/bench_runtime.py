@@ -0,0 +1,328 @@
+## @file bench_runtime.py
+#  Measures what the cooperative runtime's hot paths cost per call.
+#
+#  The primitives which every task uses every run, @c Task.ready(),
+#  @c Task.schedule(), @c Share.put() and @c get(), @c RecordField.put() and
+#  @c get() and @c Queue.put() and @c get(), are each called many times in a tight loop. The program prints
+#  the net time per call, the calls per second which that allows and the
+#  heap bytes allocated per call. The time taken by the loop and by calling
+#  an empty function with the same arguments is measured separately and
+#  taken off, so what's left is the cost of the primitive itself.
+#
+#  Each primitive is measured twice: once as imported, with the
+#  @c \@micropython.native decorators in force, and once from a copy of the
+#  source with those decorators removed, which shows how much the native
+#  code emitter actually helps. Under CPython the decorators do nothing, so
+#  the two should agree and any difference between them is noise.
+#
+#  The program runs under CPython and under the MicroPython unix port, using
+#  the stand-in modules in @c tools/stubs. Allocation can only be measured
+#  where @c gc.mem_alloc() exists, which is under MicroPython.
+#
+#  Results can be saved to a JSON file and later runs compared against it.
+#  Each interpreter's results are kept separately in the file. The
+#  comparison fails, with exit status 1, if a primitive has become slower
+#  than the baseline by more than the tolerance or allocates more than it
+#  did. Timings only mean something when compared on the same machine.
+#  A CPython baseline is kept in @c bench_baseline.json, made with
+#  @c --save on the machine on which the runtime's hot paths were last
+#  tuned; save a new one before comparing on a different machine, and save
+#  it again after a change which is meant to make a primitive faster.
+#
+#  Usage: @c python3 bench_runtime.py [--calls N] [--save FILE]
+#         [--compare FILE] [--tolerance FRACTION]
+
+import sys
+import gc
+import json
+import time
+
+import host
+import cotask
+import task_share
+
+## The default number of calls made to each primitive
+CALLS = 100000
+
+## The number of times each measurement is repeated; the fastest is kept,
+#  as it's the one least disturbed by whatever else the computer was doing
+REPEATS = 3
+
+## The default fraction by which a primitive may be slower than its
+#  baseline before the comparison fails
+TOLERANCE = 0.25
+
+## The number of items in the queues used for the queue measurements, which
+#  is also the number of calls timed between refilling or emptying a queue
+QUEUE_SIZE = 500
+
+## The name of the interpreter, under which results are saved
+IMPL = sys.implementation.name
+
+
+# Use the best clock each interpreter has, in nanoseconds
+if hasattr(time, 'perf_counter_ns'):
+    _clock_ns = time.perf_counter_ns
+
+    def _elapsed_ns(start):
+        return time.perf_counter_ns() - start
+else:
+    def _clock_ns():
+        return time.ticks_us()
+
+    def _elapsed_ns(start):
+        return time.ticks_diff(time.ticks_us(), start) * 1000
+
+# Heap allocation can only be measured under MicroPython
+_mem_alloc = getattr(gc, 'mem_alloc', None)
+
+
+## Load a copy of one of the robot's modules with its @c \@micropython.native
+#  and @c \@micropython.viper decorators removed.
+#  @param name The module's name, such as @c 'cotask'
+#  @return A dictionary holding the copy's globals
+def load_plain(name):
+    with open(host.SRC_DIR + '/' + name + '.py') as src:
+        lines = src.read().split('\n')
+    for num in range(len(lines)):
+        text = lines[num].strip()
+        if text.startswith('@micropython.native') \
+                or text.startswith('@micropython.viper'):
+            lines[num] = ''             # Keep line numbers the same
+    space = {'__name__': name + '_plain'}
+    exec('\n'.join(lines), space)
+    return space
+
+
+## Adapt a module, or the globals of a copy made by @c load_plain(), so
+#  either can be used with @c getattr()-style access.
+class Namespace:
+    def __init__(self, space):
+        self.__dict__.update(space)
+
+
+# Functions which do nothing, used to measure the overhead of the loops
+def _nothing():
+    pass
+
+
+def _nothing_arg(arg):
+    pass
+
+
+## Set up the primitives to be measured.
+#  @param cotask_mod The @c cotask module, or a copy of it
+#  @param share_mod The @c task_share module, or a copy of it
+#  @return A list of (name, function, argument, refill) tuples. If the
+#          argument isn't @c None the function is called with it. If refill
+#          isn't @c None it's called, untimed, before each batch of calls
+def make_cases(cotask_mod, share_mod):
+    cases = []
+
+    # A periodic task which isn't due, the usual case for ready()
+    idle = cotask_mod.Task(_idle_task, name='Idle', period=1000000)
+    cases.append(('Task.ready', idle.ready, None, None))
+
+    # Tasks whose generators set their own go flags, so they run each time
+    holder = [None]
+    busy = cotask_mod.Task(_busy_task, name='Busy', shares=holder)
+    holder[0] = busy
+    busy.go()
+    cases.append(('Task.schedule', busy.schedule, None, None))
+
+    holder = [None]
+    prof = cotask_mod.Task(_busy_task, name='Prof', profile=True,
+                           shares=holder)
+    holder[0] = prof
+    prof.go()
+    cases.append(('Task.schedule prof', prof.schedule, None, None))
+
+    share = share_mod.Share('h', name='Bench')
+    cases.append(('Share.put', share.put, 1, None))
+    cases.append(('Share.get', share.get, None, None))
+
+    record = share_mod.RecordShare('ff', ('left', 'right'),
+                                   thread_protect=False, name='Bench')
+    field = record.field('right')
+    cases.append(('RecordField.put', field.put, 1.0, None))
+    cases.append(('RecordField.get', field.get, None, None))
+
+    queue = share_mod.Queue('h', QUEUE_SIZE, name='Bench')
+    cases.append(('Queue.put', queue.put, 1, queue.clear))
+
+    def fill():
+        queue.clear()
+        for _ in range(QUEUE_SIZE):
+            queue.put(1)
+
+    cases.append(('Queue.get', queue.get, None, fill))
+    return cases
+
+
+# A task which is never run
+def _idle_task():
+    while True:
+        yield 0
+
+
+# A task which asks to be run again each time it runs. Its only share is a
+# list which holds the task itself once it has been created
+def _busy_task(holder):
+    task = holder[0]
+    while True:
+        task.go_flag = True
+        yield 0
+
+
+## Call a function many times and measure the time and memory it takes.
+#  @param fun The function to be called
+#  @param arg The argument to pass, or @c None to call with no argument
+#  @param refill A function to call untimed before each batch of calls, or
+#         @c None if the calls needn't be batched
+#  @param calls The number of calls to make
+#  @return A tuple (nanoseconds, bytes allocated or @c None)
+def measure(fun, arg, refill, calls):
+    batch = QUEUE_SIZE if refill else calls
+    total = 0
+    alloc = 0
+    gc.collect()
+    gc.disable()
+    try:
+        done = 0
+        while done < calls:
+            count = min(batch, calls - done)
+            if refill:
+                refill()
+            mem = _mem_alloc() if _mem_alloc else 0
+            start = _clock_ns()
+            if arg is None:
+                for _ in range(count):
+                    fun()
+            else:
+                for _ in range(count):
+                    fun(arg)
+            total += _elapsed_ns(start)
+            if _mem_alloc:
+                alloc += _mem_alloc() - mem
+            done += count
+    finally:
+        gc.enable()
+    return (total, alloc if _mem_alloc else None)
+
+
+## Measure every primitive in one version of the modules.
+#  @param cotask_mod The @c cotask module, or a copy of it
+#  @param share_mod The @c task_share module, or a copy of it
+#  @param calls The number of calls to make to each primitive
+#  @return A list of (name, nanoseconds per call, bytes per call or @c None)
+def run(cotask_mod, share_mod, calls):
+    results = []
+    for name, fun, arg, refill in make_cases(cotask_mod, share_mod):
+        empty = _nothing if arg is None else _nothing_arg
+        base_ns, base_mem = measure(empty, arg, refill, calls)
+        ns, mem = measure(fun, arg, refill, calls)
+        for _ in range(REPEATS - 1):
+            base_ns = min(base_ns, measure(empty, arg, refill, calls)[0])
+            ns = min(ns, measure(fun, arg, refill, calls)[0])
+        per_call = max(ns - base_ns, 0) / calls
+        per_alloc = None if mem is None else max(mem - base_mem, 0) / calls
+        results.append((name, per_call, per_alloc))
+    return results
+
+
+## Compare results with a saved baseline.
+#  @param results A dictionary of results as saved by this program
+#  @param baseline A dictionary of results from the baseline file
+#  @param tolerance The fraction by which a primitive may be slower
+#  @return A list of strings describing the regressions found
+def compare(results, baseline, tolerance):
+    problems = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        new = results[key]
+        old = baseline[key]
+        if new['calls_per_s'] < old['calls_per_s'] * (1.0 - tolerance):
+            problems.append('{:s}: {:.0f} calls/s, baseline {:.0f}'.format(
+                key, new['calls_per_s'], old['calls_per_s']))
+        if new['bytes_per_call'] is not None \
+                and old['bytes_per_call'] is not None \
+                and new['bytes_per_call'] > old['bytes_per_call'] + 0.5:
+            problems.append('{:s}: {:.1f} bytes/call, baseline {:.1f}'.format(
+                key, new['bytes_per_call'], old['bytes_per_call']))
+    return problems
+
+
+def main():
+    calls = CALLS
+    tolerance = TOLERANCE
+    save_path = None
+    compare_path = None
+    args = sys.argv[1:]
+    while args:
+        opt = args.pop(0)
+        if opt == '--calls':
+            calls = int(args.pop(0))
+        elif opt == '--save':
+            save_path = args.pop(0)
+        elif opt == '--compare':
+            compare_path = args.pop(0)
+        elif opt == '--tolerance':
+            tolerance = float(args.pop(0))
+        else:
+            print('Unknown option', opt)
+            sys.exit(2)
+
+    plain_cotask = Namespace(load_plain('cotask'))
+    plain_share = Namespace(load_plain('task_share'))
+    native = run(cotask, task_share, calls)
+    plain = run(plain_cotask, plain_share, calls)
+
+    print('{:s}, {:d} calls each'.format(IMPL, calls))
+    print('{:<20s} {:>10s} {:>12s} {:>10s} {:>10s} {:>8s}'.format(
+        'PRIMITIVE', 'NS/CALL', 'CALLS/S', 'BYTES/CALL', 'PLAIN NS',
+        'SPEEDUP'))
+    results = {}
+    for (name, ns, mem), (_, plain_ns, plain_mem) in zip(native, plain):
+        print('{:<20s} {:10.1f} {:12.0f} {:>10s} {:10.1f} {:8.2f}'.format(
+            name, ns, 1e9 / ns if ns else 0.0,
+            '-' if mem is None else '{:.1f}'.format(mem),
+            plain_ns, plain_ns / ns if ns else 0.0))
+        for variant, var_ns, var_mem in (('native', ns, mem),
+                                         ('plain', plain_ns, plain_mem)):
+            results[name + '/' + variant] = {
+                'ns_per_call': var_ns,
+                'calls_per_s': 1e9 / var_ns if var_ns else 1e9,
+                'bytes_per_call': var_mem}
+
+    status = 0
+    if compare_path:
+        with open(compare_path) as src:
+            saved = json.load(src)
+        if IMPL not in saved:
+            print('No {:s} baseline in {:s}'.format(IMPL, compare_path))
+        else:
+            problems = compare(results, saved[IMPL], tolerance)
+            for problem in problems:
+                print('REGRESSION', problem)
+            if problems:
+                status = 1
+            else:
+                print('No regressions against', compare_path)
+
+    if save_path:
+        try:
+            with open(save_path) as src:
+                saved = json.load(src)
+        except OSError:
+            saved = {}
+        saved[IMPL] = results
+        with open(save_path, 'w') as dst:
+            json.dump(saved, dst)
+        print('Saved results to', save_path)
+
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
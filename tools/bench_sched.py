@@ -0,0 +1,101 @@
+## @file bench_sched.py
+#  Compares the cost of dispatching tasks with @c TaskList.pri_sched() and
+#  @c TaskList.heap_sched() on a PC.
+#
+#  The tasks run against a virtual clock which moves forward a fixed step
+#  between calls to the scheduler, so both schedulers see exactly the same
+#  sequence of times. For each number of tasks the program prints the real
+#  time taken per call to the scheduler, the number of clock reads per call
+#  and the number of task runs, which should match between the schedulers.
+#
+#  Usage: @c python3 bench_sched.py [seconds_of_virtual_time]
+
+import sys
+import time
+
+import host
+import utime
+import cotask
+
+## Numbers of tasks for which the schedulers are compared
+TASK_COUNTS = (4, 16, 64)
+
+## Periods in milliseconds given to the tasks in turn
+PERIODS = (5, 5, 10, 20, 50, 100)
+
+## Virtual time between calls to the scheduler, in microseconds
+STEP_US = 50
+
+
+# The number of times any task has run
+_runs = 0
+
+
+## A task which does nothing but count its runs and yield.
+def idle_task():
+    global _runs
+    while True:
+        _runs += 1
+        yield 0
+
+
+## Create a task list holding the given number of tasks.
+#  @param count The number of tasks to create
+#  @return The new task list
+def make_list(count):
+    utime.set_time(0)
+    tasks = cotask.TaskList()
+    for num in range(count):
+        tasks.append(cotask.Task(idle_task, name='T' + str(num),
+                                 priority=num % 4,
+                                 period=PERIODS[num % len(PERIODS)]))
+    return tasks
+
+
+## Run one scheduler against the virtual clock and time it.
+#  @param count The number of tasks in the list
+#  @param method_name The name of the @c TaskList scheduler method to use
+#  @param duration The length of virtual time to run, in microseconds
+#  @return A tuple (microseconds per call, clock reads per call, task runs)
+def run(count, method_name, duration):
+    tasks = make_list(count)
+    sched = getattr(tasks, method_name)
+
+    # Count the clock reads by wrapping the stand-in clock function
+    reads = [0]
+    ticks_us = utime.ticks_us
+
+    def counting_ticks_us():
+        reads[0] += 1
+        return ticks_us()
+
+    utime.ticks_us = counting_ticks_us
+    global _runs
+    _runs = 0
+    calls = duration // STEP_US
+    try:
+        start = time.perf_counter()
+        for _ in range(calls):
+            utime.advance(STEP_US)
+            sched()
+        elapsed = time.perf_counter() - start
+    finally:
+        utime.ticks_us = ticks_us
+
+    return (elapsed * 1e6 / calls, reads[0] / calls, _runs)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    duration = int(seconds * 1000000)
+    print('{:>6s}  {:<10s} {:>10s} {:>12s} {:>8s}'.format(
+        'TASKS', 'SCHEDULER', 'US/CALL', 'READS/CALL', 'RUNS'))
+    for count in TASK_COUNTS:
+        for method_name in ('pri_sched', 'heap_sched'):
+            per_call, reads, runs = run(count, method_name, duration)
+            print('{:6d}  {:<10s} {:10.2f} {:12.2f} {:8d}'.format(
+                count, method_name, per_call, reads, runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+## @file cosim.py
+#  Simulates the robot's task schedule on a PC against a virtual clock.
+#
+#  The stand-in modules from @c tools/stubs take the place of @c utime,
+#  @c micropython and @c pyb, so the real @c cotask scheduler runs here.
+#  Tasks are replaced by stand-ins which take a given amount of virtual
+#  time per run, and whenever no task is ready the clock jumps straight to
+#  the next event, so a minute of the robot's schedule takes well under a
+#  second to simulate. Runs are deterministic, which makes the simulator
+#  useful for regression tests of task timing and for trying out period and
+#  priority changes before flashing the robot.
+#
+#  The task set is read from the @c cotask.Task() and @c cotask.TaskGroup()
+#  calls in @c src/main.py, so it follows changes made there. Calls inside
+#  an @c if statement whose test is a module constant set to @c None,
+#  @c False or zero, such as @c TELEMETRY_PERIOD, are left out.
+#
+#  @b Example:
+#  @code
+#  python3 cosim.py --seconds 60 --period Tracker=30 --cost Control=2500
+#  @endcode
+
+import argparse
+import ast
+import time
+
+import host
+import utime
+import cotask
+
+## Run times in microseconds used for tasks for which none is given. These
+#  are rough figures; replace them with the average durations from the
+#  robot's task table for accurate results.
+DEFAULT_COSTS = {'Control': 1500, 'Tracker': 800,
+                 'DriveR': 600, 'DriveL': 600, 'Drive': 1200,
+                 'Telemetry': 1400, 'Events': 50}
+
+## Run time in microseconds of tasks which aren't in @c DEFAULT_COSTS
+OTHER_COST = 500
+
+
+## Read the task set from @c main.py.
+#  @param path The path to the main program
+#  @return A list of dictionaries, one per task, with the keys @c name,
+#          @c priority, @c period, @c timer and @c shed taken from the
+#          arguments of each @c cotask.Task() or @c cotask.TaskGroup() call
+def main_tasks(path=host.SRC_DIR + '/main.py'):
+    with open(path) as file:
+        tree = ast.parse(file.read())
+
+    # Leave out code which main.py's own settings switch off
+    consts = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 \
+                and isinstance(node.targets[0], ast.Name):
+            try:
+                consts[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+    for node in ast.walk(tree):
+        if isinstance(node, ast.If) and isinstance(node.test, ast.Name) \
+                and node.test.id in consts and not consts[node.test.id]:
+            node.body = []
+
+    tasks = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ('Task', 'TaskGroup')):
+            spec = {'name': 'NoName', 'priority': 0, 'period': None,
+                    'timer': None, 'shed': cotask.SHED_RUN}
+            for keyword in node.keywords:
+                # Overload policies are given as cotask constants
+                if isinstance(keyword.value, ast.Attribute) \
+                        and keyword.value.attr.startswith('SHED_'):
+                    spec[keyword.arg] = getattr(cotask, keyword.value.attr)
+                elif keyword.arg in spec:
+                    try:
+                        spec[keyword.arg] = ast.literal_eval(keyword.value)
+                    except ValueError:
+                        pass
+            tasks.append(spec)
+    tasks.sort(key=lambda spec: spec['name'])
+    return tasks
+
+
+## Make a stand-in task function which takes virtual time when it runs.
+#  @param cost The run time in microseconds: a number, a sequence of
+#         numbers used in turn, or a function which is given the number of
+#         the run (starting at 0) and returns a run time
+#  @param step If given, the run time is taken in steps of this many
+#         microseconds, so that tasks run by timers can interrupt it
+#  @return A generator function for use with @c cotask.Task
+def cost_task(cost, step=None):
+    if callable(cost):
+        cost_of = cost
+    elif isinstance(cost, (tuple, list)):
+        cost_of = lambda run: cost[run % len(cost)]
+    else:
+        cost_of = lambda run: cost
+
+    def run():
+        runs = 0
+        while True:
+            remaining = cost_of(runs)
+            runs += 1
+            while step and remaining > step:
+                utime.advance(step)
+                remaining -= step
+            utime.advance(remaining)
+            yield 0
+    return run
+
+
+## Build a task list from task descriptions, on a fresh virtual clock.
+#  @param specs Task descriptions as returned by @c main_tasks()
+#  @param costs A dictionary of run times by task name, each as accepted
+#         by @c cost_task(); @c DEFAULT_COSTS fills in the rest
+#  @param step The step size passed to @c cost_task()
+#  @return The new task list
+def build(specs, costs=None, step=None):
+    utime.set_time(0)
+    costs = costs or {}
+    tasks = cotask.TaskList()
+    for spec in specs:
+        cost = costs.get(spec['name'],
+                         DEFAULT_COSTS.get(spec['name'], OTHER_COST))
+        tasks.append(cotask.Task(cost_task(cost, step), name=spec['name'],
+                                 priority=spec['priority'],
+                                 period=spec['period'], profile=True,
+                                 timer=spec['timer'],
+                                 shed=spec.get('shed', cotask.SHED_RUN)))
+    return tasks
+
+
+## Run a task list for a given length of virtual time.
+#  Whenever @c idle_sched() finds nothing to do, the virtual clock jumps to
+#  the time at which the next task is due.
+#  @param tasks The task list, made by @c build()
+#  @param seconds How long to run, in seconds of virtual time
+#  @param edf @c True to schedule earliest deadline first
+#  @return The task list
+def run(tasks, seconds, edf=False):
+    tasks.idle_min = 0
+    tasks.idle_fun = lambda wait: utime.advance(1000 if wait is None
+                                                else wait + 1)
+    end = utime.now() + int(seconds * 1000000)
+    while utime.now() < end:
+        tasks.idle_sched(edf)
+    return tasks
+
+
+## Find each task's profile in a task list.
+#  @param tasks The task list
+#  @return A dictionary of tasks by name
+def tasks_by_name(tasks):
+    found = {task.name: task for pri in tasks.pri_list for task in pri[2:]}
+    for task in tasks._hw_tasks:
+        found[task.name] = task
+    return found
+
+
+## Parse NAME=VALUE command line settings into a dictionary.
+#  @param items The settings as given on the command line, or @c None
+#  @param convert A function which converts each value from a string
+#  @return A dictionary of converted values keyed by name
+def parse_settings(items, convert):
+    result = {}
+    for item in items or ():
+        name, value = item.split('=', 1)
+        result[name] = convert(value)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Simulate the task schedule of main.py.')
+    parser.add_argument('--seconds', type=float, default=60.0,
+                        help='virtual time to simulate (default 60)')
+    parser.add_argument('--edf', action='store_true',
+                        help='schedule earliest deadline first')
+    parser.add_argument('--period', action='append', metavar='NAME=MS',
+                        help='change a task period in milliseconds')
+    parser.add_argument('--priority', action='append', metavar='NAME=PRI',
+                        help='change a task priority')
+    parser.add_argument('--cost', action='append', metavar='NAME=US',
+                        help='set a task run time in microseconds')
+    args = parser.parse_args()
+
+    specs = main_tasks()
+    periods = parse_settings(args.period, float)
+    priorities = parse_settings(args.priority, int)
+    for spec in specs:
+        spec['period'] = periods.get(spec['name'], spec['period'])
+        spec['priority'] = priorities.get(spec['name'], spec['priority'])
+
+    start = time.perf_counter()
+    tasks = run(build(specs, parse_settings(args.cost, int)), args.seconds,
+                args.edf)
+    elapsed = time.perf_counter() - start
+    print(tasks)
+    print('Simulated {:.1f} s in {:.3f} s'.format(args.seconds, elapsed))
+
+
+if __name__ == '__main__':
+    main()
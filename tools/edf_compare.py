@@ -0,0 +1,81 @@
+## @file edf_compare.py
+#  Compares the worst-case lateness of the robot's tasks under priority
+#  scheduling and under earliest-deadline-first scheduling, on a PC.
+#
+#  The four tasks from @c main.py are given made-up but repeatable run
+#  times and run in the simulator in @c cosim.py, first with
+#  @c TaskList.idle_sched() choosing tasks by priority and then with it
+#  choosing by earliest deadline. The program prints both task tables and
+#  exits with an error unless EDF gives @c Control and @c Tracker a lower
+#  maximum lateness than priority scheduling does without giving any task
+#  more deadline misses. EDF makes the drive and event tasks later, though
+#  still within their periods, to let @c Control and @c Tracker run sooner.
+#
+#  Usage: @c python3 edf_compare.py [seconds_of_virtual_time]
+
+import sys
+
+import cosim
+
+## The tasks from @c main.py as (name, priority, period in ms, run time in
+#  microseconds, run time in microseconds of every tenth run). The drive
+#  task group runs both wheels' tasks and the drive train together. The run
+#  times keep the processor about 90% busy; with harmonic periods and a light
+#  load both schedulers run the tasks in the same order, so there's no
+#  difference.
+TASKS = (('Events', 4, 5, 200, 200),
+         ('Drive', 3, 5, 2500, 2500),
+         ('Control', 2, 10, 2500, 5000),
+         ('Tracker', 1, 20, 2000, 4000))
+
+## The tasks which earliest-deadline-first scheduling should make less late
+IMPROVED = ('Control', 'Tracker')
+
+
+## Run the task set with one scheduling mode.
+#  @param edf @c True for earliest deadline first, @c False for priority
+#  @param seconds How long to run, in seconds of virtual time
+#  @return The task list, holding the tasks' profiles
+def run(edf, seconds):
+    specs = [{'name': name, 'priority': priority, 'period': period,
+              'timer': None}
+             for name, priority, period, _, _ in TASKS]
+    costs = {name: (lambda run, cost=cost, slow=slow:
+                    slow if run % 10 == 9 else cost)
+             for name, _, _, cost, slow in TASKS}
+    return cosim.run(cosim.build(specs, costs), seconds, edf)
+
+
+## Find the worst lateness, in microseconds, and the number of deadline
+#  misses of each task in a list.
+#  @return A dictionary of (lateness, misses) tuples by task name
+def worst_lateness(tasks):
+    return {name: (task._latest, task._misses)
+            for name, task in cosim.tasks_by_name(tasks).items()}
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    results = []
+    for edf in (False, True):
+        tasks = run(edf, seconds)
+        print('EDF' if edf else 'Priority')
+        print(tasks)
+        results.append(worst_lateness(tasks))
+
+    failed = False
+    for name, _, _, _, _ in TASKS:
+        pri_late, pri_misses = results[0][name]
+        edf_late, edf_misses = results[1][name]
+        worse = edf_misses > pri_misses or \
+            (name in IMPROVED and edf_late >= pri_late)
+        failed = failed or worse
+        print('{:<10s} max late {:6d} us, {:4d} misses by priority, '
+              '{:6d} us, {:4d} misses by EDF  {:s}'
+              .format(name, pri_late, pri_misses, edf_late, edf_misses,
+                      'WORSE' if worse else 'ok'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+## @file encoder_check.py
+#  Checks on a PC the velocity estimators of @c Encoder against synthetic
+#  tick streams whose true velocity is known.
+#
+#  A stand-in timer's counter is moved as a wheel with a given velocity
+#  profile would move it, wrapping at 16 bits as the real counter does, and
+#  the encoder is updated every 5 ms, with some jitter, as the drive tasks
+#  update it. For each profile and estimator the program prints the RMS and
+#  largest error of the estimated velocity in ticks per second, ignoring
+#  the first samples while the window fills. It exits with an error if, on
+#  a profile where smoothing should help, an estimator other than
+#  @c VEL_DIFF is no better than @c VEL_DIFF, or if an estimator doesn't
+#  settle to the true speed of a steady profile.
+#
+#  It then checks extended mode by stalling the updates for longer than the
+#  counter takes to wrap around, setting the timer's update flag and
+#  direction bit and calling its callback as the real update interrupt
+#  would at each wrap. The extended encoder must keep the exact position
+#  through the stall, where a plain one loses ticks, even when the interrupt
+#  is serviced so late that the counter is over halfway round, and when the
+#  position is captured while the interrupt is waiting. Last,
+#  positions looked up in an encoder's history at times between updates
+#  must lie within two ticks (one for the count's resolution, one for
+#  rounding) of the true positions at those times.
+#
+#  Usage: @c python3 encoder_check.py [seconds_of_virtual_time]
+
+import math
+import random
+import sys
+
+import host
+import stm
+import utime
+from Encoder import (Encoder, VEL_DIFF, VEL_LSQ, VEL_ADAPTIVE,
+                     VEL_PERIOD)
+
+## Period between encoder updates in microseconds, as for the drive tasks
+UPDATE_US = 5000
+
+## Largest jitter in the update times in microseconds
+JITTER_US = 300
+
+## Samples ignored at the start of each run while the window fills
+SETTLE = 20
+
+## The estimators checked, by name
+ESTIMATORS = (('diff', VEL_DIFF), ('lsq', VEL_LSQ),
+              ('adaptive', VEL_ADAPTIVE), ('period', VEL_PERIOD))
+
+
+## Velocity profiles in ticks per second, as functions of time in seconds.
+#  Each is given with the estimators which must beat @c VEL_DIFF on it and
+#  whether it's steady enough that every estimator must settle to it.
+PROFILES = (
+    ('cruise', lambda t: 3000.0, ('lsq', 'adaptive'), True),
+    ('slow', lambda t: 60.0, ('adaptive', 'period'), True),
+    ('ramp', lambda t: 4000.0 * min(t, 1.0), ('lsq', 'adaptive'), False),
+    # Fast reversals show the smoothing estimators' lag, so nothing must win
+    ('reverse', lambda t: 2500.0 * math.cos(2 * math.pi * t), (), False),
+)
+
+
+## Run one encoder on a velocity profile and compare its estimates.
+#  @param profile A function giving the velocity at a time in seconds
+#  @param estimator The estimator to use
+#  @param seconds How long to run, in seconds of virtual time
+#  @return A tuple of the RMS and largest errors and the mean error over
+#          the last quarter of the run
+def run(profile, estimator, seconds):
+    rng = random.Random(1)
+    utime.set_time(0)
+    encoder = Encoder(1, None, None, estimator=estimator)
+    timer = encoder.tim
+    position = 0.0
+    now = 0
+    errors = []
+    steps = int(seconds * 1000000 / UPDATE_US)
+    for step in range(steps):
+        gap = UPDATE_US + rng.randint(-JITTER_US, JITTER_US)
+
+        # Integrate the profile in small steps to move the counter
+        for sub in range(10):
+            position += profile((now + gap * (sub + 0.5) / 10) / 1e6) \
+                * gap / 10 / 1e6
+        now += gap
+        utime.set_time(now)
+        timer.counter(int(math.floor(position)) & 0xFFFF)
+        encoder.update()
+        if step >= SETTLE:
+            errors.append(encoder.get_velocity() - profile(now / 1e6))
+
+    rms = math.sqrt(sum(err * err for err in errors) / len(errors))
+    tail = errors[-len(errors) // 4:]
+    return (rms, max(abs(err) for err in errors), sum(tail) / len(tail))
+
+
+## Run an encoder through a stall at a high speed.
+#  @param extended Whether to use the encoder's extended mode
+#  @param lag The number of counter steps by which servicing the update
+#         interrupt lags each wrap
+#  @return A tuple of the error in ticks of the position kept by
+#          @c update() after the stall and the largest error of a position
+#          read by @c capture(), which in extended mode is called at every
+#          step while the interrupt waits
+def stall(extended, lag=0):
+    utime.set_time(0)
+    cr1 = stm.TIM1 + stm.TIM_CR1
+    sr = stm.TIM1 + stm.TIM_SR
+    stm.mem16[cr1] = stm.mem16[sr] = 0
+    encoder = Encoder(1, None, None, extended=extended)
+    timer = encoder.tim
+    position = 0
+    waiting = None
+    worst = 0
+    for speed, steps in ((7, 20000), (-11, 20000), (5, 1)):
+        stm.mem16[cr1] = 0x10 if speed < 0 else 0
+        for _ in range(steps):
+            count = (position + speed) & 0xFFFF
+            wrapped = (speed > 0 and count < position & 0xFFFF) or \
+                (speed < 0 and count > position & 0xFFFF)
+            position += speed
+            timer.counter(count)
+            if wrapped:
+                stm.mem16[sr] = 1
+                waiting = lag
+            if waiting is not None:
+                if extended:
+                    worst = max(worst, abs(encoder.capture() - position))
+                if waiting == 0:
+                    stm.mem16[sr] = 0
+                    if timer._callback is not None:
+                        timer._callback(timer)
+                    waiting = None
+                else:
+                    waiting -= 1
+
+        # Nothing can tell which way a wrap went if the wheel turns back
+        # before its interrupt is serviced, so it's serviced first
+        if waiting is not None:
+            stm.mem16[sr] = 0
+            if timer._callback is not None:
+                timer._callback(timer)
+            waiting = None
+
+        # Only update between the long runs
+        encoder.update()
+    return (encoder.position - position,
+            max(worst, abs(encoder.capture() - position)))
+
+
+## Look up positions in an encoder's history on a velocity profile.
+#  @param profile A function giving the velocity at a time in seconds
+#  @return The largest error in ticks of a looked up position, over times
+#          from 10 to 70 ms before the last update
+def lookup(profile):
+    utime.set_time(0)
+    encoder = Encoder(1, None, None, history=16)
+    timer = encoder.tim
+    position = 0.0
+    truth = []
+    for step in range(40):
+        for sub in range(10):
+            position += profile((step * UPDATE_US + UPDATE_US * (sub + 0.5)
+                                 / 10) / 1e6) * UPDATE_US / 10 / 1e6
+            truth.append(((step * UPDATE_US + UPDATE_US * (sub + 1) / 10),
+                          position))
+        utime.set_time((step + 1) * UPDATE_US)
+        timer.counter(int(math.floor(position)) & 0xFFFF)
+        encoder.update()
+    now = 40 * UPDATE_US
+    return max(abs(encoder.position_at(int(when)) - where)
+               for when, where in truth if 10000 <= now - when <= 70000)
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    failed = False
+    print('{:<10s}{:<10s}{:>10s}{:>10s}{:>10s}'.format(
+        'PROFILE', 'ESTIMATOR', 'RMS', 'MAX', 'BIAS'))
+    for name, profile, better, steady in PROFILES:
+        results = {}
+        for est_name, estimator in ESTIMATORS:
+            rms, worst, bias = run(profile, estimator, seconds)
+            results[est_name] = rms
+            print('{:<10s}{:<10s}{:10.1f}{:10.1f}{:10.1f}'.format(
+                name, est_name, rms, worst, bias))
+
+            # A steady speed should be found to within a few percent
+            if steady and abs(bias) > 0.05 * abs(profile(0)) + 2:
+                print('  {} is biased on {}'.format(est_name, name))
+                failed = True
+        for est_name in better:
+            if results[est_name] >= results['diff']:
+                print('  {} is no better than diff on {}'.format(est_name,
+                                                                  name))
+                failed = True
+
+    for mode, extended, lag in (('plain', False, 0), ('extended', True, 0),
+                                ('late isr', True, 5000)):
+        error, captured = stall(extended, lag)
+        print('{:<10s}{:<10s}{:>10d}{:>10d}'.format(
+            'stall', mode, error, captured))
+        if extended and (error or captured):
+            print('  extended mode lost ticks in a stall')
+            failed = True
+
+    for name, profile, better, steady in PROFILES:
+        error = lookup(profile)
+        print('{:<10s}{:<10s}{:10.1f}'.format(name, 'history', error))
+        if error > 2:
+            print('  history lookup is off on {}'.format(name))
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
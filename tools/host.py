@@ -0,0 +1,31 @@
+## @file host.py
+#  This file prepares a desktop Python interpreter to run the robot's code.
+#
+#  Importing this module puts the stand-in modules in @c tools/stubs and the
+#  robot's source directory @c src onto the module search path, so that
+#  @c cotask, @c task_share and friends can be imported on a PC. It works
+#  with CPython and with the MicroPython unix port; the latter already has
+#  real @c utime and @c micropython modules, so only the @c pyb stand-in is
+#  used there.
+#
+#  @b Example:
+#  @code
+#  import host                 # Must come before importing robot modules
+#  import cotask
+#  @endcode
+
+import sys
+
+# Work out paths from this file's location without needing os.path, which
+# the MicroPython unix port doesn't have
+_here = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+
+## The directory which holds the stand-in modules
+STUB_DIR = _here + '/stubs'
+
+## The directory which holds the robot's source code
+SRC_DIR = _here + '/../src'
+
+for _path in (SRC_DIR, STUB_DIR):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
@@ -0,0 +1,192 @@
+## @file profile_decode.py
+#  Decodes binary profiles made by @c cotask.TaskList.snapshot().
+#
+#  Each profile is shown as the table printed by @c TaskList.__repr__(), or
+#  with @c --csv as comma separated values, one row per task per profile,
+#  for plotting. Anything between profiles, such as REPL text sent over the
+#  same UART, is skipped. With @c --follow the file is read as it grows, so
+#  the profiles sent by @c TaskList.profile_task() over a serial port can be
+#  watched live, for example from @c /dev/rfcomm0 or @c /dev/ttyACM0.
+#
+#  Usage: @c python3 profile_decode.py [--csv] [--follow] profile_file
+
+import struct
+import sys
+import time
+
+import host
+import cotask
+
+## The size in bytes of a profile's header
+HEAD_SIZE = struct.calcsize(cotask.PROFILE_HEADER)
+
+## The size in bytes of each task's part of a profile
+TASK_SIZE = cotask.PROFILE_NAME + struct.calcsize(cotask.PROFILE_RECORD)
+
+## The names of each task's fields, in the order in which they're packed
+FIELDS = ('priority', 'flags', 'period', 'runs', 'avg_dur', 'dur_p50',
+          'dur_p95', 'dur_p99', 'max_dur', 'avg_late', 'late_p50',
+          'late_p95', 'late_p99', 'max_late', 'misses', 'sheds', 'avg_mem',
+          'max_mem', 'gcs')
+
+# The table heading used by TaskList.__repr__()
+_HEADING = 'TASK             PRI    PERIOD    RUNS   AVG DUR     P50' \
+    '     P95     P99   MAX DUR  AVG LATE     P50     P95     P99' \
+    '  MAX LATE  MISSES  SHED   B/RUN   MAX B   GCS'
+
+# The column of the table at which the memory profile begins
+_MEM_COLUMN = _HEADING.index('   B/RUN')
+
+
+## Decode as many complete profiles as a block of data holds.
+#  @param data Bytes holding profiles, perhaps with other data between
+#  @return A tuple holding a list of profiles and the number of bytes used.
+#          Each profile is a dictionary of the header's fields, with the
+#          key @c tasks holding a list of dictionaries, one per task. Bytes
+#          after the last complete profile aren't used.
+def decode(data):
+    profiles = []
+    pos = 0
+    while True:
+        start = data.find(b'CPRF', pos)
+        if start < 0:
+            # Keep a partial magic number which may be completed later
+            return (profiles, max(pos, len(data) - 3))
+        if start + HEAD_SIZE > len(data):
+            return (profiles, start)
+        magic, count, ticks, idle, gc_runs, gc_avg, gc_max = \
+            struct.unpack_from(cotask.PROFILE_HEADER, data, start)
+        end = start + HEAD_SIZE + count * TASK_SIZE
+        if end > len(data):
+            return (profiles, start)
+
+        tasks = []
+        offset = start + HEAD_SIZE
+        for _ in range(count):
+            name = bytes(data[offset:offset + cotask.PROFILE_NAME])
+            task = dict(zip(FIELDS, struct.unpack_from(
+                cotask.PROFILE_RECORD, data, offset + cotask.PROFILE_NAME)))
+            task['name'] = name.rstrip(b'\0').decode('utf-8', 'replace')
+            tasks.append(task)
+            offset += TASK_SIZE
+
+        profiles.append({'ticks': ticks,
+                         'idle': None if idle == 0xFFFF else idle / 10.0,
+                         'gc_runs': gc_runs, 'gc_avg': gc_avg,
+                         'gc_max': gc_max, 'tasks': tasks})
+        pos = end
+
+
+## Make one row of the task table, as @c Task.__repr__() does.
+#  @param task A dictionary of a task's fields
+#  @return The row of text
+def task_row(task):
+    row = '{:<16s}{: 4d}'.format(task['name'], task['priority'])
+    if task['flags'] & 2:
+        row += '{: 10.1f}'.format(task['period'] / 1000.0)
+    else:
+        row += '         -'
+    row += '{: 8d}'.format(task['runs'])
+
+    if task['flags'] & 1 and task['runs'] > 0:
+        row += '{: 10.3f}'.format(task['avg_dur'] / 1000.0)
+        for key in ('dur_p50', 'dur_p95', 'dur_p99'):
+            row += '{: 8.1f}'.format(task[key] / 1000.0)
+        row += '{: 10.3f}'.format(task['max_dur'] / 1000.0)
+        if task['flags'] & 2:
+            row += '{: 10.3f}'.format(task['avg_late'] / 1000.0)
+            for key in ('late_p50', 'late_p95', 'late_p99'):
+                row += '{: 8.1f}'.format(task[key] / 1000.0)
+            row += '{: 10.3f}{: 8d}{: 6d}'.format(task['max_late'] / 1000.0,
+                                                  task['misses'],
+                                                  task['sheds'])
+    if task['flags'] & 8:
+        row += ' ' * (_MEM_COLUMN - len(row))
+        row += '{: 8d}{: 8d}{: 6d}'.format(task['avg_mem'], task['max_mem'],
+                                          task['gcs'])
+    return row
+
+
+## Make the table printed by @c TaskList.__repr__() from a profile.
+#  @param profile A profile as returned by @c decode()
+#  @return The table as text
+def table(profile):
+    lines = [_HEADING]
+    for task in profile['tasks']:
+        lines.append(task_row(task))
+    if profile['idle'] is not None:
+        lines.append('IDLE {: 6.1f}%'.format(profile['idle']))
+    if profile['gc_runs'] > 0:
+        lines.append('{:<20s}{: 18d}{: 10.3f}{: 34.3f}'.format(
+            'GC', profile['gc_runs'], profile['gc_avg'] / 1000.0,
+            profile['gc_max'] / 1000.0))
+    return '\n'.join(lines) + '\n'
+
+
+## Turns the tick counts of successive profiles into seconds since the
+#  first, allowing for the tick counter wrapping around.
+class Clock:
+    def __init__(self):
+        self._last = None
+        self._total = 0
+
+    ## Find the time of a profile.
+    #  @param ticks The profile's tick count
+    #  @return Seconds since the first profile
+    def seconds(self, ticks):
+        if self._last is not None:
+            self._total += (ticks - self._last) % (1 << 30)
+        self._last = ticks
+        return self._total / 1000000.0
+
+
+## Make comma separated rows, one per task, from a profile.
+#  @param profile A profile as returned by @c decode()
+#  @param clock The @c Clock used to find the profile's time
+#  @return A list of rows of text
+def csv_rows(profile, clock):
+    seconds = clock.seconds(profile['ticks'])
+    idle = '' if profile['idle'] is None else '{:.1f}'.format(profile['idle'])
+    rows = []
+    for task in profile['tasks']:
+        rows.append(','.join(['{:.6f}'.format(seconds), task['name']]
+                             + [str(task[key]) for key in FIELDS]
+                             + [idle]))
+    return rows
+
+
+def main():
+    args = sys.argv[1:]
+    use_csv = '--csv' in args
+    follow = '--follow' in args
+    paths = [arg for arg in args if not arg.startswith('--')]
+    if len(paths) != 1:
+        print('Usage: python3 profile_decode.py [--csv] [--follow] file')
+        sys.exit(2)
+
+    clock = Clock()
+    if use_csv:
+        print(','.join(('seconds', 'name') + FIELDS + ('idle_pct',)))
+
+    data = b''
+    with open(paths[0], 'rb', buffering=0) as src:
+        while True:
+            more = src.read(4096)
+            if not more:
+                if not follow:
+                    break
+                time.sleep(0.05)
+                continue
+            data += more
+            profiles, used = decode(data)
+            data = data[used:]
+            for profile in profiles:
+                if use_csv:
+                    print('\n'.join(csv_rows(profile, clock)))
+                else:
+                    print(table(profile))
+                sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+## @file queue_check.py
+#  Checks on a PC that the queue calls which never wait behave as documented.
+#
+#  A small queue is filled, emptied and wrapped around with @c try_put(),
+#  @c try_get(), @c put_many(), @c get_many(), @c window() and
+#  @c consume(), with and without @c overwrite and @c thread_protect, and
+#  the items which come out are compared with those which went in. Reading
+#  an empty queue with @c try_get() must give back its @c empty value at
+#  once rather than waiting as @c get() would. The program prints each
+#  check and exits with an error if any of them fails.
+#
+#  Usage: @c python3 queue_check.py
+
+import array
+import sys
+
+import host
+import pyb
+import task_share
+
+## The number of items which the queues made for the checks can hold
+SIZE = 5
+
+
+## Take every item out of a queue with @c try_get().
+#  @param queue The queue to empty
+#  @return A list of the items, oldest first
+def drain(queue):
+    items = []
+    while True:
+        item = queue.try_get()
+        if item is None:
+            return items
+        items.append(item)
+
+
+## Check the single item calls on a queue.
+#  @param protect The queue's @c thread_protect setting
+#  @return A list of (name, passed) tuples
+def check_single(protect):
+    results = []
+    queue = task_share.Queue('h', SIZE, thread_protect=protect)
+    results.append(('try_get empty gives None', queue.try_get() is None))
+    results.append(('try_get empty gives sentinel',
+                    queue.try_get(empty=-1) == -1))
+
+    stored = [queue.try_put(item) for item in range(SIZE + 2)]
+    results.append(('try_put stops when full',
+                    stored == [True] * SIZE + [False, False]))
+    results.append(('try_get reads oldest first',
+                    drain(queue) == list(range(SIZE))))
+    results.append(('try_get leaves queue empty',
+                    queue.empty() and queue.try_get() is None))
+
+    # Go round the buffer a few times, one item in and one out
+    ok = True
+    for item in range(3 * SIZE):
+        queue.try_put(item)
+        ok = ok and queue.try_get() == item
+    results.append(('try_get wraps around', ok and queue.empty()))
+
+    # A zero must come back as an item, not be taken for an empty queue
+    queue.try_put(0)
+    results.append(('try_get returns a zero item',
+                    queue.try_get(empty=-1) == 0 and queue.empty()))
+
+    results.append(('interrupts enabled afterwards', pyb._irq_enabled))
+    return results
+
+
+## Check the overwriting and block calls on a queue.
+#  @param protect The queue's @c thread_protect setting
+#  @return A list of (name, passed) tuples
+def check_blocks(protect):
+    results = []
+    queue = task_share.Queue('h', SIZE, thread_protect=protect,
+                             overwrite=True)
+    for item in range(SIZE + 3):
+        queue.try_put(item)
+    results.append(('try_put overwrites oldest',
+                    drain(queue) == list(range(3, SIZE + 3))))
+
+    queue = task_share.Queue('h', SIZE, thread_protect=protect)
+    queue.try_put(100)
+    queue.try_get()
+    sent = queue.put_many(array.array('h', range(SIZE + 2)))
+    buf = array.array('h', [0] * (SIZE + 2))
+    got = queue.get_many(buf)
+    results.append(('put_many and get_many wrap around',
+                    sent == SIZE and got == SIZE
+                    and list(buf[:got]) == list(range(SIZE))))
+
+    queue.put_many(array.array('h', range(10, 13)))
+    queue.try_get()
+    queue.put_many(array.array('h', range(13, 16)))
+    seen = []
+    while True:
+        window = queue.window()
+        if not window:
+            break
+        seen.extend(window)
+        queue.consume(len(window))
+    results.append(('window and consume see every item',
+                    seen == list(range(11, 16)) and queue.empty()))
+
+    results.append(('interrupts enabled afterwards', pyb._irq_enabled))
+    return results
+
+
+def main():
+    failed = False
+    for protect in (False, True):
+        for name, passed in check_single(protect) + check_blocks(protect):
+            failed = failed or not passed
+            print('{:<36s} {:<10s} {:s}'.format(
+                name, 'protected' if protect else 'plain',
+                'ok' if passed else 'FAILED'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
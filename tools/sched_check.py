@@ -0,0 +1,154 @@
+## @file sched_check.py
+#  Checks offline whether a saved task set can meet its deadlines.
+#
+#  The task periods and measured run times are read from a saved profile,
+#  either a binary profile stream sent by @c TaskList.profile_task() or the
+#  text printed by @c print(cotask.task_list); the last profile in the file
+#  is used. Periods, priorities and run times can then be changed on the
+#  command line to try out a new schedule before flashing the robot, and the
+#  analysis in @c src/schedcheck.py is run on the result. The program exits
+#  with an error if the tasks aren't schedulable by the chosen scheduler.
+#
+#  With @c --check, no profile is read; instead a timed task is made untimed
+#  with @c set_period(None) while the simulator in @c cosim.py runs it, by
+#  priority and by earliest deadline. The program exits with an error if
+#  either scheduler fails, keeps releasing the task on its old period or
+#  doesn't run it when @c go() is called.
+#
+#  @b Example:
+#  @code
+#  python3 sched_check.py run.bin --period Tracker=30 --cost Control=2500
+#  python3 sched_check.py --check
+#  @endcode
+
+import argparse
+import sys
+
+import host
+import schedcheck
+import profile_decode
+import cosim
+from cosim import parse_settings
+
+
+## Read the tasks from the text printed for a task list.
+#  @param text The text of one or more task tables
+#  @return A list of task dictionaries as used by @c schedcheck, from the
+#          last table in the text
+def parse_table(text):
+    tasks = []
+    for line in text.splitlines():
+        if line.startswith('TASK '):
+            tasks = []
+            continue
+        fields = line[16:].split()
+        if len(fields) < 8 or line.startswith(('IDLE', 'GC')):
+            continue
+        tasks.append({'name': line[:16].strip(), 'priority': int(fields[0]),
+                      'period': None if fields[1] == '-'
+                      else int(float(fields[1]) * 1000),
+                      'avg': int(float(fields[3]) * 1000),
+                      'wcet': int(float(fields[7]) * 1000), 'hw': False})
+    return tasks
+
+
+## Read the tasks from a saved profile.
+#  @param path The file holding a binary profile stream or a text table
+#  @return A list of task dictionaries as used by @c schedcheck
+def load(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    profiles, _ = profile_decode.decode(data)
+    if not profiles:
+        return parse_table(data.decode('utf-8', 'replace'))
+    return [{'name': task['name'], 'priority': task['priority'],
+             'period': task['period'] if task['flags'] & 2 else None,
+             'avg': task['avg_dur'], 'wcet': task['max_dur'],
+             'hw': bool(task['flags'] & 4)}
+            for task in profiles[-1]['tasks']]
+
+
+## Check that the schedulers cope with a timed task being made untimed.
+#  @return @c True if every check passed
+def check():
+    passed = True
+    for edf in (False, True):
+        specs = [{'name': name, 'priority': priority, 'period': period,
+                  'timer': None}
+                 for name, priority, period in (('Fast', 2, 5),
+                                                ('Slow', 1, 10))]
+        tasks = cosim.build(specs, {'Fast': 500, 'Slow': 1000})
+        named = cosim.tasks_by_name(tasks)
+        fast, slow = named['Fast'], named['Slow']
+
+        # Stop the slow task's timer between its releases, then run long
+        # enough for the old period to have come round many times
+        cosim.run(tasks, 0.1, edf)
+        slow.set_period(None)
+        before = slow._runs
+        fast_before = fast._runs
+        problem = None
+        try:
+            cosim.run(tasks, 0.2, edf)
+            if slow._runs > before + 1:
+                problem = 'still released {:d} times'.format(
+                    slow._runs - before)
+            elif fast._runs - fast_before < 39:
+                problem = 'Fast ran only {:d} times'.format(
+                    fast._runs - fast_before)
+            elif slow in tasks._timers:
+                problem = 'left in the heap of timers'
+            else:
+                # Once untimed, the task runs only when asked to
+                before = slow._runs
+                slow.go()
+                cosim.run(tasks, 0.01, edf)
+                if slow._runs != before + 1:
+                    problem = 'not run by go()'
+        except TypeError as err:
+            problem = 'raised TypeError: {:s}'.format(str(err))
+
+        passed = passed and problem is None
+        print('{:<9s} set_period(None)  {:s}'.format(
+            'EDF' if edf else 'Priority', problem or 'ok'))
+    return passed
+
+
+def main():
+    if sys.argv[1:] == ['--check']:
+        sys.exit(0 if check() else 1)
+
+    parser = argparse.ArgumentParser(
+        description='Check whether a saved task set is schedulable.')
+    parser.add_argument('profile', help='binary profile or task table file')
+    parser.add_argument('--edf', action='store_true',
+                        help='require schedulability by edf_sched')
+    parser.add_argument('--period', action='append', metavar='NAME=MS',
+                        help='change a task period in milliseconds')
+    parser.add_argument('--priority', action='append', metavar='NAME=PRI',
+                        help='change a task priority')
+    parser.add_argument('--cost', action='append', metavar='NAME=US',
+                        help='set a task\'s longest and average run time')
+    args = parser.parse_args()
+
+    tasks = load(args.profile)
+    if not tasks:
+        print('No task profile found in', args.profile)
+        sys.exit(2)
+    periods = parse_settings(args.period, float)
+    priorities = parse_settings(args.priority, int)
+    costs = parse_settings(args.cost, int)
+    for task in tasks:
+        if task['name'] in periods:
+            task['period'] = int(periods[task['name']] * 1000)
+        task['priority'] = priorities.get(task['name'], task['priority'])
+        if task['name'] in costs:
+            task['wcet'] = task['avg'] = costs[task['name']]
+
+    text, pri_ok, edf_ok = schedcheck.analyze(tasks)
+    print(text)
+    sys.exit(0 if (edf_ok if args.edf else pri_ok) else 1)
+
+
+if __name__ == '__main__':
+    main()
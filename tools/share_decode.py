@@ -0,0 +1,215 @@
+## @file share_decode.py
+#  Decodes share snapshots made by @c task_share.Snapshot.
+#
+#  A stream from @c Snapshot.task() holds layouts, which name each share and
+#  give the format of its value, and frames, which hold the values. Each
+#  frame is decoded with the most recent layout which has the same
+#  identifier; frames which arrive before their layout are skipped. Each
+#  frame is shown as one line of @c name=value pairs, or with @c --csv as
+#  comma separated values, one row per frame, for plotting. Anything between
+#  layouts and frames, such as REPL text sent over the same UART, is
+#  skipped. With @c --follow the file is read as it grows, so frames sent
+#  over a serial port can be watched live.
+#
+#  With @c --check, no file is read; instead a snapshot is taken of a few
+#  shares made here, including native @c 'l' shares and records such as the
+#  robot's @c 'LL' positions, and decoded again. The program exits with an
+#  error if any value doesn't come back as it was put.
+#
+#  Usage: @c python3 share_decode.py [--csv] [--follow] snapshot_file
+#  or @c python3 share_decode.py --check
+
+import struct
+import sys
+import time
+
+import host
+import task_share
+from profile_decode import Clock
+
+## The size in bytes of a layout's header
+LAYOUT_SIZE = struct.calcsize(task_share.LAYOUT_HEADER)
+
+## The size in bytes of a frame's header
+FRAME_SIZE = struct.calcsize(task_share.FRAME_HEADER)
+
+## The size in bytes of each share's part of a layout
+ENTRY_SIZE = 2 * task_share.LAYOUT_NAME
+
+
+## Decode the shares' names and formats from a layout.
+#  @param data Bytes holding the layout, beginning with its header
+#  @param start The position of the layout in @c data
+#  @return A tuple holding a dictionary with the keys @c ident, @c size and
+#          @c shares, a list of (name, format) pairs, and the position just
+#          after the layout; or @c None if the layout isn't all there
+def decode_layout(data, start):
+    if start + LAYOUT_SIZE > len(data):
+        return None
+    magic, count, size, ident = struct.unpack_from(
+        task_share.LAYOUT_HEADER, data, start)
+    end = start + LAYOUT_SIZE + count * ENTRY_SIZE
+    if end > len(data):
+        return None
+
+    shares = []
+    pos = start + LAYOUT_SIZE
+    for _ in range(count):
+        texts = []
+        for _ in range(2):
+            text = bytes(data[pos:pos + task_share.LAYOUT_NAME])
+            texts.append(text.rstrip(b'\0').decode('utf-8', 'replace'))
+            pos += task_share.LAYOUT_NAME
+        shares.append(tuple(texts))
+    return ({'ident': ident, 'size': size, 'shares': shares}, end)
+
+
+## Decode the values in a frame using its layout.
+#  @param layout The layout, as returned by @c decode_layout()
+#  @param data Bytes holding the frame
+#  @param start The position of the frame in @c data
+#  @return A dictionary with the keys @c ticks and @c values, a list of
+#          (name, value) pairs; a value with more than one field is a tuple
+def decode_frame(layout, data, start):
+    magic, ident, ticks = struct.unpack_from(task_share.FRAME_HEADER, data,
+                                             start)
+    values = []
+    pos = start + FRAME_SIZE
+    for name, fmt in layout['shares']:
+        value = struct.unpack_from(fmt, data, pos)
+        values.append((name, value[0] if len(value) == 1 else value))
+        pos += struct.calcsize(fmt)
+    return {'ticks': ticks, 'values': values}
+
+
+## Decode as many complete frames as a block of data holds.
+#  @param data Bytes holding layouts and frames, perhaps with other data
+#  @param layouts A dictionary of the layouts seen so far by identifier,
+#         which is updated with any new layouts found
+#  @return A tuple holding a list of frames, as returned by
+#          @c decode_frame(), and the number of bytes used. Bytes after the
+#          last complete layout or frame aren't used.
+def decode(data, layouts):
+    frames = []
+    pos = 0
+    while True:
+        lay = data.find(b'SLAY', pos)
+        frm = data.find(b'SFRM', pos)
+        starts = [start for start in (lay, frm) if start >= 0]
+        if not starts:
+            # Keep a partial magic number which may be completed later
+            return (frames, max(pos, len(data) - 3))
+        start = min(starts)
+
+        if start == lay:
+            found = decode_layout(data, start)
+            if found is None:
+                return (frames, start)
+            layout, pos = found
+            layouts[layout['ident']] = layout
+            continue
+
+        if start + FRAME_SIZE > len(data):
+            return (frames, start)
+        ident = struct.unpack_from(task_share.FRAME_HEADER, data, start)[1]
+        layout = layouts.get(ident)
+        if layout is None:
+            pos = start + 4
+            continue
+        if start + layout['size'] > len(data):
+            return (frames, start)
+        frames.append(decode_frame(layout, data, start))
+        pos = start + layout['size']
+
+
+## Show a value as text; records' fields are separated by spaces.
+#  @param value A value from a frame
+#  @return The value as text
+def show(value):
+    if isinstance(value, tuple):
+        return ' '.join(show(item) for item in value)
+    if isinstance(value, float):
+        return '{:.6g}'.format(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+## Check that a snapshot of some shares decodes to the values put in them.
+#  The shares are made here, so they're the only ones in the snapshot.
+#  @return @c True if every value came back as it was put
+def check():
+    count = task_share.Share('l', name='count')
+    count.put(-123456)
+    flag = task_share.Share('B', name='flag')
+    flag.put(200)
+    pos = task_share.RecordShare('LL', ('left', 'right'), name='pos')
+    pos.put(4000000000, 7)
+    mixed = task_share.RecordShare('Bf', ('mode', 'gain'), name='mixed')
+    mixed.put(3, 0.5)
+    queue = task_share.Queue('h', 4, name='queue')
+    queue.put(1)
+    queue.put(2)
+    expected = [('count', -123456), ('flag', 200), ('pos', (4000000000, 7)),
+                ('mixed', (3, 0.5)), ('queue', 2)]
+
+    snap = task_share.Snapshot()
+    snap.take()
+    layouts = {}
+    frames, _ = decode(snap.layout + bytes(snap.frame), layouts)
+    for name, fmt in layouts[snap.ident]['shares']:
+        print('{:<10s}{:s}'.format(name, fmt))
+    values = frames[0]['values'] if frames else []
+    for (name, value), (_, want) in zip(values, expected):
+        print('{:<10s}{:<24s}{:s}'.format(name, show(value),
+                                          'ok' if value == want else 'WRONG'))
+    return values == expected
+
+
+def main():
+    args = sys.argv[1:]
+    if args == ['--check']:
+        sys.exit(0 if check() else 1)
+    use_csv = '--csv' in args
+    follow = '--follow' in args
+    paths = [arg for arg in args if not arg.startswith('--')]
+    if len(paths) != 1:
+        print('Usage: python3 share_decode.py [--csv] [--follow] file')
+        print('   or: python3 share_decode.py --check')
+        sys.exit(2)
+
+    clock = Clock()
+    layouts = {}
+    heading = None
+
+    data = b''
+    with open(paths[0], 'rb', buffering=0) as src:
+        while True:
+            more = src.read(4096)
+            if not more:
+                if not follow:
+                    break
+                time.sleep(0.05)
+                continue
+            data += more
+            frames, used = decode(data, layouts)
+            data = data[used:]
+            for frame in frames:
+                seconds = clock.seconds(frame['ticks'])
+                if use_csv:
+                    names = [name for name, _ in frame['values']]
+                    if names != heading:
+                        heading = names
+                        print(','.join(['seconds'] + names))
+                    print(','.join(['{:.6f}'.format(seconds)]
+                                   + [show(value) for _, value
+                                      in frame['values']]))
+                else:
+                    print('{:10.3f} '.format(seconds) + ' '.join(
+                        '{}={}'.format(name, show(value))
+                        for name, value in frame['values']))
+                sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
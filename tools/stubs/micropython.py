@@ -0,0 +1,57 @@
+## @file micropython.py
+#  A stand-in for the @c micropython module for use on a PC. The code
+#  emitter decorators leave functions unchanged.
+
+
+## Stand-in for the native code emitter decorator.
+def native(fun):
+    return fun
+
+
+## Stand-in for the viper code emitter decorator.
+def viper(fun):
+    return fun
+
+
+## Stand-in for @c micropython.const(), which just returns its argument.
+def const(value):
+    return value
+
+
+## Stand-in which does nothing, as a PC needs no emergency buffer.
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+# Callbacks waiting to be run, as (function, argument) pairs
+_pending = []
+
+# True while a scheduled callback is running, as they don't nest
+_running = False
+
+## The number of callbacks which can wait to run, as on MicroPython ports.
+SCHEDULE_DEPTH = 4
+
+
+## Stand-in for scheduling a function to run soon.
+#  On MicroPython the function runs between two bytecodes of whatever code
+#  is running. Here, callbacks are run by @c run_scheduled(), which the
+#  stand-in timers call after each interrupt.
+def schedule(fun, arg):
+    if len(_pending) >= SCHEDULE_DEPTH:
+        raise RuntimeError('schedule queue full')
+    _pending.append((fun, arg))
+
+
+## Run the scheduled callbacks, unless one is already running.
+def run_scheduled():
+    global _running
+    if _running:
+        return
+    _running = True
+    try:
+        while _pending:
+            fun, arg = _pending.pop(0)
+            fun(arg)
+    finally:
+        _running = False
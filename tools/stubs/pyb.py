@@ -0,0 +1,135 @@
+## @file pyb.py
+#  A stand-in for the parts of the @c pyb module which the cooperative
+#  multitasking code uses, for use on a PC.
+
+import micropython
+import utime
+
+# Whether interrupts are enabled, tracked only so that disable_irq() and
+# enable_irq() return and accept the right values
+_irq_enabled = True
+
+
+## Stand-in for disabling interrupts.
+#  @return The previous interrupt state
+def disable_irq():
+    global _irq_enabled
+    state = _irq_enabled
+    _irq_enabled = False
+    return state
+
+
+## Stand-in for restoring interrupts.
+#  @param state The state returned by @c disable_irq()
+def enable_irq(state=True):
+    global _irq_enabled
+    _irq_enabled = state
+
+
+## Stand-in for waiting for an interrupt. On the PC the next interrupt is
+#  taken to be the one-millisecond system tick, so a virtual clock is moved
+#  on to the next millisecond and a real clock waits for up to a millisecond.
+def wfi():
+    if utime.now() is None:
+        utime.sleep_us(1000 - utime.ticks_us() % 1000)
+    else:
+        utime.set_time((utime.now() // 1000 + 1) * 1000)
+
+
+## A stand-in for a hardware timer.
+#  With the virtual clock, a timer's callback is called at each of its
+#  periods as the clock is moved forward, followed by any callbacks which
+#  it scheduled, so a task run by a timer interrupts a task which moves the
+#  clock forward in small steps as a real timer would. The counter and
+#  channels do nothing unless a program sets them.
+class Timer:
+
+    ## Timer mode constants, as in the real @c pyb.Timer
+    PWM = 0
+    ENC_AB = 1
+
+    ## Make a timer which counts at a given frequency or period.
+    #  @param num The timer number, used only for diagnostics
+    #  @param freq The frequency in Hz at which the callback is called
+    #  @param period The value at which the counter rolls over
+    #  @param prescaler Ignored
+    def __init__(self, num, freq=None, period=0xFFFF, prescaler=0):
+        self.num = num
+        self._freq = freq
+        self._period = period
+        self._counter = 0
+        self._callback = None
+        self._next = None
+
+        ## The number of times the callback has been called
+        self.fired = 0
+        utime.event_sources.append(self)
+
+    ## Set a function to be called, with this timer, at each period.
+    def callback(self, fun):
+        self._callback = fun
+        if fun is None or not self._freq:
+            self._next = None
+        else:
+            start = utime.now() or 0
+            self._next = start + 1000000 / self._freq
+
+    ## Return the virtual time of the next callback, or @c None.
+    def next_event(self):
+        return None if self._next is None else int(self._next)
+
+    ## Call the callback, then any callbacks it scheduled.
+    def handle_event(self):
+        self._next += 1000000 / self._freq
+        self.fired += 1
+        self._callback(self)
+        micropython.run_scheduled()
+
+    ## Stop the timer.
+    def deinit(self):
+        self._callback = None
+        self._next = None
+
+    ## Return or set the timer frequency.
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    ## Return or set the counter value.
+    def counter(self, value=None):
+        if value is None:
+            return self._counter
+        self._counter = value
+
+    ## Return or set the value at which the counter rolls over.
+    def period(self, value=None):
+        if value is None:
+            return self._period
+        self._period = value
+
+    ## Stand-in for configuring a timer channel; returns a channel object.
+    def channel(self, num, mode=None, pin=None, **kwargs):
+        return TimerChannel(self, num)
+
+
+## A stand-in for a timer channel, which remembers its last setting.
+class TimerChannel:
+
+    def __init__(self, timer, num):
+        self.timer = timer
+        self.num = num
+        self.width = 0
+        self.percent = 0
+
+    ## Set or return the pulse width in timer counts.
+    def pulse_width(self, value=None):
+        if value is None:
+            return self.width
+        self.width = value
+
+    ## Set or return the pulse width in percent of the period.
+    def pulse_width_percent(self, value=None):
+        if value is None:
+            return self.percent
+        self.percent = value
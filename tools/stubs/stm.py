@@ -0,0 +1,36 @@
+## @file stm.py
+#  A stand-in for the parts of the @c stm module which the encoder driver
+#  uses, for use on a PC. Memory is a dictionary of 16 bit registers, all
+#  zero until a program sets them, so a check can set a timer's direction
+#  bit or update flag as the hardware would.
+
+## Base addresses of the timers' registers, as on the STM32F4
+TIM1 = 0x40010000
+TIM2 = 0x40000000
+TIM3 = 0x40000400
+TIM4 = 0x40000800
+TIM5 = 0x40000C00
+TIM8 = 0x40010400
+
+## Offset of a timer's control register 1, which holds the DIR bit
+TIM_CR1 = 0x00
+
+## Offset of a timer's status register, which holds the update flag UIF
+TIM_SR = 0x10
+
+
+## Stand-in for a view of memory as 16 bit words.
+class _Memory:
+
+    def __init__(self):
+        self._words = {}
+
+    def __getitem__(self, addr):
+        return self._words.get(addr, 0)
+
+    def __setitem__(self, addr, value):
+        self._words[addr] = value & 0xFFFF
+
+
+## Memory seen as 16 bit words
+mem16 = _Memory()
@@ -0,0 +1,102 @@
+## @file utime.py
+#  A stand-in for MicroPython's @c utime module for use on a PC.
+#
+#  Tick counts wrap around at 2**30 as they do on MicroPython ports, so code
+#  which forgets to use @c ticks_diff() misbehaves here as it would on the
+#  robot. By default the ticks follow the PC's clock; calling @c set_time()
+#  switches to a virtual clock which only moves when @c set_time() or
+#  @c advance() is called.
+
+import time
+
+# Tick counters wrap around at this many counts, as on MicroPython ports
+_PERIOD = 1 << 30
+_MASK = _PERIOD - 1
+_HALF = _PERIOD >> 1
+
+# The virtual time in microseconds, or None to follow the real clock
+_virtual = None
+
+## Objects which make things happen at given virtual times, such as the
+#  stand-in hardware timers. Each has a method @c next_event() which returns
+#  the unwrapped virtual time of its next event or @c None, and a method
+#  @c handle_event() which makes that event happen.
+event_sources = []
+
+
+## Return a microsecond tick count.
+def ticks_us():
+    if _virtual is None:
+        return (time.perf_counter_ns() // 1000) & _MASK
+    return _virtual & _MASK
+
+
+## Return a millisecond tick count.
+def ticks_ms():
+    if _virtual is None:
+        return (time.perf_counter_ns() // 1000000) & _MASK
+    return (_virtual // 1000) & _MASK
+
+
+## Add a (possibly negative) delta to a tick count.
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _MASK
+
+
+## Find the signed difference between two tick counts, @c end - @c start.
+def ticks_diff(end, start):
+    return ((end - start + _HALF) & _MASK) - _HALF
+
+
+## Set the virtual clock to the given time in microseconds and use it.
+#  @param us The new time, in microseconds; it need not be wrapped
+def set_time(us):
+    global _virtual
+    _virtual = us
+
+
+## Move the virtual clock forward by the given number of microseconds.
+#  Events from the event sources which fall within the step happen in time
+#  order, each with the clock set to the time of the event.
+#  @param us The time step, in microseconds
+def advance(us):
+    global _virtual
+    if _virtual is None:
+        _virtual = 0
+    target = _virtual + us
+    while True:
+        first = None
+        for source in event_sources:
+            when = source.next_event()
+            if when is not None and when <= target and (
+                    first is None or when < first[0]):
+                first = (when, source)
+        if first is None:
+            break
+        _virtual = max(_virtual, first[0])
+        first[1].handle_event()
+    _virtual = max(_virtual, target)
+
+
+## Return the unwrapped virtual time in microseconds.
+def now():
+    return _virtual
+
+
+## Go back to following the PC's real clock.
+def use_real_clock():
+    global _virtual
+    _virtual = None
+
+
+## Wait for the given number of microseconds.
+def sleep_us(us):
+    if _virtual is None:
+        time.sleep(us / 1000000)
+    else:
+        advance(us)
+
+
+## Wait for the given number of milliseconds.
+def sleep_ms(ms):
+    sleep_us(ms * 1000)
@@ -0,0 +1,70 @@
+## @file timer_task_check.py
+#  Checks on a PC that a task run by a hardware timer keeps a fixed period
+#  while a slow cooperative task is running.
+#
+#  A 5 ms drive task runs alongside a 10 ms control task which sometimes
+#  takes 6 ms, moving the virtual clock forward 100 microseconds at a time
+#  as a stand-in for executing bytecodes. The drive task is run first by
+#  the scheduler and then by a stand-in hardware timer. The program prints
+#  the shortest and longest time between starts of the drive task in each
+#  case and exits with an error if, when run by the timer, its start times
+#  stray from the 5 ms period by more than one 100 microsecond step.
+#
+#  Usage: @c python3 timer_task_check.py [seconds_of_virtual_time]
+
+import sys
+
+import cosim
+import utime
+import cotask
+
+## Period of the drive task in milliseconds
+DRIVE_PERIOD = 5
+
+## Virtual time taken by one step of the slow task, in microseconds
+STEP_US = 100
+
+
+## Make the drive task's function, which records its start times.
+#  @param starts A list to which start times are appended
+def drive_task(starts):
+    def run():
+        while True:
+            starts.append(utime.now())
+            utime.advance(600)
+            yield 0
+    return run
+
+
+## Run the two tasks and return the times between the drive task's starts.
+#  @param timer A timer number for the drive task, or @c None
+#  @param seconds How long to run, in seconds of virtual time
+def run(timer, seconds):
+    starts = []
+    tasks = cosim.build([{'name': 'Control', 'priority': 2, 'period': 10,
+                          'timer': None}],
+                        {'Control': (1000, 1000, 1000, 1000, 6000)}, STEP_US)
+    tasks.append(cotask.Task(drive_task(starts), name='Drive', priority=3,
+                             period=DRIVE_PERIOD, profile=True, timer=timer))
+    cosim.run(tasks, seconds)
+    print(tasks)
+    return [b - a for a, b in zip(starts, starts[1:])]
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    period = DRIVE_PERIOD * 1000
+    failed = False
+    for timer in (None, 6):
+        gaps = run(timer, seconds)
+        error = max(abs(gap - period) for gap in gaps)
+        print('{:<10s} period {:6.0f} to {:6.0f} us, worst error {:5.0f} us\n'
+              .format('Scheduler' if timer is None else 'Timer',
+                      min(gaps), max(gaps), error))
+        if timer is not None and error > STEP_US:
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+## @file trace_decode.py
+#  Decodes transition traces written by @c cotask.Task.write_trace().
+#
+#  The output matches the text made by @c Task.get_trace(). Several traces
+#  written one after the other into the same file are decoded in turn.
+#
+#  Usage: @c python3 trace_decode.py trace_file
+
+import struct
+import sys
+
+import host
+import cotask
+
+# struct codes for unsigned and signed integers of each size in bytes
+_UNSIGNED = {4: 'I', 8: 'Q'}
+_SIGNED = {4: 'i', 8: 'q'}
+
+
+## Decode one or more binary traces into text.
+#  @param data The bytes written by one or more calls to @c write_trace()
+#  @return A list of strings, one per trace, in the style of @c get_trace()
+def decode(data):
+    traces = []
+    pos = 0
+    head_size = struct.calcsize(cotask.TRACE_HEADER)
+    while pos + head_size <= len(data):
+        magic, count, total, start, t_size, s_size = struct.unpack_from(
+            cotask.TRACE_HEADER, data, pos)
+        if magic != b'CTRC':
+            raise ValueError('No trace header at byte {:d}'.format(pos))
+        pos += head_size
+        times = struct.unpack_from('<{:d}{:s}'.format(
+            count, _UNSIGNED.get(t_size, 'I')), data, pos)
+        pos += count * t_size
+        states = struct.unpack_from('<{:d}{:s}'.format(
+            count, _SIGNED.get(s_size, 'i')), data, pos)
+        pos += count * s_size
+
+        lines = []
+        last_state = 0
+        first = 0
+        if total > count:
+            lines.append('  ({:d} earlier transitions lost)'.format(
+                total - count + 1))
+            last_state = states[0]
+            first = 1
+        for idx in range(first, count):
+            seconds = ((times[idx] - start) % (1 << 30)) / 1000000.0
+            lines.append('{: 12.6f}: {: 2d} -> {:d}'.format(
+                seconds, last_state, states[idx]))
+            last_state = states[idx]
+        traces.append('\n'.join(lines))
+    return traces
+
+
+def main():
+    with open(sys.argv[1], 'rb') as file:
+        for num, text in enumerate(decode(file.read())):
+            print('Trace {:d}:'.format(num))
+            print(text)
+
+
+if __name__ == '__main__':
+    main()